@@ -0,0 +1,224 @@
+import asyncio
+import re
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import (
+    FileResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+
+from app import settings
+from app.services.attachments import (
+    CHUNK_SIZE,
+    attachment_store,
+    parse_byte_range,
+)
+from app.services.metrics import metrics
+from app.services.session_tokens import (
+    SESSION_COOKIE,
+    session_tokens,
+)
+from app.services.storage import storage
+from app.services.transfer import EXPORT_FORMATS, export_messages
+from app.states.auth_state import ADMIN_EMAIL
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+DAY_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+# Attachments are only served to signed-in sessions, so shared caches
+# must not keep them.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Uploaded types the browser may render in place. Anything else (HTML, SVG,
+# scripts...) is served as a download so it cannot run on this origin.
+INLINE_CONTENT_TYPES = {
+    "image/png",
+    "image/jpeg",
+    "image/gif",
+    "image/webp",
+    "image/avif",
+}
+UNTRUSTED_CONTENT_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "sandbox",
+}
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+api = FastAPI()
+
+
+def _read_range(path: Path, start: int, end: int):
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _session_email(request: Request) -> str:
+    """Returns the email of the request's signed-in session, or raises 403."""
+    token = request.cookies.get(SESSION_COOKIE, "")
+    email = session_tokens.verify(token) if token else None
+    if email is None:
+        raise HTTPException(status_code=403)
+    return email
+
+
+async def _readable_attachment(
+    digest: str, request: Request
+) -> tuple[int, str]:
+    """Returns the (size, content type) of an attachment the session may read.
+
+    Only its uploader and the users it was posted to may read it; anyone
+    else gets the same 404 as for a digest that does not exist.
+    """
+    email = _session_email(request)
+    if not DIGEST_PATTERN.fullmatch(digest):
+        raise HTTPException(status_code=404)
+    info = await asyncio.to_thread(storage.load_attachment, digest)
+    if info is None or not await asyncio.to_thread(
+        storage.can_read_attachment, email, digest
+    ):
+        raise HTTPException(status_code=404)
+    return info
+
+
+@api.get("/files/{digest}")
+async def download_attachment(digest: str, request: Request):
+    """Serves an attachment to its readers, with single-range support and long-lived caching.
+
+    Only allowlisted image types are shown inline; everything else is a
+    sandboxed download whose type the browser must not sniff.
+    """
+    size, content_type = await _readable_attachment(
+        digest, request
+    )
+    if content_type not in INLINE_CONTENT_TYPES:
+        content_type = "application/octet-stream"
+    etag = f'"{digest}"'
+    headers = {
+        **UNTRUSTED_CONTENT_HEADERS,
+        "Content-Disposition": (
+            "inline"
+            if content_type in INLINE_CONTENT_TYPES
+            else f'attachment; filename="{digest[:16]}"'
+        ),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = attachment_store.path(digest)
+    range_header = request.headers.get("range")
+    if range_header is None:
+        return StreamingResponse(
+            _read_range(path, 0, size - 1),
+            media_type=content_type,
+            headers={
+                **headers,
+                "Content-Length": str(size),
+            },
+        )
+    byte_range = parse_byte_range(range_header, size)
+    if byte_range is None:
+        raise HTTPException(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    start, end = byte_range
+    return StreamingResponse(
+        _read_range(path, start, end),
+        status_code=206,
+        media_type=content_type,
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+        },
+    )
+
+
+@api.get("/files/{digest}/thumbnail")
+async def attachment_thumbnail(digest: str, request: Request):
+    """Serves a cached, downscaled JPEG of an image attachment to its readers."""
+    await _readable_attachment(digest, request)
+    thumbnail = await attachment_store.thumbnail(digest)
+    if thumbnail is None:
+        raise HTTPException(status_code=404)
+    return FileResponse(
+        thumbnail,
+        media_type="image/jpeg",
+        headers={
+            **UNTRUSTED_CONTENT_HEADERS,
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        },
+    )
+
+
+@api.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Exposes the process metrics in the Prometheus text format."""
+    if not settings.METRICS_ALLOW_REMOTE and (
+        request.client is None
+        or request.client.host not in LOOPBACK_HOSTS
+    ):
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(
+        metrics.exposition(), media_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+
+@api.get("/export/messages")
+async def export_message_history(
+    request: Request,
+    format: str = "ndjson",
+    user: str = "",
+    partner: str = "",
+    since: str = "",
+    until: str = "",
+):
+    """Streams message history as NDJSON or CSV (admin only).
+
+    Filters by a user's conversations (or one conversation with `partner`,
+    which needs `user`) and an inclusive range of UTC days; without filters
+    everything is exported. Rows are read and written as they are sent.
+    """
+    if _session_email(request) != ADMIN_EMAIL:
+        raise HTTPException(status_code=403)
+    if (
+        format not in EXPORT_FORMATS
+        or (partner and not user)
+        or any(
+            day and not DAY_PATTERN.fullmatch(day)
+            for day in (since, until)
+        )
+    ):
+        raise HTTPException(status_code=400)
+    name = re.sub(
+        r"[^\w.@-]",
+        "_",
+        "-".join(
+            part for part in ("messages", user, since, until) if part
+        ),
+    )
+    return StreamingResponse(
+        export_messages(
+            storage,
+            format,
+            user=user or None,
+            partner=partner or None,
+            since=since or None,
+            until=until or None,
+        ),
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}.{format}"'
+        },
+    )
@@ -1,36 +1,143 @@
-import reflex as rx
-from app.pages.login_page import login_page
-from app.pages.signup_page import signup_page
-from app.pages.chat_page import chat_page
-from app.states.auth_state import AuthState
-
-app = rx.App(
-    theme=rx.theme(appearance="light"),
-    stylesheets=[
-        "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap"
-    ],
-)
+from app.services.startup import startup_profiler
+import asyncio
+import contextlib
+import functools
+
+with startup_profiler.phase("import reflex"):
+    import reflex as rx
+with startup_profiler.phase("define states"):
+    from app.states.auth_state import AuthState
+    from app.states.chat_state import ChatState
+with startup_profiler.phase("import api"):
+    from app.api import api
+with startup_profiler.phase("import pages"):
+    from app.pages.login_page import login_page
+    from app.pages.signup_page import signup_page
+    from app.pages.chat_page import chat_page
+from app.services.archive import archiver
+from app.services.cluster import cluster
+from app.services.storage import storage
+from app.services.instrumentation import instrument_state
+from app.services.metrics import record_state_delta
+from app.services.passwords import password_hasher
+from app.services.session_tokens import session_tokens
+from app import settings
+
+
+@contextlib.asynccontextmanager
+async def storage_lifespan():
+    """Flushes queued writes and closes the database on shutdown."""
+    yield
+    await storage.close()
+
+
+@contextlib.asynccontextmanager
+async def cluster_lifespan():
+    """Joins the cross-worker bus for the life of this worker, when configured."""
+    if settings.BUS_SOCKET:
+        await cluster.start(
+            settings.BUS_SOCKET, settings.BUS_MAX_WORKERS
+        )
+    try:
+        yield
+    finally:
+        await cluster.stop()
+
+
+@contextlib.asynccontextmanager
+async def session_tokens_lifespan():
+    """Loads the session tokens revoked before this worker started."""
+    await session_tokens.load()
+    yield
+
+
+@contextlib.asynccontextmanager
+async def archive_lifespan():
+    """Periodically moves old messages to archive segments and applies retention."""
+    task = None
+    if settings.ARCHIVE_COMPACT_INTERVAL_S > 0:
+        task = asyncio.create_task(
+            archiver.run(settings.ARCHIVE_COMPACT_INTERVAL_S)
+        )
+    try:
+        yield
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+@contextlib.asynccontextmanager
+async def password_hasher_lifespan():
+    """Stops the bcrypt worker pool on shutdown."""
+    yield
+    password_hasher.shutdown()
+
+
+@contextlib.asynccontextmanager
+async def payload_metrics_lifespan(app: rx.App):
+    """Counts the bytes of every state delta sent to clients, when enabled."""
+    namespace = app.event_namespace
+    if settings.PAYLOAD_METRICS_ENABLED and namespace:
+        emit_update = namespace.emit_update
+
+        @functools.wraps(emit_update)
+        async def emit_update_with_metrics(
+            update, *args, **kwargs
+        ):
+            record_state_delta(update.delta)
+            return await emit_update(
+                update, *args, **kwargs
+            )
+
+        namespace.emit_update = emit_update_with_metrics
+    yield
+
+
+if settings.INSTRUMENTATION_ENABLED:
+    instrument_state(AuthState)
+    instrument_state(ChatState)
+with startup_profiler.phase("create app"):
+    app = rx.App(
+        theme=rx.theme(appearance="light"),
+        stylesheets=[
+            "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap"
+        ],
+        api_transformer=api,
+    )
+app.register_lifespan_task(storage_lifespan)
+app.register_lifespan_task(cluster_lifespan)
+app.register_lifespan_task(session_tokens_lifespan)
+app.register_lifespan_task(archive_lifespan)
+app.register_lifespan_task(password_hasher_lifespan)
+app.register_lifespan_task(payload_metrics_lifespan)
 app.style = {
     "font_family": "Inter, sans-serif",
     "background_color": rx.color("slate", 1),
 }
-app.add_page(
-    login_page,
-    route="/",
-    on_load=AuthState.redirect_if_logged_in,
-)
-app.add_page(
-    login_page,
-    route="/login",
-    on_load=AuthState.redirect_if_logged_in,
-)
-app.add_page(
-    signup_page,
-    route="/signup",
-    on_load=AuthState.redirect_if_logged_in,
-)
-app.add_page(
-    chat_page,
-    route="/chat",
-    on_load=AuthState.check_login_status,
-)
\ No newline at end of file
+with startup_profiler.phase("register pages"):
+    app.add_page(
+        login_page,
+        route="/",
+        on_load=AuthState.redirect_if_logged_in,
+    )
+    app.add_page(
+        login_page,
+        route="/login",
+        on_load=AuthState.redirect_if_logged_in,
+    )
+    app.add_page(
+        signup_page,
+        route="/signup",
+        on_load=AuthState.redirect_if_logged_in,
+    )
+    app.add_page(
+        chat_page,
+        route="/chat",
+        on_load=[
+            AuthState.check_login_status,
+            ChatState.load_latest_messages,
+            ChatState.listen_for_messages,
+            ChatState.load_admin_users,
+        ],
+    )
+startup_profiler.report()
@@ -1,54 +1,109 @@
 import reflex as rx
 from app.states.chat_state import ChatState
-from app.states.auth_state import (
-    AuthState,
-    DEFAULT_PROFILE_PIC,
-)
+from app import settings
 
+# Attachments are served by the backend API, which may be on another origin.
+BACKEND_URL = rx.config.get_config().api_url
 
-def message_item(
+
+def message_attachment(
     message: rx.Var[dict],
-    current_user_email: rx.Var[str | None],
 ) -> rx.Component:
-    """Displays a single chat message."""
-    is_sender = (
-        message["sender_email"] == current_user_email
+    """Displays an attached file: a cached thumbnail for images, a download link otherwise."""
+    file_url = message["file_url"].to_string()
+    download_url = f"{BACKEND_URL}{file_url.split('?')[0]}"
+    return rx.el.a(
+        rx.cond(
+            file_url.contains("kind=image"),
+            rx.el.img(
+                src=f"{download_url}/thumbnail",
+                alt=message["content"],
+                loading="lazy",
+                class_name="max-w-[240px] max-h-[240px] rounded-lg object-cover",
+            ),
+            rx.el.span(
+                rx.icon(tag="paperclip", class_name="w-4 h-4 mr-2"),
+                message["content"],
+                class_name="flex items-center px-4 py-2 rounded-lg bg-slate-100 text-slate-700 underline break-all",
+            ),
+        ),
+        href=download_url,
+        target="_blank",
+        rel="noopener",
     )
-    timestamp = message["timestamp"].to_string()
-    display_time = rx.cond(
-        timestamp.contains("T"),
-        timestamp.split("T")[1]
-        .split(".")[0]
-        .to_string()[0:5],
-        timestamp,
+
+
+def client_message_id_input(draft_id: rx.Var[str]) -> rx.Component:
+    """Hidden form field carrying the client message id of the form's draft.
+
+    The id lives in state, so a double click or a resend after reconnecting
+    submits the same one and the server answers with the message it first
+    sent. The state replaces it once a send is acknowledged.
+    """
+    return rx.el.input(
+        type="hidden",
+        name="client_message_id",
+        value=draft_id,
     )
+
+
+def broadcast_item(message: rx.Var[dict]) -> rx.Component:
+    """Displays an announcement sent to every user."""
     return rx.el.div(
+        rx.el.span(
+            "Announcement",
+            class_name="text-xs font-semibold uppercase tracking-wide text-amber-700",
+        ),
+        rx.el.p(
+            message["content"],
+            class_name="text-sm text-slate-700 break-words",
+        ),
+        rx.el.span(
+            message["time"],
+            class_name="text-xs text-slate-400",
+        ),
+        class_name="mb-3 mx-auto max-w-md px-4 py-2 rounded-lg bg-amber-50 border border-amber-200 text-center flex flex-col",
+    )
+
+
+def message_item(message: rx.Var[dict]) -> rx.Component:
+    """Displays a single chat message."""
+    is_sender = message["mine"]
+    return rx.cond(
+        message["broadcast"],
+        broadcast_item(message),
         rx.el.div(
-            rx.el.p(
-                message["content"],
-                class_name="px-4 py-2 rounded-lg inline-block max-w-xs md:max-w-md lg:max-w-lg break-words",
-                background_color=rx.cond(
-                    is_sender,
-                    rx.color("indigo", 6),
-                    rx.color("slate", 2),
+            rx.el.div(
+                rx.cond(
+                    message["file_url"] != "",
+                    message_attachment(message),
+                    rx.el.p(
+                        message["content"],
+                        class_name="px-4 py-2 rounded-lg inline-block max-w-xs md:max-w-md lg:max-w-lg break-words",
+                        background_color=rx.cond(
+                            is_sender,
+                            rx.color("indigo", 6),
+                            rx.color("slate", 2),
+                        ),
+                        color=rx.cond(
+                            is_sender,
+                            "white",
+                            rx.color("slate", 12),
+                        ),
+                    ),
+                ),
+                rx.el.span(
+                    message["time"],
+                    class_name="text-xs text-slate-400 ml-2 align-bottom",
                 ),
-                color=rx.cond(
+                class_name=rx.cond(
                     is_sender,
-                    "white",
-                    rx.color("slate", 12),
+                    "flex items-end justify-end flex-row-reverse",
+                    "flex items-end justify-start",
                 ),
             ),
-            rx.el.span(
-                display_time,
-                class_name="text-xs text-slate-400 ml-2 align-bottom",
-            ),
-            class_name=rx.cond(
-                is_sender,
-                "flex items-end justify-end flex-row-reverse",
-                "flex items-end justify-start",
-            ),
+            class_name="mb-3 w-full",
         ),
-        class_name="mb-3 w-full",
     )
 
 
@@ -57,36 +112,108 @@ def chat_area() -> rx.Component:
     return rx.el.div(
         rx.el.div(
             rx.el.img(
-                src=ChatState.current_chat_partner_profile_pic,
+                src=ChatState.chat_partner["profile_photo_src"],
                 class_name="w-10 h-10 rounded-full mr-3 object-cover border-2 border-slate-300",
             ),
-            rx.el.h2(
-                ChatState.current_chat_partner_name,
-                class_name="text-lg font-semibold text-slate-700",
+            rx.el.div(
+                rx.el.h2(
+                    ChatState.chat_partner["name"],
+                    class_name="text-lg font-semibold text-slate-700",
+                ),
+                rx.cond(
+                    ChatState.partner_typing,
+                    rx.el.span(
+                        "typing...",
+                        class_name="text-xs italic text-emerald-600",
+                    ),
+                ),
+                class_name="flex flex-col flex-grow",
+            ),
+            rx.cond(
+                ChatState.conversation_export_query != "",
+                rx.el.div(
+                    rx.el.span("Export:"),
+                    rx.el.a(
+                        "NDJSON",
+                        href=f"{BACKEND_URL}/export/messages?format=ndjson&"
+                        + ChatState.conversation_export_query,
+                        class_name="text-indigo-600 hover:text-indigo-700",
+                    ),
+                    rx.el.a(
+                        "CSV",
+                        href=f"{BACKEND_URL}/export/messages?format=csv&"
+                        + ChatState.conversation_export_query,
+                        class_name="text-indigo-600 hover:text-indigo-700",
+                    ),
+                    class_name="flex gap-2 text-xs text-slate-500",
+                ),
             ),
             class_name="flex items-center p-3 border-b border-slate-200 bg-slate-50 rounded-t-xl sticky top-0 z-10",
         ),
         rx.el.div(
             rx.el.div(
+                rx.cond(
+                    ChatState.has_older_messages,
+                    rx.el.button(
+                        "Load older messages",
+                        on_click=ChatState.load_older_messages,
+                        class_name="self-center text-sm text-indigo-600 hover:text-indigo-700 py-1 px-3 mb-2",
+                    ),
+                ),
+                rx.foreach(
+                    ChatState.displayed_messages, message_item
+                ),
                 rx.foreach(
-                    ChatState.displayed_messages,
-                    lambda msg: message_item(
-                        msg, AuthState.logged_in_user_email
+                    ChatState.recent_messages, message_item
+                ),
+                rx.cond(
+                    ChatState.last_message_seen,
+                    rx.el.span(
+                        "Seen",
+                        class_name="self-end text-xs text-slate-400 -mt-2",
+                    ),
+                ),
+                rx.cond(
+                    ChatState.has_newer_messages,
+                    rx.el.button(
+                        "Jump to latest",
+                        on_click=ChatState.load_latest_messages,
+                        class_name="self-center text-sm text-indigo-600 hover:text-indigo-700 py-1 px-3 mt-2",
                     ),
                 ),
                 id="message-list",
+                on_scroll=ChatState.mark_window_read.debounce(
+                    500
+                ),
                 class_name="flex-grow overflow-y-auto p-4 space-y-2",
             ),
             class_name="h-[calc(100vh-260px)] md:h-[calc(100vh-240px)] flex flex-col bg-white",
         ),
         rx.el.form(
+            client_message_id_input(ChatState.message_draft_id),
             rx.el.input(
                 placeholder="Type your message here...",
                 name="chat_message_content",
                 default_value=ChatState.current_message_input,
                 key=ChatState.current_message_input,
+                on_change=ChatState.user_typing.throttle(
+                    settings.TYPING_THROTTLE_MS
+                ),
                 class_name="flex-grow p-3 border border-slate-300 rounded-l-lg focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500 transition-colors text-slate-700 placeholder-slate-400 focus:outline-none",
             ),
+            rx.upload.root(
+                rx.el.button(
+                    rx.icon(tag="paperclip", class_name="w-5 h-5"),
+                    type="button",
+                    class_name="h-full px-3 text-slate-500 hover:text-indigo-600 border-y border-slate-300 bg-white transition-colors",
+                ),
+                id="chat_upload",
+                max_size=settings.ATTACHMENT_MAX_BYTES,
+                no_drag=True,
+                on_drop=ChatState.upload_attachment(
+                    rx.upload_files(upload_id="chat_upload")
+                ),
+            ),
             rx.el.button(
                 rx.icon(tag="send", class_name="w-5 h-5"),
                 type="submit",
@@ -105,22 +232,56 @@ def admin_user_list_item(
 ) -> rx.Component:
     """Displays an item in the admin's list of users."""
     return rx.el.div(
-        rx.el.img(
-            src=user["profile_photo_src"],
-            alt=user["name"],
-            class_name="w-10 h-10 rounded-full mr-3 object-cover",
+        rx.el.div(
+            rx.el.img(
+                src=user["profile_photo_src"],
+                alt=user["name"],
+                class_name="w-10 h-10 rounded-full object-cover",
+            ),
+            rx.cond(
+                ChatState.online_users.contains(user["email"]),
+                rx.el.span(
+                    class_name="absolute bottom-0 right-0 w-3 h-3 rounded-full bg-emerald-500 border-2 border-white",
+                ),
+            ),
+            class_name="relative mr-3 shrink-0",
         ),
         rx.el.div(
             rx.el.p(
                 user["name"],
                 class_name="font-semibold text-slate-700 truncate",
             ),
-            rx.el.p(
-                user["email"],
-                class_name="text-sm text-slate-500 truncate",
+            rx.cond(
+                ChatState.typing_users.contains(user["email"]),
+                rx.el.p(
+                    "typing...",
+                    class_name="text-sm italic text-emerald-600 truncate",
+                ),
+                rx.el.p(
+                    rx.cond(
+                        user["last_message"] != "",
+                        user["last_message"],
+                        user["email"],
+                    ),
+                    class_name="text-sm text-slate-500 truncate",
+                ),
             ),
             class_name="flex-grow min-w-0",
         ),
+        rx.el.div(
+            rx.el.span(
+                user["last_activity"],
+                class_name="text-xs text-slate-400",
+            ),
+            rx.cond(
+                user["unread"] != "0",
+                rx.el.span(
+                    user["unread"],
+                    class_name="mt-1 min-w-5 px-1.5 text-xs font-semibold text-white bg-indigo-600 rounded-full text-center",
+                ),
+            ),
+            class_name="flex flex-col items-end ml-2",
+        ),
         on_click=lambda: ChatState.select_user_to_chat(
             user["email"]
         ),
@@ -146,6 +307,113 @@ def admin_user_list_item(
     )
 
 
+def message_search_form() -> rx.Component:
+    """Admin form to search messages across all conversations."""
+    input_class = "w-full p-2 border border-slate-300 rounded-lg text-sm text-slate-700 placeholder-slate-400 focus:outline-none focus:ring-2 focus:ring-indigo-500"
+    return rx.el.form(
+        rx.el.input(
+            name="query",
+            placeholder="Search messages...",
+            class_name=input_class,
+        ),
+        rx.el.input(
+            name="sender",
+            type="email",
+            placeholder="Sender email (optional)",
+            class_name=input_class + " mt-2",
+        ),
+        rx.el.div(
+            rx.el.input(
+                name="since", type="date", class_name=input_class
+            ),
+            rx.el.input(
+                name="until", type="date", class_name=input_class
+            ),
+            class_name="flex gap-2 mt-2",
+        ),
+        rx.el.button(
+            "Search",
+            type="submit",
+            class_name="w-full mt-2 bg-indigo-600 hover:bg-indigo-700 text-white text-sm font-semibold py-2 rounded-lg transition-colors",
+        ),
+        on_submit=ChatState.search_messages,
+        reset_on_submit=False,
+        class_name="p-2 border-b border-slate-200",
+    )
+
+
+def broadcast_form() -> rx.Component:
+    """Admin form to send an announcement to every user."""
+    return rx.el.form(
+        client_message_id_input(ChatState.broadcast_draft_id),
+        rx.el.textarea(
+            name="broadcast_content",
+            placeholder="Announcement to all users...",
+            rows="2",
+            class_name="w-full p-2 border border-slate-300 rounded-lg text-sm text-slate-700 placeholder-slate-400 focus:outline-none focus:ring-2 focus:ring-amber-500",
+        ),
+        rx.el.button(
+            "Send to everyone",
+            type="submit",
+            class_name="w-full mt-2 bg-amber-600 hover:bg-amber-700 text-white text-sm font-semibold py-2 rounded-lg transition-colors",
+        ),
+        on_submit=ChatState.send_broadcast,
+        reset_on_submit=True,
+        class_name="p-2 border-b border-slate-200",
+    )
+
+
+def message_search_result_item(
+    result: rx.Var[dict],
+) -> rx.Component:
+    """Displays one message search hit; clicking it opens the conversation."""
+    return rx.el.div(
+        rx.el.div(
+            rx.el.span(
+                result["sender_name"],
+                class_name="font-semibold text-sm text-slate-700 truncate",
+            ),
+            rx.el.span(
+                result["time"],
+                class_name="text-xs text-slate-400 ml-2 shrink-0",
+            ),
+            class_name="flex justify-between",
+        ),
+        rx.el.p(
+            result["content"],
+            class_name="text-sm text-slate-500 line-clamp-2 break-words",
+        ),
+        on_click=lambda: ChatState.select_user_to_chat(
+            result["partner_email"]
+        ),
+        class_name="p-3 hover:bg-slate-100 cursor-pointer border-b border-slate-200 transition-colors rounded-lg mb-1",
+    )
+
+
+def message_search_results_panel() -> rx.Component:
+    """List of message search results with a control to close it."""
+    return rx.el.div(
+        rx.el.div(
+            rx.el.span(
+                ChatState.message_search_results.length(),
+                " results",
+                class_name="text-sm text-slate-500",
+            ),
+            rx.el.button(
+                "Clear",
+                on_click=ChatState.clear_message_search,
+                class_name="text-sm text-indigo-600 hover:text-indigo-700",
+            ),
+            class_name="flex items-center justify-between px-2 pb-2",
+        ),
+        rx.foreach(
+            ChatState.message_search_results,
+            message_search_result_item,
+        ),
+        class_name="overflow-y-auto p-2 flex-grow",
+    )
+
+
 def admin_dashboard_layout() -> rx.Component:
     """Layout for the admin's chat view, including user list and chat area."""
     return rx.el.div(
@@ -155,19 +423,77 @@ def admin_dashboard_layout() -> rx.Component:
                 class_name="text-xl font-semibold p-4 border-b border-slate-200 text-slate-700 sticky top-0 bg-slate-50 z-10",
             ),
             rx.el.div(
-                rx.cond(
-                    ChatState.get_chat_user_list_for_admin_view.length()
-                    > 0,
-                    rx.foreach(
-                        ChatState.get_chat_user_list_for_admin_view,
-                        admin_user_list_item,
+                rx.el.input(
+                    placeholder="Search by name or email...",
+                    default_value=ChatState.admin_user_query,
+                    on_change=ChatState.search_admin_users.debounce(
+                        300
                     ),
-                    rx.el.p(
-                        "No users to display yet.",
-                        class_name="p-4 text-slate-500 text-center",
+                    class_name="w-full p-2 border border-slate-300 rounded-lg text-sm text-slate-700 placeholder-slate-400 focus:outline-none focus:ring-2 focus:ring-indigo-500",
+                ),
+                rx.el.select(
+                    rx.el.option("Name", value="name"),
+                    rx.el.option(
+                        "Recent activity", value="recent"
+                    ),
+                    rx.el.option("Unread", value="unread"),
+                    value=ChatState.admin_user_sort,
+                    on_change=ChatState.set_admin_user_sort,
+                    class_name="w-full mt-2 p-2 border border-slate-300 rounded-lg text-sm text-slate-700 bg-white focus:outline-none focus:ring-2 focus:ring-indigo-500",
+                ),
+                class_name="p-2 border-b border-slate-200",
+            ),
+            broadcast_form(),
+            message_search_form(),
+            rx.cond(
+                ChatState.message_search_active,
+                message_search_results_panel(),
+                rx.fragment(
+                    rx.el.div(
+                        rx.cond(
+                            ChatState.admin_user_list.length() > 0,
+                            rx.foreach(
+                                ChatState.admin_user_list,
+                                admin_user_list_item,
+                            ),
+                            rx.el.p(
+                                "No users to display yet.",
+                                class_name="p-4 text-slate-500 text-center",
+                            ),
+                        ),
+                        class_name="overflow-y-auto p-2 flex-grow",
+                    ),
+                    rx.el.div(
+                        rx.el.button(
+                            rx.icon(
+                                tag="chevron_left", class_name="w-4 h-4"
+                            ),
+                            on_click=ChatState.change_admin_user_page(
+                                -1
+                            ),
+                            disabled=ChatState.admin_user_page == 0,
+                            class_name="p-1 rounded hover:bg-slate-200 disabled:opacity-40",
+                        ),
+                        rx.el.span(
+                            ChatState.admin_user_page + 1,
+                            " / ",
+                            ChatState.admin_user_page_count,
+                            class_name="text-sm text-slate-500",
+                        ),
+                        rx.el.button(
+                            rx.icon(
+                                tag="chevron_right", class_name="w-4 h-4"
+                            ),
+                            on_click=ChatState.change_admin_user_page(
+                                1
+                            ),
+                            disabled=ChatState.admin_user_page + 1
+                            >= ChatState.admin_user_page_count,
+                            class_name="p-1 rounded hover:bg-slate-200 disabled:opacity-40",
+                        ),
+                        class_name="flex items-center justify-between p-2 border-t border-slate-200",
                     ),
                 ),
-                class_name="overflow-y-auto p-2 flex-grow",
             ),
             class_name="w-full md:w-1/3 lg:w-1/4 bg-slate-50 border-r border-slate-200 flex flex-col rounded-l-xl h-full",
         ),
@@ -8,9 +8,31 @@ class User(TypedDict):
 
 
 class Message(TypedDict):
+    id: int
     sender_email: str
     receiver_email: str
     content: str
     timestamp: str
     is_read: bool
-    file_url: str | None
\ No newline at end of file
+    file_url: str | None
+
+
+class WireMessage(TypedDict):
+    """A message as rendered by the client for one viewer."""
+
+    id: int
+    # Index of the sender in the conversation's (sorted) participants.
+    sender: int
+    mine: bool
+    content: str
+    sent_at: int
+    time: str
+    file_url: str
+    broadcast: bool
+
+
+class ConversationSummary(TypedDict):
+    last_message: str
+    last_sender_email: str
+    last_activity: str
+    unread: dict[str, int]
@@ -0,0 +1,76 @@
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import Frame, Opcode
+from uvicorn.protocols.websockets.websockets_impl import (
+    WebSocketProtocol,
+)
+from uvicorn.workers import UvicornWorker
+
+from app import settings
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that sends messages below `min_size` bytes uncompressed.
+
+    RFC 7692 lets each message choose whether it is compressed (RSV1), so
+    small deltas skip the compressor while hydration frames are deflated.
+    """
+
+    def __init__(self, *args, min_size: int, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame: Frame) -> Frame:
+        if (
+            frame.fin
+            and frame.opcode in (Opcode.TEXT, Opcode.BINARY)
+            and len(frame.data) < self.min_size
+        ):
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate with a per-message size threshold."""
+
+    def __init__(self, min_size: int) -> None:
+        super().__init__()
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+class CompressingWebSocketProtocol(WebSocketProtocol):
+    """Uvicorn's websockets protocol with thresholded compression."""
+
+    def __init__(self, config, *args, **kwargs) -> None:
+        super().__init__(config, *args, **kwargs)
+        if config.ws_per_message_deflate:
+            self.available_extensions = [
+                ThresholdDeflateFactory(
+                    settings.WS_COMPRESSION_MIN_BYTES
+                )
+            ]
+
+
+class CompressingUvicornWorker(UvicornWorker):
+    """Gunicorn worker used by `reflex run --env prod` (see rxconfig.py)."""
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "ws": CompressingWebSocketProtocol,
+        "ws_per_message_deflate": settings.WS_COMPRESSION_ENABLED,
+    }
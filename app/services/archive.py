@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import logging
+import os
+
+from app import settings
+from app.services.segments import write_segment
+from app.services.storage import Storage, storage
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    """Moves old messages from the database into compressed day segments.
+
+    Each UTC day older than `after_days` becomes one immutable segment file
+    holding a compressed block per conversation and an offset index. The
+    rows are then deleted from the database in the same transaction that
+    records the segment, so a conversation's positions never change; reads
+    of archived positions go through a memory map of the segment. Segments
+    older than `retention_days` are deleted, leaving their positions
+    counted but unreadable.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        after_days: int,
+        retention_days: int,
+    ) -> None:
+        self.storage = storage
+        self.after_days = after_days
+        self.retention_days = retention_days
+
+    def _write_day(
+        self, day: str
+    ) -> tuple[str, dict[str, int], dict[str, list[tuple]]]:
+        """Writes the segment for `day` (runs in a worker thread)."""
+        blocks, first_positions = self.storage.load_day(day)
+        name = f"{day}.seg"
+        if blocks:
+            os.makedirs(
+                self.storage.segments.directory, exist_ok=True
+            )
+            write_segment(self.storage.segments.path(name), blocks)
+        return name, first_positions, blocks
+
+    async def compact(self, today: datetime.date | None = None) -> int:
+        """Archives every day older than the cutoff, oldest first; returns how many."""
+        if self.after_days <= 0:
+            return 0
+        today = today or datetime.datetime.utcnow().date()
+        cutoff = (
+            today - datetime.timedelta(days=self.after_days)
+        ).isoformat()
+        await self.storage.flush()
+        days = await asyncio.to_thread(
+            self.storage.archivable_days, cutoff
+        )
+        for day in days:
+            name, first_positions, blocks = await asyncio.to_thread(
+                self._write_day, day
+            )
+            if blocks:
+                self.storage.save_segment(
+                    name, day, first_positions, blocks
+                )
+                # Later days take their first positions from this one.
+                await self.storage.flush()
+        return len(days)
+
+    async def purge(self, today: datetime.date | None = None) -> int:
+        """Deletes segments past the retention period; returns how many."""
+        if self.retention_days <= 0:
+            return 0
+        today = today or datetime.datetime.utcnow().date()
+        cutoff = (
+            today - datetime.timedelta(days=self.retention_days)
+        ).isoformat()
+        names = self.storage.expired_segments(cutoff)
+        for name in names:
+            self.storage.purge_segment(name)
+        await self.storage.flush()
+        for name in names:
+            self.storage.segments.evict(name)
+            try:
+                os.remove(self.storage.segments.path(name))
+            except FileNotFoundError:
+                pass
+        return len(names)
+
+    async def run(self, interval_s: float) -> None:
+        """Compacts and applies retention every `interval_s` seconds until cancelled."""
+        while True:
+            try:
+                compacted = await self.compact()
+                purged = await self.purge()
+                if compacted or purged:
+                    logger.info(
+                        "Archived %d days, deleted %d segments.",
+                        compacted,
+                        purged,
+                    )
+            except Exception:
+                logger.exception("Archive compaction failed.")
+            await asyncio.sleep(interval_s)
+
+
+archiver = Archiver(
+    storage,
+    settings.ARCHIVE_AFTER_DAYS,
+    settings.ARCHIVE_RETENTION_DAYS,
+)
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, TypedDict
+
+from app import settings
+from app.services.storage import (
+    Storage,
+    StorageWriteError,
+    storage,
+)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CHUNK_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class Attachment(TypedDict):
+    digest: str
+    size: int
+    content_type: str
+
+
+class AttachmentTooLargeError(Exception):
+    """Raised when an upload exceeds the per-file size limit."""
+
+
+class QuotaExceededError(Exception):
+    """Raised when an upload would exceed the owner's storage quota."""
+
+
+class AttachmentStore:
+    """Content-addressed attachment files on local disk.
+
+    Files live at ``<root>/<sha256[:2]>/<sha256>``, so identical uploads are
+    stored once. A user's quota is charged once per distinct file they own.
+    Thumbnails are generated on first request in a worker thread and cached
+    under ``<root>/thumbnails``.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        storage: Storage,
+        max_file_bytes: int,
+        quota_bytes: int,
+        thumbnail_size: int,
+    ) -> None:
+        self.root = Path(root)
+        self.storage = storage
+        self.max_file_bytes = max_file_bytes
+        self.quota_bytes = quota_bytes
+        self.thumbnail_size = thumbnail_size
+        self._usage: dict[str, tuple[int, set[str]]] = {}
+        self._thumbnails: dict[str, asyncio.Future] = {}
+        self._not_images: set[str] = set()
+
+    def path(self, digest: str) -> Path:
+        """Returns where the file with the given digest is stored."""
+        return self.root / digest[:2] / digest
+
+    async def _load_usage(self, email: str) -> None:
+        if email in self._usage:
+            return
+        usage = await asyncio.to_thread(
+            self.storage.load_attachment_usage, email
+        )
+        # A concurrent upload may have loaded and charged it meanwhile.
+        self._usage.setdefault(email, usage)
+
+    def _charge(self, owner: str, digest: str, size: int) -> bool:
+        """Charges a new file to `owner`'s quota; returns False if they already own it.
+
+        The owner's usage must have been loaded with `_load_usage`.
+        """
+        used, owned = self._usage[owner]
+        if digest in owned:
+            return False
+        if size > self.quota_bytes - used:
+            raise QuotaExceededError(
+                "Uploading this file would exceed your storage quota."
+            )
+        owned.add(digest)
+        self._usage[owner] = (used + size, owned)
+        return True
+
+    def _release(self, owner: str, digest: str, size: int) -> None:
+        used, owned = self._usage[owner]
+        owned.discard(digest)
+        self._usage[owner] = (used - size, owned)
+
+    async def save(
+        self,
+        owner: str,
+        content_type: str,
+        chunks: AsyncIterator[bytes],
+        readers: tuple[str, ...] = (),
+    ) -> Attachment:
+        """Streams an upload to disk while hashing it, deduplicating by content.
+
+        The owner's quota is checked and charged in one step once the file
+        is hashed, with no await in between, so concurrent uploads from the
+        same user cannot both pass the check. The charge is released if the
+        file cannot be stored.
+
+        The owner and `readers` may download the file. Its rows are flushed
+        before returning, so a download of the URL right away, possibly
+        served by another worker, finds them.
+        """
+        tmp_dir = self.root / "tmp"
+        await asyncio.to_thread(
+            tmp_dir.mkdir, parents=True, exist_ok=True
+        )
+        fd, tmp_name = tempfile.mkstemp(dir=tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise AttachmentTooLargeError(
+                            "File is larger than the upload limit."
+                        )
+                    digest.update(chunk)
+                    await asyncio.to_thread(tmp.write, chunk)
+            hex_digest = digest.hexdigest()
+            await self._load_usage(owner)
+            charged = self._charge(owner, hex_digest, size)
+        except BaseException:
+            await asyncio.to_thread(
+                Path(tmp_name).unlink, missing_ok=True
+            )
+            raise
+        try:
+            await asyncio.to_thread(
+                _move_into_place,
+                Path(tmp_name),
+                self.path(hex_digest),
+            )
+        except BaseException:
+            if charged:
+                self._release(owner, hex_digest, size)
+            await asyncio.to_thread(
+                Path(tmp_name).unlink, missing_ok=True
+            )
+            raise
+        if charged:
+            self.storage.save_attachment(
+                hex_digest, size, content_type, owner
+            )
+        self.storage.save_attachment_readers(hex_digest, readers)
+        try:
+            await self.storage.flush()
+        except StorageWriteError:
+            # The dropped writes may have been someone else's.
+            if not await asyncio.to_thread(
+                self.storage.can_read_attachment, owner, hex_digest
+            ):
+                if charged:
+                    self._release(owner, hex_digest, size)
+                raise
+        return Attachment(
+            digest=hex_digest,
+            size=size,
+            content_type=content_type,
+        )
+
+    async def thumbnail(self, digest: str) -> Path | None:
+        """Returns a cached thumbnail of an image attachment, generating it if needed."""
+        if Image is None or digest in self._not_images:
+            return None
+        target = self.root / "thumbnails" / f"{digest}.jpg"
+        if target.exists():
+            return target
+        pending = self._thumbnails.get(digest)
+        if pending is None:
+            pending = self._thumbnails[digest] = (
+                asyncio.ensure_future(
+                    asyncio.to_thread(
+                        _make_thumbnail,
+                        self.path(digest),
+                        target,
+                        self.thumbnail_size,
+                    )
+                )
+            )
+            pending.add_done_callback(
+                lambda _: self._thumbnails.pop(digest, None)
+            )
+        thumbnail = await asyncio.shield(pending)
+        if thumbnail is None:
+            self._not_images.add(digest)
+        return thumbnail
+
+
+def parse_byte_range(
+    header: str, size: int
+) -> tuple[int, int] | None:
+    """Parses a single-range Range header into inclusive offsets.
+
+    Returns None if the header is malformed or the range cannot be
+    satisfied for a file of `size` bytes.
+    """
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def _move_into_place(tmp: Path, target: Path) -> None:
+    if target.exists():
+        tmp.unlink()
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp, target)
+
+
+def _make_thumbnail(
+    source: Path, target: Path, size: int
+) -> Path | None:
+    try:
+        with Image.open(source) as image:
+            image.thumbnail((size, size))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(".tmp")
+            image.convert("RGB").save(tmp, "JPEG", quality=80)
+            os.replace(tmp, target)
+    except (OSError, ValueError):
+        return None
+    return target
+
+
+attachment_store = AttachmentStore(
+    settings.ATTACHMENTS_DIR,
+    storage,
+    max_file_bytes=settings.ATTACHMENT_MAX_BYTES,
+    quota_bytes=settings.ATTACHMENT_QUOTA_BYTES,
+    thumbnail_size=settings.ATTACHMENT_THUMBNAIL_SIZE,
+)
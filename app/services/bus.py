@@ -0,0 +1,244 @@
+"""Cross-process message bus for running several backend workers on one box.
+
+Run the broker next to the workers and point them at it:
+
+    python -m app.services.bus            # listens on CHAT_BUS_SOCKET
+
+A frame is a header (JSON length, target length), the target worker id and
+a JSON object. Each worker says hello with its id and is given a slot (a
+small integer unique among the connected workers). The broker then forwards
+every frame as is to its target, or to every other worker when the target
+is "*", without decoding the JSON, and announces the member list whenever
+a worker joins or leaves. A frame for a worker that has left is returned to
+its sender as "undelivered", after the member list that shows it gone.
+The broker reads a worker's next frame only once its targets have drained
+the last one, so a slow worker slows its senders instead of buffering
+without bound.
+"""
+
+import asyncio
+import json
+import logging
+import struct
+from collections.abc import Callable
+from typing import Any
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">IH")
+BROADCAST = "*"
+
+
+def encode_frame(frame: dict[str, Any], to: str = "") -> bytes:
+    data = json.dumps(frame, separators=(",", ":")).encode()
+    target = to.encode()
+    return HEADER.pack(len(data), len(target)) + target + data
+
+
+async def read_raw_frame(
+    reader: asyncio.StreamReader,
+) -> tuple[str, bytes, bytes] | None:
+    """Reads one frame as (target, JSON bytes, whole frame), or None at end of stream."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        size, target_size = HEADER.unpack(header)
+        rest = await reader.readexactly(target_size + size)
+    except asyncio.IncompleteReadError:
+        return None
+    return (
+        rest[:target_size].decode(),
+        rest[target_size:],
+        header + rest,
+    )
+
+
+async def read_frame(
+    reader: asyncio.StreamReader,
+) -> dict[str, Any] | None:
+    """Reads and decodes one frame, or returns None at end of stream."""
+    frame = await read_raw_frame(reader)
+    return None if frame is None else json.loads(frame[1])
+
+
+class BusBroker:
+    """Routes frames between the workers connected to a Unix socket."""
+
+    def __init__(self, path: str, max_workers: int) -> None:
+        self.path = path
+        self.max_workers = max_workers
+        self._writers: dict[str, asyncio.StreamWriter] = {}
+        self._slots: dict[str, int] = {}
+
+    async def serve_forever(self) -> None:
+        server = await asyncio.start_unix_server(
+            self._handle, path=self.path
+        )
+        async with server:
+            await server.serve_forever()
+
+    def _announce(self) -> None:
+        frame = encode_frame(
+            {"op": "members", "workers": sorted(self._writers)}
+        )
+        for writer in self._writers.values():
+            writer.write(frame)
+
+    @staticmethod
+    async def _drain(writer: asyncio.StreamWriter) -> None:
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The worker is leaving; its own handler cleans up.
+            pass
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        worker = None
+        try:
+            hello = await read_frame(reader)
+            if hello is None:
+                return
+            worker = hello["worker"]
+            free = set(range(self.max_workers)) - set(
+                self._slots.values()
+            )
+            if worker in self._writers or not free:
+                logger.warning("Rejected bus worker %s", worker)
+                worker = None
+                return
+            self._writers[worker] = writer
+            self._slots[worker] = min(free)
+            writer.write(
+                encode_frame(
+                    {"op": "welcome", "slot": self._slots[worker]}
+                )
+            )
+            self._announce()
+            while (
+                frame := await read_raw_frame(reader)
+            ) is not None:
+                to, data, raw = frame
+                if to == BROADCAST:
+                    targets = [
+                        target
+                        for name, target in self._writers.items()
+                        if name != worker
+                    ]
+                elif (target := self._writers.get(to)) is not None:
+                    targets = [target]
+                else:
+                    targets = [writer]
+                    raw = encode_frame(
+                        {
+                            "op": "undelivered",
+                            "to": to,
+                            "body": json.loads(data)["body"],
+                        }
+                    )
+                for target in targets:
+                    target.write(raw)
+                await asyncio.gather(
+                    *(self._drain(target) for target in targets)
+                )
+        finally:
+            if worker is not None:
+                del self._writers[worker]
+                del self._slots[worker]
+                self._announce()
+            writer.close()
+
+
+class BusClient:
+    """A worker's connection to the broker.
+
+    `on_event` is called with the body of every event sent to this worker,
+    `on_members` with the sorted worker ids on every membership change and
+    `on_undelivered` with the target and body of an event sent to a worker
+    that had left. `send` only buffers; await `drain` to wait for the
+    broker to take what was sent.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        worker_id: str,
+        on_event: Callable[[dict[str, Any]], None],
+        on_members: Callable[[list[str]], None],
+        on_undelivered: Callable[[str, dict[str, Any]], None],
+    ) -> None:
+        self.path = path
+        self.worker_id = worker_id
+        self.on_event = on_event
+        self.on_members = on_members
+        self.on_undelivered = on_undelivered
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+
+    async def connect(self) -> int:
+        """Joins the bus and returns this worker's slot."""
+        reader, self._writer = await asyncio.open_unix_connection(
+            self.path
+        )
+        self._writer.write(
+            encode_frame({"op": "hello", "worker": self.worker_id})
+        )
+        welcome = await read_frame(reader)
+        if welcome is None:
+            raise ConnectionError(
+                f"The bus broker at {self.path} rejected {self.worker_id}."
+            )
+        self._reader_task = asyncio.create_task(self._read(reader))
+        return welcome["slot"]
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while (frame := await read_frame(reader)) is not None:
+            if frame["op"] == "members":
+                self.on_members(frame["workers"])
+            elif frame["op"] == "event":
+                try:
+                    self.on_event(frame["body"])
+                except Exception:
+                    logger.exception("Failed to apply bus event")
+            elif frame["op"] == "undelivered":
+                try:
+                    self.on_undelivered(frame["to"], frame["body"])
+                except Exception:
+                    logger.exception(
+                        "Failed to handle an undelivered bus event"
+                    )
+        logger.error("Lost the connection to the bus broker")
+
+    def send(self, to: str, body: dict[str, Any]) -> None:
+        """Sends an event to worker `to`, or to every other worker with "*"."""
+        if self._writer is None:
+            return
+        self._writer.write(
+            encode_frame({"op": "event", "body": body}, to)
+        )
+
+    async def drain(self) -> None:
+        """Waits until the connection's send buffer is below its high-water mark."""
+        if self._writer is not None:
+            await self._writer.drain()
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(
+        BusBroker(
+            settings.BUS_SOCKET or "chat-bus.sock",
+            settings.BUS_MAX_WORKERS,
+        ).serve_forever()
+    )
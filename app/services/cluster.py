@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import os
+import socket
+from collections.abc import Callable
+from typing import Any
+
+from app.models import Message, User
+from app.services.bus import BROADCAST, BusClient
+from app.services.dedupe import RecentKeys, recent_sends
+from app.services.hub import MessageHub, hub
+from app.services.message_store import (
+    MessageStore,
+    conversation_id,
+    message_store,
+    participants,
+)
+from app.services.metrics import metrics
+from app.services.search_index import SearchIndex, search_index
+from app.services.sharding import HashRing
+from app.services.user_directory import (
+    UserDirectory,
+    user_directory,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Cluster:
+    """Conversation ownership and replication between backend workers.
+
+    Each conversation is owned by one worker, picked by consistent hashing
+    over the workers on the bus. Only the owner appends to it, so positions
+    and summaries stay in one order; other workers forward their appends to
+    it, which is also where resubmitted sends are recognized and answered
+    with the message they first appended; every worker remembers recent
+    sends, so that still holds after a conversation changes owner. Every
+    change (messages, broadcasts, read receipts, new users) is sent so each
+    worker updates its in-memory copies and pushes the event to its own
+    connected sessions. Without a bus, this worker owns everything.
+    """
+
+    def __init__(
+        self,
+        store: MessageStore,
+        index: SearchIndex,
+        hub: MessageHub,
+        directory: UserDirectory,
+        recent_sends: RecentKeys,
+    ) -> None:
+        self.store = store
+        self.index = index
+        self.hub = hub
+        self.directory = directory
+        self.recent_sends = recent_sends
+        self.worker_id = ""
+        self.bus: BusClient | None = None
+        self.ring: HashRing | None = None
+        # Replicated receipts whose read state is being loaded.
+        self._receipts: set[asyncio.Task] = set()
+        self._handlers: dict[
+            str, Callable[[dict[str, Any]], None]
+        ] = {}
+        self._departure_handlers: list[Callable[[str], None]] = []
+
+    async def start(
+        self, path: str, max_workers: int, worker_id: str = ""
+    ) -> None:
+        """Joins the bus at `path`; call once per worker process.
+
+        The worker id defaults to the host name and process id.
+        """
+        self.worker_id = (
+            worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        )
+        self.ring = HashRing([self.worker_id])
+        self.bus = BusClient(
+            path,
+            self.worker_id,
+            self._apply,
+            self._set_members,
+            self._reroute,
+        )
+        slot = await self.bus.connect()
+        self.store.id_stride = max_workers
+        self.store.id_offset = slot
+
+    async def stop(self) -> None:
+        if self.bus is not None:
+            await self.bus.close()
+            self.bus = None
+
+    async def drain(self) -> None:
+        """Waits for the bus to take what this worker has sent."""
+        if self.bus is not None:
+            await self.bus.drain()
+
+    def _set_members(self, workers: list[str]) -> None:
+        departed = (
+            set(self.ring.nodes) - set(workers)
+            if self.ring is not None
+            else set()
+        )
+        self.ring = HashRing(workers or [self.worker_id])
+        for worker in sorted(departed - {self.worker_id}):
+            for handler in self._departure_handlers:
+                handler(worker)
+
+    def _reroute(self, to: str, event: dict[str, Any]) -> None:
+        """Forwards an append again after its owner left; other events are dropped.
+
+        The broker returns it after the member list without `to`, so the
+        ring already names the conversation's new owner.
+        """
+        if event["type"] != "append":
+            logger.warning(
+                "Dropped a %s event for departed worker %s",
+                event["type"],
+                to,
+            )
+            return
+        metrics.inc("bus_rerouted_appends_total")
+        self.append(event["message"], event.get("client_id", ""))
+
+    def owner(self, cid: str) -> str:
+        """Returns the worker that appends to conversation `cid`."""
+        if self.ring is None:
+            return self.worker_id
+        return self.ring.owner(cid)
+
+    def append(
+        self, message: Message, client_id: str = ""
+    ) -> tuple[str, int, Message] | None:
+        """Appends a message, returning its conversation id, position and the stored message.
+
+        `client_id` is the id the sender's client gave this send; a send
+        whose id was already appended is not appended again, and the
+        message it first appended is returned instead. Returns None when
+        another worker owns the conversation; the message is then forwarded
+        there and comes back to the sender as a pushed event, resends
+        included.
+        """
+        cid = conversation_id(
+            message["sender_email"], message["receiver_email"]
+        )
+        owner = self.owner(cid)
+        if owner != self.worker_id and self.bus is not None:
+            self.bus.send(
+                owner,
+                {
+                    "type": "append",
+                    "message": message,
+                    "client_id": client_id,
+                },
+            )
+            return None
+        sent = self._resubmitted(message, client_id)
+        if sent is not None:
+            return sent
+        return self._append_owned(message, client_id)
+
+    def _resubmitted(self, message: Message, client_id: str) -> Any:
+        """Returns what an earlier send with this `client_id` produced, if there was one."""
+        if not client_id:
+            return None
+        sent = self.recent_sends.get(
+            (message["sender_email"], client_id)
+        )
+        if sent is not None:
+            metrics.inc("send_duplicates_total")
+        return sent
+
+    def _append_owned(
+        self, message: Message, client_id: str
+    ) -> tuple[str, int, Message]:
+        cid = self.store.append(message)
+        self.index.add(message)
+        position = self.store.conversation_length(cid) - 1
+        event = {
+            "type": "message",
+            "conversation_id": cid,
+            "position": position,
+            "message": message,
+        }
+        self._deliver(cid, event)
+        self.replicate({**event, "client_id": client_id})
+        if client_id:
+            self.recent_sends.add(
+                (message["sender_email"], client_id),
+                (cid, position, message),
+            )
+        return cid, position, message
+
+    def _acknowledge_resend(self, event: dict[str, Any]) -> None:
+        """Pushes a resent message back to its sender's sessions here.
+
+        The session that resent it may have missed the first push, e.g.
+        while it was reconnecting.
+        """
+        self.hub.publish(
+            event["message"]["sender_email"],
+            {**event, "type": "message"},
+        )
+
+    def publish_receipt(
+        self, cid: str, reader: str, position: int
+    ) -> None:
+        """Pushes a read receipt to both participants on every worker."""
+        event = {
+            "type": "receipt",
+            "conversation_id": cid,
+            "reader": reader,
+            "position": position,
+        }
+        self._deliver(cid, event)
+        self.replicate(event)
+
+    def add_broadcast(
+        self, message: Message, client_id: str = ""
+    ) -> Message:
+        """Stores a broadcast once and pushes it to every connected session.
+
+        Returns the stored broadcast: the one first sent with `client_id`
+        if this is a resend.
+        """
+        sent = self._resubmitted(message, client_id)
+        if sent is not None:
+            return sent
+        self.store.add_broadcast(message)
+        event = {"type": "broadcast", "message": message}
+        self.hub.publish_all(event)
+        self.replicate({**event, "client_id": client_id})
+        if client_id:
+            self.recent_sends.add(
+                (message["sender_email"], client_id), message
+            )
+        return message
+
+    async def add_user(self, email: str, user: User) -> None:
+        """Registers a new user here and, once it is persisted, on every other worker.
+
+        Raises ValueError if the email is already taken, here or by a
+        concurrent sign-up elsewhere.
+        """
+        await self.directory.register(email, user)
+        self.replicate({"type": "user", "email": email, "user": user})
+
+    def register(
+        self, kind: str, handler: Callable[[dict[str, Any]], None]
+    ) -> None:
+        """Routes events of type `kind` from other workers to `handler`."""
+        self._handlers[kind] = handler
+
+    def on_departure(self, handler: Callable[[str], None]) -> None:
+        """Calls `handler` with the id of every worker that leaves the bus."""
+        self._departure_handlers.append(handler)
+
+    def replicate(self, event: dict[str, Any]) -> None:
+        """Sends a change made here to every other worker."""
+        if self.bus is not None:
+            self.bus.send(BROADCAST, event)
+
+    async def _apply_receipt(self, event: dict[str, Any]) -> None:
+        cid = event["conversation_id"]
+        await self.store.load_read_state(cid)
+        self.store.mark_read_up_to(
+            cid, event["reader"], event["position"], persist=False
+        )
+        self._deliver(cid, event)
+
+    def _deliver(self, cid: str, event: dict[str, Any]) -> None:
+        for email in participants(cid):
+            self.hub.publish(email, event)
+
+    def _apply(self, event: dict[str, Any]) -> None:
+        """Applies an event received from another worker."""
+        kind = event["type"]
+        if kind == "append":
+            message = event["message"]
+            client_id = event.get("client_id", "")
+            sent = self._resubmitted(message, client_id)
+            if sent is None:
+                self._append_owned(message, client_id)
+            else:
+                cid, position, message = sent
+                resent = {
+                    "type": "resent",
+                    "conversation_id": cid,
+                    "position": position,
+                    "message": message,
+                }
+                self._acknowledge_resend(resent)
+                self.replicate(resent)
+        elif kind == "resent":
+            self._acknowledge_resend(event)
+        elif kind == "message":
+            cid = event["conversation_id"]
+            message = event["message"]
+            self.store.apply_replicated(
+                cid, event["position"], message
+            )
+            self.index.add(message, persist=False)
+            client_id = event.pop("client_id", "")
+            if client_id:
+                self.recent_sends.add(
+                    (message["sender_email"], client_id),
+                    (cid, event["position"], message),
+                )
+            self._deliver(cid, event)
+        elif kind == "receipt":
+            task = asyncio.ensure_future(self._apply_receipt(event))
+            self._receipts.add(task)
+            task.add_done_callback(self._receipts.discard)
+        elif kind == "broadcast":
+            message = event["message"]
+            self.store.apply_replicated_broadcast(message)
+            client_id = event.pop("client_id", "")
+            if client_id:
+                self.recent_sends.add(
+                    (message["sender_email"], client_id), message
+                )
+            self.hub.publish_all(event)
+        elif kind == "user":
+            self.directory.add_replicated(
+                event["email"], event["user"]
+            )
+        elif kind in self._handlers:
+            self._handlers[kind](event)
+
+
+cluster = Cluster(
+    message_store, search_index, hub, user_directory, recent_sends
+)
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+from app import settings
+
+
+class RecentKeys:
+    """Remembers keys added in the last `window_s` seconds, at most `max_size` of them, with a value each.
+
+    Keys are kept in the order they were added, so expiring old keys and
+    evicting past the size bound both pop from the front in O(1).
+    """
+
+    def __init__(self, max_size: int, window_s: float) -> None:
+        self.max_size = max_size
+        self.window_s = window_s
+        self._added: OrderedDict[Hashable, tuple[float, Any]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._added)
+
+    def _expire(self, now: float) -> None:
+        added = self._added
+        while added:
+            oldest, (at, _) = next(iter(added.items()))
+            if now - at < self.window_s:
+                break
+            del added[oldest]
+
+    def get(self, key: Hashable) -> Any | None:
+        """Returns the value `key` was added with within the window, or None."""
+        self._expire(time.monotonic())
+        entry = self._added.get(key)
+        return entry[1] if entry is not None else None
+
+    def add(self, key: Hashable, value: Any) -> None:
+        """Records `key` with `value`, replacing any earlier value."""
+        now = time.monotonic()
+        self._expire(now)
+        added = self._added
+        added[key] = (now, value)
+        added.move_to_end(key)
+        if len(added) > self.max_size:
+            added.popitem(last=False)
+
+
+# What recent sends produced, keyed by (sender email, client message id).
+recent_sends = RecentKeys(
+    settings.SEND_DEDUPE_SIZE, settings.SEND_DEDUPE_WINDOW_S
+)
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any
+
+from app import settings
+
+
+class Subscription:
+    """A bounded stream of events delivered to one connected session."""
+
+    def __init__(
+        self, hub: "MessageHub", email: str, maxsize: int
+    ) -> None:
+        self.hub = hub
+        self.email = email
+        self.dropped = 0
+        self._queue: asyncio.Queue[dict[str, Any]] = (
+            asyncio.Queue(maxsize)
+        )
+
+    def offer(self, event: dict[str, Any]) -> None:
+        """Enqueues an event without blocking, dropping the oldest one if full."""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    async def get(self) -> dict[str, Any]:
+        """Waits for the next event."""
+        return await self._queue.get()
+
+    def drain(self) -> list[dict[str, Any]]:
+        """Returns every event that is already queued, without waiting."""
+        events = []
+        while not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    def close(self) -> None:
+        """Stops receiving events."""
+        self.hub.unsubscribe(self)
+
+
+class MessageHub:
+    """In-process pub/sub keyed by recipient email."""
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[Subscription]] = {}
+
+    def subscribe(self, email: str) -> Subscription:
+        """Registers a new subscriber for events addressed to `email`."""
+        subscription = Subscription(
+            self, email, self.queue_size
+        )
+        self._subscribers.setdefault(email, set()).add(
+            subscription
+        )
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Removes a subscriber; unknown subscribers are ignored."""
+        subscribers = self._subscribers.get(
+            subscription.email
+        )
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.email]
+
+    def publish(
+        self, email: str, event: dict[str, Any]
+    ) -> None:
+        """Delivers an event to every subscriber of `email` without waiting on any of them."""
+        for subscription in self._subscribers.get(email, ()):
+            subscription.offer(event)
+
+    def publish_all(self, event: dict[str, Any]) -> None:
+        """Delivers one event to every connected subscriber."""
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.offer(event)
+
+
+hub = MessageHub(settings.SUBSCRIBER_QUEUE_SIZE)
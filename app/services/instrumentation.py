@@ -0,0 +1,225 @@
+import functools
+import inspect
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+from app import settings
+from app.services.metrics import SIZE_BUCKETS, metrics, payload_size
+
+logger = logging.getLogger(__name__)
+
+
+class _Sample:
+    """Wall and CPU time of one handler call or var recompute."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.cpu = 0.0
+
+    def wall(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class _CpuTimed:
+    """Awaits a coroutine, adding the thread CPU time of each of its steps to `sample`.
+
+    Only the steps of this coroutine are counted, not whatever else the event
+    loop runs while it is suspended.
+    """
+
+    def __init__(self, coro, sample: _Sample) -> None:
+        self.coro = coro
+        self.sample = sample
+
+    def __await__(self):
+        send, error = None, None
+        while True:
+            started = time.thread_time()
+            try:
+                if error is None:
+                    yielded = self.coro.send(send)
+                else:
+                    yielded = self.coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.sample.cpu += time.thread_time() - started
+            try:
+                send, error = (yield yielded), None
+            except BaseException as e:
+                send, error = None, e
+
+
+def _record_event(
+    name: str, sample: _Sample, kwargs: dict[str, Any]
+) -> None:
+    wall = sample.wall()
+    metrics.inc("state_event_calls_total", handler=name)
+    metrics.observe("state_event_seconds", wall, handler=name)
+    metrics.observe(
+        "state_event_cpu_seconds", sample.cpu, handler=name
+    )
+    metrics.observe(
+        "state_event_payload_bytes",
+        payload_size(kwargs),
+        SIZE_BUCKETS,
+        handler=name,
+    )
+    threshold = settings.SLOW_EVENT_THRESHOLD_MS
+    if threshold and wall * 1000 >= threshold:
+        logger.warning(
+            "Slow event %s: %.1f ms wall, %.1f ms CPU",
+            name,
+            wall * 1000,
+            sample.cpu * 1000,
+        )
+
+
+def _instrument_handler(name: str, fn: Callable) -> Callable:
+    if inspect.isasyncgenfunction(fn):
+
+        @functools.wraps(fn)
+        async def async_gen_wrapper(state, *args, **kwargs):
+            sample = _Sample()
+            events = fn(state, *args, **kwargs)
+            try:
+                while True:
+                    try:
+                        event = await _CpuTimed(
+                            events.__anext__(), sample
+                        )
+                    except StopAsyncIteration:
+                        return
+                    yield event
+            finally:
+                await events.aclose()
+                _record_event(name, sample, kwargs)
+
+        return async_gen_wrapper
+
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(state, *args, **kwargs):
+            sample = _Sample()
+            try:
+                return await _CpuTimed(
+                    fn(state, *args, **kwargs), sample
+                )
+            finally:
+                _record_event(name, sample, kwargs)
+
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(fn):
+
+        @functools.wraps(fn)
+        def gen_wrapper(state, *args, **kwargs):
+            sample = _Sample()
+            events = fn(state, *args, **kwargs)
+            try:
+                while True:
+                    started = time.thread_time()
+                    try:
+                        event = next(events)
+                    except StopIteration:
+                        return
+                    finally:
+                        sample.cpu += time.thread_time() - started
+                    yield event
+            finally:
+                events.close()
+                _record_event(name, sample, kwargs)
+
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(state, *args, **kwargs):
+        sample = _Sample()
+        started = time.thread_time()
+        try:
+            return fn(state, *args, **kwargs)
+        finally:
+            sample.cpu = time.thread_time() - started
+            _record_event(name, sample, kwargs)
+
+    return wrapper
+
+
+def _record_var(name: str, sample: _Sample, value: Any) -> None:
+    metrics.inc("computed_var_recomputes_total", var=name)
+    metrics.observe("computed_var_seconds", sample.wall(), var=name)
+    metrics.observe(
+        "computed_var_cpu_seconds", sample.cpu, var=name
+    )
+    metrics.observe(
+        "computed_var_payload_bytes",
+        payload_size(value),
+        SIZE_BUCKETS,
+        var=name,
+    )
+
+
+def _instrument_var(name: str, fget: Callable) -> Callable:
+    if inspect.iscoroutinefunction(fget):
+
+        @functools.wraps(fget)
+        async def async_fget(state):
+            sample = _Sample()
+            value = await _CpuTimed(fget(state), sample)
+            _record_var(name, sample, value)
+            return value
+
+        return async_fget
+
+    @functools.wraps(fget)
+    def timed_fget(state):
+        sample = _Sample()
+        started = time.thread_time()
+        value = fget(state)
+        sample.cpu = time.thread_time() - started
+        _record_var(name, sample, value)
+        return value
+
+    return timed_fget
+
+
+def instrument_state(state_cls) -> None:
+    """Times every event handler and computed var defined on `state_cls`.
+
+    Handlers record call counts, wall and CPU time and the size of their
+    payload; computed vars record recomputes, wall and CPU time and the size
+    of their value. Handlers and vars inherited from other states are left
+    alone.
+    """
+    prefix = state_cls.__name__
+    for name, handler in state_cls.event_handlers.items():
+        fn = handler.fn
+        if (
+            getattr(fn, "__qualname__", "").split(".")[0]
+            != prefix
+        ):
+            continue
+        object.__setattr__(
+            handler,
+            "fn",
+            _instrument_handler(f"{prefix}.{name}", fn),
+        )
+    for name, var in state_cls.computed_vars.items():
+        fget = var._fget
+        if name in state_cls.inherited_vars or fget is None:
+            continue
+        object.__setattr__(
+            var,
+            "_fget",
+            _instrument_var(f"{prefix}.{name}", fget),
+        )
+        # Dependencies are read from the bytecode of the getter, so later
+        # recalculations (hot reload, added vars) must see the original.
+        object.__setattr__(
+            var,
+            "_deps",
+            functools.partial(type(var)._deps, var, obj=fget),
+        )
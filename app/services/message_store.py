@@ -0,0 +1,725 @@
+import asyncio
+import base64
+import binascii
+import bisect
+import datetime
+from array import array
+from collections import OrderedDict
+
+from app import settings
+from app.models import ConversationSummary, Message, WireMessage
+from app.services.storage import Storage, storage
+
+SNIPPET_LENGTH = 80
+# Page anchors kept per loaded conversation before they are dropped.
+MAX_PAGE_ANCHORS = 256
+# Broadcasts are stored once, addressed to this recipient, under this
+# conversation id, and merged into every conversation when it is read.
+BROADCAST_RECIPIENT = "*"
+BROADCAST_CONVERSATION = "*"
+
+
+def conversation_id(email_a: str, email_b: str) -> str:
+    """Returns the canonical id for the conversation between two users."""
+    first, second = sorted((email_a, email_b))
+    return f"{first}|{second}"
+
+
+def participants(cid: str) -> tuple[str, str]:
+    """Returns the two emails of a conversation id."""
+    first, _, second = cid.partition("|")
+    return first, second
+
+
+def encode_cursor(cid: str, position: int) -> str:
+    """Encodes a conversation position as an opaque pagination cursor."""
+    return base64.urlsafe_b64encode(
+        f"{position}:{cid}".encode()
+    ).decode()
+
+
+def decode_cursor(cid: str, cursor: str) -> int | None:
+    """Returns the position encoded in a cursor, or None if it is not valid for `cid`."""
+    try:
+        position, _, cursor_cid = (
+            base64.urlsafe_b64decode(cursor.encode())
+            .decode()
+            .partition(":")
+        )
+        if cursor_cid != cid:
+            return None
+        return int(position)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def to_wire(message: Message, viewer_email: str) -> WireMessage:
+    """Converts a stored message to the compact form sent to `viewer_email`'s client.
+
+    The display time is formatted here so the client renders it as is.
+    """
+    sender_email = message["sender_email"]
+    sent_at = datetime.datetime.fromisoformat(
+        message["timestamp"]
+    ).replace(tzinfo=datetime.timezone.utc)
+    return WireMessage(
+        id=message["id"],
+        sender=int(sender_email > message["receiver_email"]),
+        mine=sender_email == viewer_email,
+        content=message["content"],
+        sent_at=int(sent_at.timestamp() * 1000),
+        time=sent_at.strftime("%H:%M"),
+        file_url=message["file_url"] or "",
+        broadcast=message["receiver_email"] == BROADCAST_RECIPIENT,
+    )
+
+
+class _Conversation:
+    """The loaded tail of a conversation."""
+
+    __slots__ = (
+        "messages",
+        "base",
+        "first",
+        "received",
+        "anchors",
+        "cursors",
+    )
+
+    def __init__(
+        self, messages: list[Message], base: int, first: int
+    ) -> None:
+        # Position of messages[0]; older positions are read from storage.
+        self.messages = messages
+        self.base = base
+        # Position of the oldest message still retained anywhere.
+        self.first = first
+        # Running count of the tail's messages received by the first
+        # participant.
+        self.received = array("L")
+        # Ids at the start positions of pages read from storage, so the page
+        # before one can be read by id rather than by offset.
+        self.anchors: dict[int, int] = {}
+        # Read position per participant, loaded on first use.
+        self.cursors: dict[str, int] | None = None
+
+    @property
+    def length(self) -> int:
+        return self.base + len(self.messages)
+
+
+def _discard(keys: list, key: tuple) -> None:
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+class _PartnerOrder:
+    """One participant's conversations, kept sorted by recency and by unread count.
+
+    Both orders are sorted lists of keys ending in the partner's email, so
+    updating a conversation is a bisect and reading a page is a slice.
+    """
+
+    __slots__ = ("keys", "recent", "unread")
+
+    def __init__(self) -> None:
+        # Partner email -> (activity sequence number, unread count).
+        self.keys: dict[str, tuple[int, int]] = {}
+        # (-activity, partner): most recent first.
+        self.recent: list[tuple[int, str]] = []
+        # (-unread, -activity, partner): most unread first, then most recent.
+        self.unread: list[tuple[int, int, str]] = []
+
+    @staticmethod
+    def _recent_key(
+        partner: str, activity: int, unread: int
+    ) -> tuple[int, str]:
+        return -activity, partner
+
+    @staticmethod
+    def _unread_key(
+        partner: str, activity: int, unread: int
+    ) -> tuple[int, int, str]:
+        return -unread, -activity, partner
+
+    def update(self, partner: str, activity: int, unread: int) -> None:
+        old = self.keys.get(partner)
+        if old == (activity, unread):
+            return
+        if old is not None:
+            _discard(self.recent, self._recent_key(partner, *old))
+            _discard(self.unread, self._unread_key(partner, *old))
+        self.keys[partner] = (activity, unread)
+        bisect.insort(
+            self.recent, self._recent_key(partner, activity, unread)
+        )
+        bisect.insort(
+            self.unread, self._unread_key(partner, activity, unread)
+        )
+
+    def page(
+        self,
+        order: str,
+        offset: int,
+        limit: int,
+        among: set[str] | None,
+    ) -> tuple[list[str], int]:
+        ordered: list = (
+            self.unread if order == "unread" else self.recent
+        )
+        if among is None:
+            matches = ordered
+        elif len(among) < len(ordered):
+            key = (
+                self._unread_key
+                if order == "unread"
+                else self._recent_key
+            )
+            keys = self.keys
+            matches = sorted(
+                key(partner, *keys[partner])
+                for partner in among
+                if partner in keys
+            )
+        else:
+            matches = [item for item in ordered if item[-1] in among]
+        return [
+            item[-1] for item in matches[offset : offset + limit]
+        ], len(matches)
+
+
+class MessageStore:
+    """Process-wide, append-only message store indexed by conversation.
+
+    Conversations are loaded from storage on first access. Only the most
+    recent `hot_tail_size` messages of the `max_conversations` most recently
+    used conversations are kept in memory; older positions are read from
+    storage (the database or archive segments) when someone scrolls back.
+    The async `load` and `page` do those reads in a worker thread; the
+    other methods read synchronously if the conversation is not loaded.
+    Appends are written through to storage's write-behind queue. A summary
+    per conversation (last message, activity time, unread counts) is kept
+    in recency order and updated in O(1) on every append and read. For
+    participants whose conversation list is paged (the admin), their
+    conversations are also kept sorted by recency and by unread count.
+
+    Message ids double as sequence numbers: the worker that owns a
+    conversation assigns them in append order, so a conversation's messages
+    are ordered by id in memory and in storage alike. Timestamps are kept
+    from going backwards along that order, which keeps every archived day a
+    prefix of its conversations.
+
+    Each participant has a read cursor per conversation ("read up to position
+    X"), kept with the loaded conversation and evicted along with it. A
+    running count of tail messages received by the first participant lets
+    the unread count after a cursor move be computed in O(1), without
+    reading older messages back.
+    """
+
+    def __init__(
+        self,
+        storage: Storage | None = None,
+        hot_tail_size: int = 200,
+        max_conversations: int = 5000,
+    ) -> None:
+        self._storage = storage
+        self.hot_tail_size = hot_tail_size
+        self.max_conversations = max_conversations
+        self._conversations: OrderedDict[str, _Conversation] = (
+            OrderedDict()
+        )
+        self._last_id: int | None = None
+        self._summaries: (
+            OrderedDict[str, ConversationSummary] | None
+        ) = None
+        # Sequence number of each conversation's last activity.
+        self._activity: dict[str, int] = {}
+        self._last_activity = 0
+        self._partner_orders: dict[str, _PartnerOrder] = {}
+        # Ids are allocated as `id_offset` modulo `id_stride`, so workers
+        # sharing the database never hand out the same id.
+        self.id_stride = 1
+        self.id_offset = 0
+        self._broadcasts: list[Message] | None = None
+        self._broadcast_times: list[str] = []
+
+    def _all_summaries(
+        self,
+    ) -> OrderedDict[str, ConversationSummary]:
+        if self._summaries is None:
+            self._summaries = OrderedDict(
+                self._storage.load_summaries()
+                if self._storage is not None
+                else ()
+            )
+            self._activity = {
+                cid: activity
+                for activity, cid in enumerate(self._summaries, 1)
+            }
+            self._last_activity = len(self._activity)
+        return self._summaries
+
+    def _partner_order(self, email: str) -> _PartnerOrder:
+        """Returns `email`'s sorted conversations, building them on first use."""
+        partner_order = self._partner_orders.get(email)
+        if partner_order is None:
+            partner_order = self._partner_orders[email] = (
+                _PartnerOrder()
+            )
+            for cid, summary in self._all_summaries().items():
+                self._reorder(partner_order, cid, email, summary)
+        return partner_order
+
+    def _reorder(
+        self,
+        partner_order: _PartnerOrder,
+        cid: str,
+        email: str,
+        summary: ConversationSummary,
+    ) -> None:
+        first, second = participants(cid)
+        if email == first:
+            partner = second
+        elif email == second:
+            partner = first
+        else:
+            return
+        partner_order.update(
+            partner,
+            self._activity[cid],
+            summary["unread"].get(email, 0),
+        )
+
+    def _save_summary(
+        self, cid: str, summary: ConversationSummary
+    ) -> None:
+        if self._storage is not None:
+            self._storage.save_summary(cid, summary)
+
+    def _fetch(self, cid: str) -> tuple[list[Message], int, int]:
+        """Reads a conversation's tail, length and first position from storage."""
+        if self._storage is None:
+            return [], 0, 0
+        messages, length = self._storage.load_conversation_tail(
+            cid, self.hot_tail_size
+        )
+        return messages, length, self._storage.first_position(cid)
+
+    def _load(self, cid: str) -> _Conversation:
+        conversation = self._conversations.get(cid)
+        if conversation is not None:
+            self._conversations.move_to_end(cid)
+            return conversation
+        return self._install(cid, *self._fetch(cid))
+
+    async def load(self, cid: str) -> None:
+        """Loads a conversation's tail in a worker thread if it is not in memory."""
+        if cid in self._conversations or self._storage is None:
+            self._load(cid)
+            return
+        fetched = await asyncio.to_thread(self._fetch, cid)
+        # An append may have loaded it in the meantime.
+        if cid not in self._conversations:
+            self._install(cid, *fetched)
+
+    def _install(
+        self,
+        cid: str,
+        messages: list[Message],
+        length: int,
+        first_position: int,
+    ) -> _Conversation:
+        conversation = _Conversation(
+            messages, length - len(messages), first_position
+        )
+        first, _ = participants(cid)
+        count = 0
+        for message in conversation.messages:
+            count += message["receiver_email"] == first
+            conversation.received.append(count)
+        self._conversations[cid] = conversation
+        if len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        return conversation
+
+    @staticmethod
+    def _id_at(conversation: _Conversation, position: int) -> int | None:
+        """Returns the id at `position` if it is in the tail or starts a page read before."""
+        if conversation.base <= position < conversation.length:
+            return conversation.messages[position - conversation.base][
+                "id"
+            ]
+        return conversation.anchors.get(position)
+
+    @staticmethod
+    def _anchor(
+        conversation: _Conversation,
+        start: int,
+        end: int,
+        messages: list[Message],
+    ) -> None:
+        # Purged archive positions come back empty; only a complete read
+        # tells which id is at `start`.
+        if messages and len(messages) == end - start:
+            if len(conversation.anchors) >= MAX_PAGE_ANCHORS:
+                conversation.anchors.clear()
+            conversation.anchors[start] = messages[0]["id"]
+
+    def _read(
+        self, cid: str, conversation: _Conversation, start: int, end: int
+    ) -> list[Message]:
+        """Returns positions [start, end), reading those before the tail from storage."""
+        base = conversation.base
+        if start >= base:
+            return conversation.messages[start - base : end - base]
+        stored_end = min(end, base)
+        stored = self._storage.load_conversation_range(
+            cid, start, stored_end, self._id_at(conversation, stored_end)
+        )
+        self._anchor(conversation, start, stored_end, stored)
+        return stored + conversation.messages[: max(0, end - base)]
+
+    @staticmethod
+    def _received_after(
+        cid: str, conversation: _Conversation, email: str, position: int
+    ) -> int:
+        """Counts the messages received by `email` after `position`.
+
+        The count is exact within the tail. Positions between the cursor
+        and the tail are all counted as received rather than read back:
+        sending from the chat page marks what it shows as read, so a reader
+        that far behind has rarely sent any of them.
+        """
+        received = conversation.received
+        i = max(position + 1 - conversation.base, 0)
+        by_first = (
+            received[-1] - (received[i - 1] if i > 0 else 0)
+            if received
+            else 0
+        )
+        if email == participants(cid)[0]:
+            count = by_first
+        else:
+            count = len(conversation.messages) - i - by_first
+        if position + 1 < conversation.base:
+            count += conversation.base - position - 1
+        return count
+
+    def _observe_id(self, message_id: int) -> None:
+        if self._last_id is None:
+            self._last_id = (
+                self._storage.max_message_id()
+                if self._storage is not None
+                else 0
+            )
+        self._last_id = max(self._last_id, message_id)
+
+    def _allocate_id(self) -> int:
+        self._observe_id(0)
+        next_id = self._last_id + 1
+        next_id += (self.id_offset - next_id) % self.id_stride
+        self._last_id = next_id
+        return next_id
+
+    def append(self, message: Message) -> str:
+        """Assigns the message its id, appends it to its conversation and returns the conversation id.
+
+        A timestamp older than the conversation's last message, e.g. from a
+        send that waited on the state lock, is raised to match it.
+        """
+        cid = conversation_id(
+            message["sender_email"],
+            message["receiver_email"],
+        )
+        conversation = self._load(cid)
+        if conversation.messages:
+            last = conversation.messages[-1]
+            # After a change of owner, ids must still follow this
+            # conversation's previous ones.
+            self._observe_id(last["id"])
+            if message["timestamp"] < last["timestamp"]:
+                message["timestamp"] = last["timestamp"]
+        message["id"] = self._allocate_id()
+        self._append_loaded(cid, conversation, message)
+        if self._storage is not None:
+            self._storage.save_message(cid, message)
+        self._update_summary(cid, message, persist=True)
+        return cid
+
+    def apply_replicated(
+        self, cid: str, position: int, message: Message
+    ) -> None:
+        """Applies a message appended (and persisted) by another worker.
+
+        Conversations that are not loaded here are left to be read from
+        storage; a loaded one that missed a message is dropped and reloaded
+        on next access.
+        """
+        self._observe_id(message["id"])
+        conversation = self._conversations.get(cid)
+        if conversation is not None:
+            if position == conversation.length:
+                self._append_loaded(cid, conversation, message)
+            elif position > conversation.length:
+                del self._conversations[cid]
+        self._update_summary(cid, message, persist=False)
+
+    def _append_loaded(
+        self, cid: str, conversation: _Conversation, message: Message
+    ) -> None:
+        messages = conversation.messages
+        received = conversation.received
+        messages.append(message)
+        received.append(
+            (received[-1] if received else 0)
+            + (message["receiver_email"] == participants(cid)[0])
+        )
+        if (
+            self._storage is not None
+            and len(messages) >= 2 * self.hot_tail_size
+        ):
+            # Trim back to the hot tail; amortized O(1) per append.
+            drop = len(messages) - self.hot_tail_size
+            dropped = received[drop - 1]
+            del messages[:drop]
+            conversation.received = array(
+                "L", (count - dropped for count in received[drop:])
+            )
+            conversation.base += drop
+
+    def _update_summary(
+        self, cid: str, message: Message, persist: bool
+    ) -> None:
+        summaries = self._all_summaries()
+        summary = summaries.pop(cid, None) or ConversationSummary(
+            last_message="",
+            last_sender_email="",
+            last_activity="",
+            unread={},
+        )
+        summary["last_message"] = message["content"][
+            :SNIPPET_LENGTH
+        ]
+        summary["last_sender_email"] = message["sender_email"]
+        summary["last_activity"] = message["timestamp"]
+        receiver = message["receiver_email"]
+        summary["unread"][receiver] = (
+            summary["unread"].get(receiver, 0) + 1
+        )
+        summaries[cid] = summary
+        self._last_activity += 1
+        self._activity[cid] = self._last_activity
+        for email in participants(cid):
+            partner_order = self._partner_orders.get(email)
+            if partner_order is not None:
+                self._reorder(partner_order, cid, email, summary)
+        if persist:
+            self._save_summary(cid, summary)
+
+    def _all_broadcasts(self) -> list[Message]:
+        if self._broadcasts is None:
+            self._broadcasts = (
+                self._storage.load_conversation(
+                    BROADCAST_CONVERSATION
+                )
+                if self._storage is not None
+                else []
+            )
+            self._broadcast_times = [
+                message["timestamp"] for message in self._broadcasts
+            ]
+        return self._broadcasts
+
+    def _insert_broadcast(self, message: Message) -> None:
+        broadcasts = self._all_broadcasts()
+        i = bisect.bisect_right(
+            self._broadcast_times, message["timestamp"]
+        )
+        same_time = bisect.bisect_left(
+            self._broadcast_times, message["timestamp"]
+        )
+        if any(
+            other["id"] == message["id"]
+            for other in broadcasts[same_time:i]
+        ):
+            return
+        broadcasts.insert(i, message)
+        self._broadcast_times.insert(i, message["timestamp"])
+
+    def add_broadcast(self, message: Message) -> None:
+        """Assigns a broadcast its id and stores it once for every conversation."""
+        message["id"] = self._allocate_id()
+        self._insert_broadcast(message)
+        if self._storage is not None:
+            self._storage.save_message(
+                BROADCAST_CONVERSATION, message
+            )
+
+    def apply_replicated_broadcast(self, message: Message) -> None:
+        """Applies a broadcast stored by another worker."""
+        self._observe_id(message["id"])
+        self._insert_broadcast(message)
+
+    def broadcasts_between(
+        self, after: str | None, until: str | None, limit: int
+    ) -> list[Message]:
+        """Returns up to `limit` of the latest broadcasts sent after `after` and up to `until`.
+
+        Either bound may be None for an open range.
+        """
+        broadcasts = self._all_broadcasts()
+        low = (
+            0
+            if after is None
+            else bisect.bisect_right(self._broadcast_times, after)
+        )
+        high = (
+            len(broadcasts)
+            if until is None
+            else bisect.bisect_right(self._broadcast_times, until)
+        )
+        return broadcasts[max(low, high - limit) : high]
+
+    def summary(self, cid: str) -> ConversationSummary | None:
+        """Returns the summary of a conversation, if it has any messages."""
+        return self._all_summaries().get(cid)
+
+    def _cursors(
+        self, cid: str, conversation: _Conversation
+    ) -> dict[str, int]:
+        if conversation.cursors is None:
+            conversation.cursors = (
+                self._storage.load_read_cursors(cid)
+                if self._storage is not None
+                else {}
+            )
+        return conversation.cursors
+
+    async def load_read_state(self, cid: str) -> None:
+        """Loads a conversation and its read cursors in a worker thread if they are not in memory."""
+        await self.load(cid)
+        conversation = self._conversations.get(cid)
+        if (
+            conversation is None
+            or conversation.cursors is not None
+            or self._storage is None
+        ):
+            return
+        cursors = await asyncio.to_thread(
+            self._storage.load_read_cursors, cid
+        )
+        # A cursor may have moved in the meantime.
+        if conversation.cursors is None:
+            conversation.cursors = cursors
+
+    def read_cursor(self, cid: str, email: str) -> int:
+        """Returns the position `email` has read up to in a conversation, or -1."""
+        return self._cursors(cid, self._load(cid)).get(email, -1)
+
+    def mark_read_up_to(
+        self,
+        cid: str,
+        email: str,
+        position: int,
+        persist: bool = True,
+    ) -> bool:
+        """Advances `email`'s read cursor to `position`; returns whether it moved.
+
+        Pass `persist=False` for moves already saved by another worker.
+        Call `load_read_state` first so that nothing is read from storage
+        on the event loop.
+        """
+        conversation = self._load(cid)
+        position = min(position, conversation.length - 1)
+        cursors = self._cursors(cid, conversation)
+        if position <= cursors.get(email, -1):
+            return False
+        cursors[email] = position
+        if persist and self._storage is not None:
+            self._storage.save_read_cursor(
+                cid,
+                email,
+                position,
+                self._id_at(conversation, position),
+            )
+        summary = self._all_summaries().get(cid)
+        if summary is not None:
+            summary["unread"][email] = self._received_after(
+                cid, conversation, email, position
+            )
+            partner_order = self._partner_orders.get(email)
+            if partner_order is not None:
+                self._reorder(partner_order, cid, email, summary)
+            if persist:
+                self._save_summary(cid, summary)
+        return True
+
+    def partner_page(
+        self,
+        email: str,
+        order: str,
+        offset: int,
+        limit: int,
+        among: set[str] | None = None,
+    ) -> tuple[list[str], int]:
+        """Returns one page of `email`'s conversation partners, and their total count.
+
+        `order` is "recent" (most recent activity first) or "unread" (most
+        unread first, then most recent). `among` restricts the partners to
+        a set of emails. Only summaries are read, never message history.
+        """
+        return self._partner_order(email).page(
+            order, offset, limit, among
+        )
+
+    def conversation(self, cid: str) -> list[Message]:
+        """Returns a copy of the retained messages in a conversation, oldest first."""
+        conversation = self._load(cid)
+        return self._read(
+            cid, conversation, conversation.first, conversation.length
+        )
+
+    async def page(
+        self, cid: str, end: int | None, limit: int
+    ) -> tuple[list[Message], int]:
+        """Returns up to `limit` messages before position `end` and the position of the first one.
+
+        With `end=None` the most recent messages are returned. Positions
+        before the hot tail are read from storage in a worker thread.
+        """
+        await self.load(cid)
+        conversation = self._load(cid)
+        if end is None or end > conversation.length:
+            end = conversation.length
+        start = min(max(conversation.first, end - limit), end)
+        if start >= conversation.base:
+            return self._read(cid, conversation, start, end), start
+        stored_end = min(end, conversation.base)
+        stored = await asyncio.to_thread(
+            self._storage.load_conversation_range,
+            cid,
+            start,
+            stored_end,
+            self._id_at(conversation, stored_end),
+        )
+        self._anchor(conversation, start, stored_end, stored)
+        if end > stored_end:
+            # Appends may have trimmed the tail during the read.
+            stored += self._read(cid, conversation, stored_end, end)
+        return stored, start
+
+    def conversation_length(self, cid: str) -> int:
+        """Returns the number of messages in a conversation."""
+        return self._load(cid).length
+
+    def first_position(self, cid: str) -> int:
+        """Returns the position of the oldest message still retained (0 unless archive segments were deleted)."""
+        return self._load(cid).first
+
+
+message_store = MessageStore(
+    storage,
+    hot_tail_size=settings.HOT_TAIL_SIZE,
+    max_conversations=settings.HOT_CONVERSATIONS,
+)
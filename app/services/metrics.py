@@ -0,0 +1,191 @@
+import bisect
+import json
+from collections import defaultdict
+from typing import Any
+
+Labels = tuple[tuple[str, str], ...]
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+SIZE_BUCKETS = (
+    64,
+    256,
+    1024,
+    4096,
+    16384,
+    65536,
+    262144,
+    1048576,
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(
+        self, buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Records one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide counters, gauges and histograms, keyed by name and label set."""
+
+    def __init__(self) -> None:
+        self._counters: defaultdict[
+            tuple[str, Labels], float
+        ] = defaultdict(float)
+        self._gauges: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[
+            tuple[str, Labels], Histogram
+        ] = {}
+
+    def inc(
+        self, name: str, value: float = 1, **labels: str
+    ) -> None:
+        """Adds `value` to a counter."""
+        self._counters[
+            (name, tuple(sorted(labels.items())))
+        ] += value
+
+    def set_gauge(
+        self, name: str, value: float, **labels: str
+    ) -> None:
+        """Sets a gauge to `value`."""
+        self._gauges[
+            (name, tuple(sorted(labels.items())))
+        ] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """Records `value` in a histogram, created with `buckets` on first use."""
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(
+                buckets
+            )
+        histogram.observe(value)
+
+    def snapshot(self) -> dict[tuple[str, Labels], float]:
+        """Returns a copy of every counter and gauge."""
+        return {**self._counters, **self._gauges}
+
+    def histograms(self) -> dict[tuple[str, Labels], Histogram]:
+        """Returns every histogram."""
+        return dict(self._histograms)
+
+    def exposition(self) -> str:
+        """Renders every metric in the Prometheus text format."""
+        lines: list[str] = []
+        for kind, values in (
+            ("counter", self._counters),
+            ("gauge", self._gauges),
+        ):
+            typed: set[str] = set()
+            for (name, labels), value in sorted(
+                values.items()
+            ):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(
+                    f"{name}{_format_labels(labels)} {value}"
+                )
+        typed = set()
+        for (name, labels), histogram in sorted(
+            self._histograms.items(), key=lambda item: item[0]
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(
+                (*histogram.buckets, "+Inf"), histogram.counts
+            ):
+                cumulative += count
+                bucket_labels = (*labels, ("le", str(bound)))
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} {histogram.sum}"
+            )
+            lines.append(
+                f"{name}_count{_format_labels(labels)} {histogram.count}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{key}="{_escape_label(value)}"'
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _escape_label(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def payload_size(value: Any) -> int:
+    """Returns the size in bytes of `value` serialized as compact JSON."""
+    return len(
+        json.dumps(
+            value, separators=(",", ":"), default=str
+        ).encode()
+    )
+
+
+def record_state_delta(delta: dict[str, dict[str, Any]]) -> None:
+    """Counts the frames and serialized bytes of an outgoing state delta, per var."""
+    metrics.inc("state_update_frames_total")
+    for state_name, changes in delta.items():
+        for var_name, value in changes.items():
+            size = payload_size(value)
+            metrics.inc(
+                "state_update_bytes_total",
+                size,
+                state=state_name,
+                var=var_name,
+            )
+            metrics.inc(
+                "state_update_vars_total",
+                state=state_name,
+                var=var_name,
+            )
+
+
+metrics = Metrics()
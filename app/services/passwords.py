@@ -0,0 +1,142 @@
+import asyncio
+import concurrent.futures
+import time
+from typing import Callable, TypeVar
+
+import bcrypt
+
+from app import settings
+from app.services.metrics import metrics
+
+T = TypeVar("T")
+
+
+class HasherBusyError(Exception):
+    """Raised when too many hash/verify requests are already waiting."""
+
+
+def hash_password(
+    password: str, rounds: int = settings.BCRYPT_ROUNDS
+) -> str:
+    """Hashes a password using bcrypt."""
+    return bcrypt.hashpw(
+        password.encode(), bcrypt.gensalt(rounds)
+    ).decode()
+
+
+def verify_password(
+    plain_password: str, hashed_password: str
+) -> bool:
+    """Verifies a plain password against a hashed one."""
+    return bcrypt.checkpw(
+        plain_password.encode(), hashed_password.encode()
+    )
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so it never blocks the event loop."""
+
+    def __init__(
+        self,
+        executor: str,
+        max_workers: int,
+        max_waiting: int,
+        rounds: int,
+    ) -> None:
+        if executor not in ("thread", "process"):
+            raise ValueError(
+                f"Unknown password hash executor {executor!r}; expected 'thread' or 'process'."
+            )
+        self.executor_kind = executor
+        self.max_workers = max_workers
+        self.max_waiting = max_waiting
+        self.rounds = rounds
+        self._executor: concurrent.futures.Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._waiting = 0
+
+    def _pool(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = (
+                    concurrent.futures.ProcessPoolExecutor(
+                        self.max_workers
+                    )
+                )
+            else:
+                self._executor = (
+                    concurrent.futures.ThreadPoolExecutor(
+                        self.max_workers,
+                        thread_name_prefix="bcrypt",
+                    )
+                )
+        return self._executor
+
+    async def _run(
+        self, op: str, fn: Callable[..., T], *args
+    ) -> T:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        if self._slots.locked():
+            if self._waiting >= self.max_waiting:
+                metrics.inc(
+                    "password_hash_rejected_total", op=op
+                )
+                raise HasherBusyError(
+                    "Too many password operations are queued."
+                )
+        self._waiting += 1
+        metrics.set_gauge(
+            "password_hash_queue_depth", self._waiting
+        )
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+            metrics.set_gauge(
+                "password_hash_queue_depth", self._waiting
+            )
+        try:
+            started = time.perf_counter()
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._pool(), fn, *args
+            )
+            metrics.observe(
+                "password_hash_seconds",
+                time.perf_counter() - started,
+                op=op,
+            )
+            return result
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """Hashes a password on the worker pool."""
+        return await self._run(
+            "hash", hash_password, password, self.rounds
+        )
+
+    async def verify(
+        self, plain_password: str, hashed_password: str
+    ) -> bool:
+        """Verifies a password on the worker pool."""
+        return await self._run(
+            "verify",
+            verify_password,
+            plain_password,
+            hashed_password,
+        )
+
+    def shutdown(self) -> None:
+        """Stops the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    settings.PASSWORD_HASH_EXECUTOR,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_waiting=settings.PASSWORD_HASH_MAX_WAITING,
+    rounds=settings.BCRYPT_ROUNDS,
+)
@@ -0,0 +1,251 @@
+import asyncio
+import math
+import time
+from collections.abc import Hashable
+from typing import Any
+
+from app import settings
+from app.services.cluster import Cluster, cluster
+from app.services.metrics import metrics
+
+
+class TimerWheel:
+    """Expires keys a fixed time after they were last touched.
+
+    Keys sit in the slot of the tick they expire at, so touching a key and
+    advancing one tick are both O(1) (amortized over the keys that expire).
+    A touched key may be left in an older slot; it is skipped there because
+    its deadline moved.
+    """
+
+    def __init__(self, tick_s: float, slots: int) -> None:
+        self.tick_s = tick_s
+        self._slots: list[set[Hashable]] = [
+            set() for _ in range(slots)
+        ]
+        self._deadlines: dict[Hashable, int] = {}
+        self._tick = self._now_tick()
+
+    def _now_tick(self) -> int:
+        return int(time.monotonic() / self.tick_s)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def touch(self, key: Hashable, timeout_s: float) -> bool:
+        """(Re)starts the timeout of `key`, returning whether it was new."""
+        ticks = min(
+            max(1, math.ceil(timeout_s / self.tick_s)),
+            len(self._slots) - 1,
+        )
+        deadline = self._now_tick() + ticks
+        previous = self._deadlines.get(key)
+        if previous == deadline:
+            return False
+        self._deadlines[key] = deadline
+        self._slots[deadline % len(self._slots)].add(key)
+        return previous is None
+
+    def discard(self, key: Hashable) -> bool:
+        """Forgets `key` without expiring it, returning whether it was present."""
+        return self._deadlines.pop(key, None) is not None
+
+    def advance(self) -> list[Hashable]:
+        """Moves to the current tick and returns the keys that expired."""
+        now = self._now_tick()
+        expired = []
+        # Past one full turn every slot has been visited once.
+        first = max(self._tick + 1, now - len(self._slots) + 1)
+        for tick in range(first, now + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for key in slot:
+                deadline = self._deadlines.get(key)
+                if deadline is not None and deadline <= now:
+                    del self._deadlines[key]
+                    expired.append(key)
+            slot.clear()
+        self._tick = now
+        return expired
+
+
+class Presence:
+    """Ephemeral online and typing status, kept in memory only.
+
+    A user is online while one of their sessions keeps sending heartbeats;
+    typing lasts until no typing event arrived for a few seconds. Only
+    changes are pushed: watchers (admins) get an event when a user comes
+    online or goes offline, and the partner gets one when a user starts or
+    stops typing to them. Each worker expires its own heartbeats and tells
+    the others, so a user is online if any worker has a live session; what
+    a worker reported is dropped when it leaves the bus.
+    """
+
+    def __init__(
+        self,
+        cluster: Cluster,
+        online_timeout_s: float,
+        typing_timeout_s: float,
+    ) -> None:
+        self.cluster = cluster
+        self.online_timeout = online_timeout_s
+        self.typing_timeout = typing_timeout_s
+        self._online = TimerWheel(1.0, 128)
+        self._typing = TimerWheel(1.0, 16)
+        self._remote_online: dict[str, set[str]] = {}
+        self._remote_typing: dict[tuple[str, str], set[str]] = {}
+        self._watchers: set[str] = set()
+        self._tick_handle: asyncio.TimerHandle | None = None
+        cluster.register("presence", self._apply_remote)
+        cluster.register("typing", self._apply_remote)
+        cluster.on_departure(self._forget_worker)
+
+    def watch(self, email: str) -> None:
+        """Pushes online/offline events to `email` from now on."""
+        self._watchers.add(email)
+
+    def is_online(self, email: str) -> bool:
+        return email in self._online or bool(
+            self._remote_online.get(email)
+        )
+
+    def is_typing(self, email: str, to: str) -> bool:
+        key = (email, to)
+        return key in self._typing or bool(
+            self._remote_typing.get(key)
+        )
+
+    def heartbeat(self, email: str) -> None:
+        """Marks `email` online for another timeout period."""
+        was_online = self.is_online(email)
+        if self._online.touch(email, self.online_timeout):
+            self._changed("presence", email, "", True, was_online)
+        self._schedule_tick()
+
+    def typing(self, email: str, to: str) -> None:
+        """Marks `email` as typing to `to` for another timeout period."""
+        was_typing = self.is_typing(email, to)
+        if self._typing.touch((email, to), self.typing_timeout):
+            self._changed("typing", email, to, True, was_typing)
+        self._schedule_tick()
+
+    def stop_typing(self, email: str, to: str) -> None:
+        """Clears the typing status, e.g. once the message was sent."""
+        was_typing = self.is_typing(email, to)
+        if self._typing.discard((email, to)):
+            self._changed("typing", email, to, False, was_typing)
+
+    def _changed(
+        self,
+        kind: str,
+        email: str,
+        to: str,
+        active: bool,
+        was_active: bool,
+    ) -> None:
+        """Tells other workers about a local change and pushes it if the overall status flipped."""
+        event = {
+            "type": kind,
+            "email": email,
+            "to": to,
+            "active": active,
+            "worker": self.cluster.worker_id,
+        }
+        self.cluster.replicate(event)
+        now_active = (
+            self.is_online(email)
+            if kind == "presence"
+            else self.is_typing(email, to)
+        )
+        if now_active != was_active:
+            self._push(event)
+
+    def _push(self, event: dict[str, Any]) -> None:
+        metrics.inc("presence_events_total", kind=event["type"])
+        recipients = (
+            self._watchers
+            if event["type"] == "presence"
+            else (event["to"],)
+        )
+        for email in recipients:
+            self.cluster.hub.publish(email, event)
+
+    def _apply_remote(self, event: dict[str, Any]) -> None:
+        """Applies a presence or typing change made on another worker."""
+        email = event["email"]
+        if event["type"] == "presence":
+            was_active = self.is_online(email)
+            workers = self._remote_online.setdefault(email, set())
+        else:
+            was_active = self.is_typing(email, event["to"])
+            workers = self._remote_typing.setdefault(
+                (email, event["to"]), set()
+            )
+        if event["active"]:
+            workers.add(event["worker"])
+        else:
+            workers.discard(event["worker"])
+        now_active = (
+            self.is_online(email)
+            if event["type"] == "presence"
+            else self.is_typing(email, event["to"])
+        )
+        if not workers:
+            if event["type"] == "presence":
+                del self._remote_online[email]
+            else:
+                del self._remote_typing[(email, event["to"])]
+        if now_active != was_active:
+            self._push(event)
+
+    def _forget_worker(self, worker: str) -> None:
+        """Clears what a departed worker reported; its sessions went with it."""
+        for email, workers in list(self._remote_online.items()):
+            if worker in workers:
+                self._apply_remote(
+                    {
+                        "type": "presence",
+                        "email": email,
+                        "to": "",
+                        "active": False,
+                        "worker": worker,
+                    }
+                )
+        for (email, to), workers in list(
+            self._remote_typing.items()
+        ):
+            if worker in workers:
+                self._apply_remote(
+                    {
+                        "type": "typing",
+                        "email": email,
+                        "to": to,
+                        "active": False,
+                        "worker": worker,
+                    }
+                )
+
+    def _schedule_tick(self) -> None:
+        if self._tick_handle is None:
+            self._tick_handle = asyncio.get_running_loop().call_later(
+                self._online.tick_s, self._tick
+            )
+
+    def _tick(self) -> None:
+        """Expires stale heartbeats and typing, rescheduling while any are live."""
+        self._tick_handle = None
+        for email, to in self._typing.advance():
+            self._changed("typing", email, to, False, True)
+        for email in self._online.advance():
+            self._changed("presence", email, "", False, True)
+        if len(self._online) or len(self._typing):
+            self._schedule_tick()
+
+
+presence = Presence(
+    cluster,
+    settings.PRESENCE_TIMEOUT_S,
+    settings.TYPING_TIMEOUT_S,
+)
@@ -0,0 +1,136 @@
+import time
+from collections import OrderedDict
+
+from app import settings
+from app.services.metrics import metrics
+
+# Buckets kept per user and per session before idle ones are evicted.
+MAX_TRACKED_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Allows `rate` actions per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+
+    def available(self, now: float) -> bool:
+        """Whether one action is allowed at `now`, without consuming it."""
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self) -> None:
+        """Consumes one action; call after `available` returned True."""
+        self.tokens -= 1
+
+
+class SendLimiter:
+    """Admission control for message sends.
+
+    A send must fit the sender's in-flight limit and a token from the
+    session's, the user's and the global bucket. Tokens are only consumed
+    when every check passes, so a rejected send costs nothing.
+    """
+
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        session_rate: float,
+        session_burst: float,
+        global_rate: float,
+        global_burst: float,
+        max_in_flight: int,
+    ) -> None:
+        self.user_limits = (user_rate, user_burst)
+        self.session_limits = (session_rate, session_burst)
+        self.max_in_flight = max_in_flight
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._sessions: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._in_flight: dict[str, int] = {}
+
+    @staticmethod
+    def _bucket(
+        buckets: OrderedDict[str, TokenBucket],
+        key: str,
+        limits: tuple[float, float],
+    ) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*limits)
+            if len(buckets) > MAX_TRACKED_BUCKETS:
+                # The least recently used bucket has long refilled.
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, email: str, session: str) -> str | None:
+        """Admits one send, or returns why it was throttled.
+
+        The reason is "in_flight", "session", "user" or "global". An admitted
+        send must be followed by `release(email)`.
+        """
+        reason = None
+        if self._in_flight.get(email, 0) >= self.max_in_flight:
+            reason = "in_flight"
+        else:
+            now = time.monotonic()
+            buckets = (
+                (
+                    "session",
+                    self._bucket(
+                        self._sessions, session, self.session_limits
+                    ),
+                ),
+                (
+                    "user",
+                    self._bucket(
+                        self._users, email, self.user_limits
+                    ),
+                ),
+                ("global", self._global),
+            )
+            for name, bucket in buckets:
+                if not bucket.available(now):
+                    reason = name
+                    break
+            else:
+                for _, bucket in buckets:
+                    bucket.take()
+        if reason is not None:
+            metrics.inc("send_throttled_total", reason=reason)
+            return reason
+        self._in_flight[email] = self._in_flight.get(email, 0) + 1
+        metrics.inc("send_admitted_total")
+        return None
+
+    def release(self, email: str) -> None:
+        """Ends an admitted send."""
+        remaining = self._in_flight.get(email, 0) - 1
+        if remaining > 0:
+            self._in_flight[email] = remaining
+        else:
+            self._in_flight.pop(email, None)
+
+
+send_limiter = SendLimiter(
+    user_rate=settings.SEND_RATE_PER_USER,
+    user_burst=settings.SEND_BURST_PER_USER,
+    session_rate=settings.SEND_RATE_PER_SESSION,
+    session_burst=settings.SEND_BURST_PER_SESSION,
+    global_rate=settings.SEND_RATE_GLOBAL,
+    global_burst=settings.SEND_BURST_GLOBAL,
+    max_in_flight=settings.SEND_MAX_IN_FLIGHT,
+)
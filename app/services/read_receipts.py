@@ -0,0 +1,70 @@
+import asyncio
+
+from app import settings
+from app.services.cluster import Cluster, cluster
+from app.services.message_store import (
+    MessageStore,
+    message_store,
+)
+
+
+class ReadReceiptBatcher:
+    """Coalesces read-cursor moves and emits one receipt per debounce window.
+
+    Marking read only records the furthest position per (conversation,
+    reader). When the window closes, each cursor is advanced once and both
+    participants get a single receipt event with the new position. Read
+    state that is not in memory is loaded in a worker thread first.
+    """
+
+    def __init__(
+        self,
+        store: MessageStore,
+        cluster: Cluster,
+        debounce_ms: int,
+    ) -> None:
+        self.store = store
+        self.cluster = cluster
+        self.debounce = debounce_ms / 1000
+        self._pending: dict[tuple[str, str], int] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flushing: set[asyncio.Task] = set()
+
+    def mark_read(
+        self, cid: str, email: str, position: int
+    ) -> None:
+        """Records that `email` has seen `cid` up to `position`."""
+        key = (cid, email)
+        if position <= self._pending.get(key, -1):
+            return
+        self._pending[key] = position
+        if self._flush_handle is None:
+            self._flush_handle = (
+                asyncio.get_running_loop().call_later(
+                    self.debounce, self._start_flush
+                )
+            )
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        task = asyncio.ensure_future(self.flush())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self) -> None:
+        """Applies every pending cursor move and publishes the receipts."""
+        pending, self._pending = self._pending, {}
+        for (cid, email), position in pending.items():
+            await self.store.load_read_state(cid)
+            if not self.store.mark_read_up_to(
+                cid, email, position
+            ):
+                continue
+            self.cluster.publish_receipt(cid, email, position)
+
+
+read_receipts = ReadReceiptBatcher(
+    message_store,
+    cluster,
+    settings.READ_RECEIPT_DEBOUNCE_MS,
+)
@@ -0,0 +1,242 @@
+import asyncio
+import bisect
+import datetime
+import logging
+import re
+from array import array
+
+from app.models import Message
+from app.services.storage import Storage, StorageWriteError, storage
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w{2,}")
+
+
+def tokenize(text: str) -> set[str]:
+    """Returns the distinct lower-cased search tokens of `text`."""
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def to_epoch(timestamp: str) -> float:
+    """Converts a naive UTC ISO timestamp to epoch seconds."""
+    return (
+        datetime.datetime.fromisoformat(timestamp)
+        .replace(tzinfo=datetime.timezone.utc)
+        .timestamp()
+    )
+
+
+def _insert(postings: array, message_id: int) -> int:
+    """Inserts an id keeping the array sorted; returns its index."""
+    if not postings or postings[-1] < message_id:
+        postings.append(message_id)
+        return len(postings) - 1
+    i = bisect.bisect_left(postings, message_id)
+    postings.insert(i, message_id)
+    return i
+
+
+def _contains(postings: array, message_id: int) -> bool:
+    i = bisect.bisect_left(postings, message_id)
+    return i < len(postings) and postings[i] == message_id
+
+
+class SearchIndex:
+    """Incrementally updated inverted index over message content.
+
+    Posting lists are arrays of message ids in ascending order (ids are
+    assigned in order, so inserts are almost always appends), so
+    intersections are bisects from the shortest list. Messages are also
+    indexed by sender. Ids are not in time order (they interleave across
+    workers and imports keep their exported ids), so send times are kept
+    twice: an id-sorted column to check a candidate's time, and a
+    time-sorted (time, id) column to enumerate a date range. Postings are
+    persisted with the messages and loaded on the first search.
+    """
+
+    def __init__(self, storage: Storage | None = None) -> None:
+        self._storage = storage
+        self._postings: dict[str, array] = {}
+        self._by_sender: dict[str, array] = {}
+        self._ids = array("Q")
+        self._times = array("d")
+        self._by_time = array("d")
+        self._by_time_ids = array("Q")
+        self._loaded = storage is None
+        self._loading: asyncio.Future | None = None
+        self._pending: list[Message] = []
+
+    def _index(self, message: Message, tokens: set[str]) -> None:
+        message_id = message["id"]
+        for token in tokens:
+            _insert(
+                self._postings.setdefault(token, array("Q")),
+                message_id,
+            )
+        _insert(
+            self._by_sender.setdefault(
+                message["sender_email"], array("Q")
+            ),
+            message_id,
+        )
+        sent = to_epoch(message["timestamp"])
+        self._times.insert(_insert(self._ids, message_id), sent)
+        i = bisect.bisect_right(self._by_time, sent)
+        self._by_time.insert(i, sent)
+        self._by_time_ids.insert(i, message_id)
+
+    def add(self, message: Message, persist: bool = True) -> None:
+        """Indexes a newly appended message and persists its postings.
+
+        Pass `persist=False` for messages whose postings another worker saved.
+        """
+        if not persist and not self._loaded:
+            # Already in storage; it is read from there when the index loads.
+            return
+        tokens = tokenize(message["content"])
+        if persist and self._storage is not None:
+            self._storage.save_postings(message["id"], tokens)
+        if self._loaded:
+            self._index(message, tokens)
+        else:
+            self._pending.append(message)
+
+    def _load(self) -> None:
+        """Builds the in-memory index from storage (runs in a worker thread)."""
+        postings: dict[str, array] = {}
+        for token, message_id in self._storage.load_search_postings():
+            postings.setdefault(token, array("Q")).append(
+                message_id
+            )
+        by_sender: dict[str, array] = {}
+        ids, times = array("Q"), array("d")
+        for (
+            message_id,
+            sender,
+            timestamp,
+        ) in self._storage.load_message_metadata():
+            by_sender.setdefault(sender, array("Q")).append(
+                message_id
+            )
+            ids.append(message_id)
+            times.append(to_epoch(timestamp))
+        order = sorted(range(len(ids)), key=times.__getitem__)
+        self._postings, self._by_sender = postings, by_sender
+        self._ids, self._times = ids, times
+        self._by_time = array("d", (times[i] for i in order))
+        self._by_time_ids = array("Q", (ids[i] for i in order))
+
+    async def ensure_loaded(self) -> None:
+        """Loads the persisted index once, off the event loop.
+
+        A load that fails is retried by the next call.
+        """
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(
+                self._load_async()
+            )
+            self._loading.add_done_callback(self._forget_failed_load)
+        await asyncio.shield(self._loading)
+
+    def _forget_failed_load(self, loading: asyncio.Future) -> None:
+        if loading.cancelled() or loading.exception() is not None:
+            self._loading = None
+
+    async def _load_async(self) -> None:
+        try:
+            await self._storage.flush()
+        except StorageWriteError:
+            # Messages added since startup are indexed from _pending anyway.
+            logger.warning("Loading the search index after dropped writes.")
+        await asyncio.to_thread(self._load)
+        for message in self._pending:
+            if not _contains(self._ids, message["id"]):
+                self._index(message, tokenize(message["content"]))
+        self._pending = []
+        self._loaded = True
+
+    def _time_range(
+        self, since: float | None, until: float | None
+    ) -> tuple[int, int]:
+        """Maps an epoch time range onto the slice of the time-sorted column sent in it."""
+        low = (
+            bisect.bisect_left(self._by_time, since)
+            if since is not None
+            else 0
+        )
+        high = (
+            bisect.bisect_right(self._by_time, until)
+            if until is not None
+            else len(self._by_time)
+        )
+        return low, max(low, high)
+
+    def _sent_in(
+        self,
+        message_id: int,
+        since: float | None,
+        until: float | None,
+    ) -> bool:
+        sent = self._times[bisect.bisect_left(self._ids, message_id)]
+        return (since is None or sent >= since) and (
+            until is None or sent <= until
+        )
+
+    def search(
+        self,
+        query: str,
+        sender: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int = 50,
+    ) -> list[int]:
+        """Returns the ids of the newest messages matching every filter, newest first.
+
+        `query` tokens must all appear in the content; `sender` and the
+        epoch range [`since`, `until`] further restrict the matches. At least
+        one of `query` and `sender` is required.
+        """
+        lists = []
+        for token in tokenize(query):
+            postings = self._postings.get(token)
+            if postings is None:
+                return []
+            lists.append(postings)
+        if sender:
+            postings = self._by_sender.get(sender)
+            if postings is None:
+                return []
+            lists.append(postings)
+        if not lists:
+            return []
+        lists.sort(key=len)
+        driver, others = lists[0], lists[1:]
+        if since is None and until is None:
+            candidates = reversed(driver)
+        else:
+            low, high = self._time_range(since, until)
+            if high - low < len(driver):
+                # Fewer messages were sent in the range than match the
+                # rarest filter: enumerate the range instead.
+                others = lists
+                candidates = sorted(
+                    self._by_time_ids[low:high], reverse=True
+                )
+            else:
+                candidates = (
+                    message_id
+                    for message_id in reversed(driver)
+                    if self._sent_in(message_id, since, until)
+                )
+        matches = []
+        for message_id in candidates:
+            if all(_contains(other, message_id) for other in others):
+                matches.append(message_id)
+                if len(matches) == limit:
+                    break
+        return matches
+
+search_index = SearchIndex(storage)
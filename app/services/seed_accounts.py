@@ -0,0 +1,49 @@
+import asyncio
+import functools
+import json
+
+from app.models import User
+from app.services.passwords import password_hasher
+
+
+@functools.cache
+def load_credentials(path: str) -> dict[str, User]:
+    """Reads precomputed seed accounts from a JSON credentials file."""
+    if not path:
+        return {}
+    with open(path) as f:
+        raw = json.load(f)
+    return {
+        email.strip().lower(): User(
+            password=entry["password"],
+            name=entry["name"],
+            profile_photo=entry["profile_photo"],
+        )
+        for email, entry in raw.items()
+    }
+
+
+class LazyPasswordHash:
+    """A bcrypt hash of a fixed password, computed once on first use."""
+
+    def __init__(
+        self, password: str, precomputed: str = ""
+    ) -> None:
+        self._password = password
+        self._hash = precomputed or None
+        self._pending: asyncio.Future[str] | None = None
+
+    async def get(self) -> str:
+        """Returns the hash, computing it on the worker pool the first time."""
+        if self._hash is not None:
+            return self._hash
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(
+                password_hasher.hash(self._password)
+            )
+        try:
+            self._hash = await asyncio.shield(self._pending)
+        except Exception:
+            self._pending = None
+            raise
+        return self._hash
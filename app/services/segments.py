@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any
+
+MAGIC = b"CHATSEG1"
+# Index offset, index length, magic.
+TRAILER = struct.Struct(">QI8s")
+
+
+def write_segment(
+    path: str, blocks: dict[str, list[tuple[Any, ...]]]
+) -> None:
+    """Writes an immutable segment holding one compressed block of message rows per conversation.
+
+    Rows must be ordered within each block. The file ends with a compressed
+    offset index mapping each conversation id to
+    [offset, length, first id, last id] of its block, then a fixed trailer
+    locating the index. The file is written aside and renamed into place.
+    """
+    index = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        for cid, rows in blocks.items():
+            data = zlib.compress(
+                json.dumps(rows, separators=(",", ":")).encode()
+            )
+            ids = [row[0] for row in rows]
+            index[cid] = [f.tell(), len(data), min(ids), max(ids)]
+            f.write(data)
+        index_offset = f.tell()
+        data = zlib.compress(json.dumps(index).encode())
+        f.write(data)
+        f.write(TRAILER.pack(index_offset, len(data), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentReader:
+    """Reads blocks of one segment through a read-only memory map."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        index_offset, index_length, magic = TRAILER.unpack(
+            self._map[-TRAILER.size :]
+        )
+        if magic != MAGIC or self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a message segment.")
+        self.index: dict[str, list[int]] = json.loads(
+            zlib.decompress(
+                self._map[index_offset : index_offset + index_length]
+            )
+        )
+
+    def read_block(self, cid: str) -> list[list[Any]]:
+        """Returns the rows of `cid`'s block, or [] if the segment has none."""
+        entry = self.index.get(cid)
+        if entry is None:
+            return []
+        offset, length, _, _ = entry
+        return json.loads(
+            zlib.decompress(self._map[offset : offset + length])
+        )
+
+    def read_ids(self, ids: set[int]) -> list[list[Any]]:
+        """Returns the rows whose id is in `ids`, reading only blocks whose id range covers one."""
+        rows = []
+        for cid, (_, _, first_id, last_id) in self.index.items():
+            if any(first_id <= i <= last_id for i in ids):
+                rows.extend(
+                    row
+                    for row in self.read_block(cid)
+                    if row[0] in ids
+                )
+        return rows
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class SegmentCache:
+    """Keeps the most recently read segments mapped, closing the least recently used.
+
+    Reads may come from several threads; they hold a lock so a segment is
+    never unmapped while another thread reads it.
+    """
+
+    def __init__(self, directory: str, max_open: int) -> None:
+        self.directory = directory
+        self.max_open = max_open
+        self._open: OrderedDict[str, SegmentReader] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def read_block(
+        self, name: str, cid: str
+    ) -> list[list[Any]] | None:
+        """Returns `cid`'s rows in segment `name`, or None if its file is gone."""
+        with self._lock:
+            reader = self._get(name)
+            return None if reader is None else reader.read_block(cid)
+
+    def read_ids(
+        self, name: str, ids: set[int]
+    ) -> list[list[Any]] | None:
+        """Returns the rows of segment `name` whose id is in `ids`, or None if its file is gone."""
+        with self._lock:
+            reader = self._get(name)
+            return None if reader is None else reader.read_ids(ids)
+
+    def _get(self, name: str) -> SegmentReader | None:
+        reader = self._open.get(name)
+        if reader is not None:
+            self._open.move_to_end(name)
+            return reader
+        try:
+            reader = SegmentReader(self.path(name))
+        except FileNotFoundError:
+            return None
+        self._open[name] = reader
+        if len(self._open) > self.max_open:
+            _, oldest = self._open.popitem(last=False)
+            oldest.close()
+        return reader
+
+    def evict(self, name: str) -> None:
+        """Closes segment `name` if it is mapped."""
+        with self._lock:
+            reader = self._open.pop(name, None)
+            if reader is not None:
+                reader.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for reader in self._open.values():
+                reader.close()
+            self._open.clear()
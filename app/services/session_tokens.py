@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any
+
+from jose import JWTError, jwt
+
+from app import settings
+from app.services.cluster import Cluster, cluster
+from app.services.storage import Storage, storage
+
+ALGORITHM = "HS256"
+# Cookie holding the session token in the browser.
+SESSION_COOKIE = "chat_session"
+
+
+class SessionTokens:
+    """Issues and verifies signed, expiring session tokens (HS256 JWTs).
+
+    Verifying is an HMAC, not a password hash; recently verified tokens are
+    also kept in a small LRU so reconnect storms skip even that. Each token
+    carries an id; revoking it stores the id until the token would have
+    expired anyway and tells the other workers, so a signed-out token stops
+    working everywhere and across restarts.
+    """
+
+    def __init__(
+        self,
+        secret: str,
+        ttl_s: int,
+        cache_size: int,
+        storage: Storage,
+        cluster: Cluster,
+    ) -> None:
+        self.secret = secret
+        self.ttl_s = ttl_s
+        self.cache_size = cache_size
+        self.storage = storage
+        self.cluster = cluster
+        self._verified: OrderedDict[
+            str, tuple[str, float, str]
+        ] = OrderedDict()
+        self._revoked: set[str] = set()
+        # (expiry, token id) of revoked tokens, soonest first.
+        self._revoked_expiry: list[tuple[float, str]] = []
+        cluster.register("revoke", self._apply_revoked)
+
+    async def load(self) -> None:
+        """Loads the revocations of tokens that have not expired yet."""
+        now = time.time()
+        revoked = await asyncio.to_thread(
+            self.storage.load_revoked_sessions, now
+        )
+        for token_id, expires in revoked:
+            self._add_revoked(token_id, expires)
+        self.storage.purge_revoked_sessions(now)
+
+    def issue(self, email: str) -> str:
+        """Returns a token identifying `email` until it expires or is revoked."""
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "sub": email,
+                "jti": secrets.token_urlsafe(16),
+                "iat": now,
+                "exp": now + self.ttl_s,
+            },
+            self.secret,
+            algorithm=ALGORITHM,
+        )
+
+    def verify(self, token: str) -> str | None:
+        """Returns the email a valid, unexpired, unrevoked token was issued for, or None."""
+        cached = self._verified.get(token)
+        if cached is not None:
+            email, expires, token_id = cached
+            if (
+                time.time() < expires
+                and token_id not in self._revoked
+            ):
+                self._verified.move_to_end(token)
+                return email
+            del self._verified[token]
+            return None
+        claims = self._claims(token)
+        if claims is None:
+            return None
+        email, token_id = claims.get("sub"), claims.get("jti")
+        if not isinstance(email, str) or not isinstance(
+            token_id, str
+        ):
+            return None
+        if token_id in self._revoked:
+            return None
+        self._verified[token] = (email, claims["exp"], token_id)
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return email
+
+    def revoke(self, token: str) -> None:
+        """Stops a token from verifying on every worker, until it expires anyway."""
+        self._verified.pop(token, None)
+        claims = self._claims(token)
+        token_id = claims and claims.get("jti")
+        if not isinstance(token_id, str):
+            return
+        expires = float(claims["exp"])
+        self._add_revoked(token_id, expires)
+        self.storage.save_revoked_session(token_id, expires)
+        self.cluster.replicate(
+            {
+                "type": "revoke",
+                "token_id": token_id,
+                "expires": expires,
+            }
+        )
+
+    def _claims(self, token: str) -> dict[str, Any] | None:
+        try:
+            return jwt.decode(
+                token, self.secret, algorithms=[ALGORITHM]
+            )
+        except JWTError:
+            return None
+
+    def _apply_revoked(self, event: dict[str, Any]) -> None:
+        self._add_revoked(event["token_id"], event["expires"])
+
+    def _add_revoked(self, token_id: str, expires: float) -> None:
+        now = time.time()
+        expiry = self._revoked_expiry
+        while expiry and expiry[0][0] <= now:
+            self._revoked.discard(heapq.heappop(expiry)[1])
+        if expires > now and token_id not in self._revoked:
+            self._revoked.add(token_id)
+            heapq.heappush(expiry, (expires, token_id))
+
+
+session_tokens = SessionTokens(
+    # Without a configured secret, sessions do not survive a restart and
+    # are not shared between backend workers.
+    secret=settings.SESSION_SECRET or secrets.token_urlsafe(32),
+    ttl_s=settings.SESSION_TTL_S,
+    cache_size=settings.SESSION_CACHE_SIZE,
+    storage=storage,
+    cluster=cluster,
+)
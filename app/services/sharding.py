@@ -0,0 +1,35 @@
+import bisect
+import hashlib
+
+# Points per node on the ring; more points spread keys more evenly.
+RING_REPLICAS = 64
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent-hash ring assigning keys (conversation ids) to nodes (workers).
+
+    Adding or removing a node only moves the keys on that node's arcs.
+    """
+
+    def __init__(
+        self, nodes: list[str], replicas: int = RING_REPLICAS
+    ) -> None:
+        self.nodes = sorted(nodes)
+        points = sorted(
+            (_point(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """Returns the node responsible for `key`."""
+        i = bisect.bisect(self._points, _point(key))
+        return self._owners[i % len(self._owners)]
@@ -0,0 +1,54 @@
+import contextlib
+import json
+import logging
+import time
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+    """Records how long each named phase of app startup takes."""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Times the enclosed block as phase `name`."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                (name, time.perf_counter() - started)
+            )
+
+    def report(self) -> None:
+        """Writes the collected phase timings, if profiling is enabled."""
+        if not self.enabled:
+            return
+        report = {
+            "total_ms": (time.perf_counter() - self.started)
+            * 1000,
+            "phases": [
+                {"name": name, "ms": seconds * 1000}
+                for name, seconds in self.phases
+            ],
+        }
+        if settings.STARTUP_PROFILE_OUTPUT:
+            with open(settings.STARTUP_PROFILE_OUTPUT, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            logger.warning("Startup profile: %s", report)
+
+
+startup_profiler = StartupProfiler(
+    settings.STARTUP_PROFILE_ENABLED
+)
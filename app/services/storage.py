@@ -0,0 +1,1117 @@
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from app import settings
+from app.models import ConversationSummary, Message, User
+from app.services.metrics import metrics
+from app.services.segments import SegmentCache, SegmentReader
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = {"fsync": "FULL", "relaxed": "NORMAL"}
+# A batch that hits a busy or locked database is retried this many times,
+# backing off from WRITE_RETRY_DELAY_S.
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_DELAY_S = 0.05
+TRANSIENT_ERROR_CODES = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+# A queued write: SQL and its parameters, or a function called with the
+# connection and the parameters.
+Write = tuple[str | Callable[..., None], tuple[Any, ...]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    name TEXT NOT NULL,
+    profile_photo TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    receiver_email TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    file_url TEXT
+);
+-- A conversation's positions follow message ids, which the owning worker
+-- assigns in append order.
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id
+    ON messages (conversation_id, id);
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id TEXT PRIMARY KEY,
+    last_message TEXT NOT NULL,
+    last_sender_email TEXT NOT NULL,
+    last_activity TEXT NOT NULL,
+    unread TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS read_cursors (
+    conversation_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (conversation_id, email)
+);
+CREATE TABLE IF NOT EXISTS search_postings (
+    token TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (token, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS attachments (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachment_owners (
+    email TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (email, digest)
+);
+CREATE TABLE IF NOT EXISTS attachment_readers (
+    digest TEXT NOT NULL,
+    email TEXT NOT NULL,
+    PRIMARY KEY (digest, email)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp
+    ON messages (timestamp);
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+    token_id TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS archive_segments (
+    name TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    purged INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS archive_blocks (
+    conversation_id TEXT NOT NULL,
+    first_position INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    segment TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, first_position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS archived_messages (
+    id INTEGER PRIMARY KEY,
+    sender_email TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    segment TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversation_lengths (
+    conversation_id TEXT PRIMARY KEY,
+    archived INTEGER NOT NULL DEFAULT 0,
+    length INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+# A plain INSERT, so a racing sign-up for the same email fails instead of
+# replacing the first one's password.
+INSERT_USER = (
+    "INSERT INTO users"
+    " (email, password, name, profile_photo)"
+    " VALUES (?, ?, ?, ?)"
+)
+INSERT_MESSAGE = (
+    "INSERT INTO messages (id, conversation_id, sender_email,"
+    " receiver_email, content, timestamp, is_read, file_url)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+MESSAGE_COLUMNS = (
+    "id, sender_email, receiver_email, content, timestamp,"
+    " is_read, file_url"
+)
+
+ADD_TO_LENGTH = (
+    "INSERT INTO conversation_lengths (conversation_id, length)"
+    " VALUES (?, ?) ON CONFLICT (conversation_id)"
+    " DO UPDATE SET length = length + excluded.length"
+)
+# Fills conversation_lengths for a database created before it existed.
+BACKFILL_LENGTHS = """
+INSERT OR IGNORE INTO conversation_lengths
+    (conversation_id, archived, length)
+SELECT conversation_id, SUM(archived), SUM(archived) + SUM(live)
+FROM (
+    SELECT conversation_id, MAX(first_position + count) AS archived,
+        0 AS live
+    FROM archive_blocks GROUP BY conversation_id
+    UNION ALL
+    SELECT conversation_id, 0, COUNT(*) FROM messages
+    GROUP BY conversation_id
+)
+GROUP BY conversation_id
+"""
+
+# Attachment URLs are "/files/<sha256>?kind=...". Messages already moved
+# into archive segments are not scanned; their uploaders keep access.
+BACKFILL_ATTACHMENT_READERS = """
+INSERT OR IGNORE INTO attachment_readers (digest, email)
+SELECT substr(file_url, 8, 64), sender_email FROM messages
+WHERE file_url LIKE '/files/%'
+UNION
+SELECT substr(file_url, 8, 64), receiver_email FROM messages
+WHERE file_url LIKE '/files/%'
+"""
+
+# Steps that bring a database created by an earlier version up to SCHEMA,
+# oldest first. A database's user_version counts the steps applied to it.
+MIGRATIONS = (
+    # Positions follow ids; the old (conversation_id, timestamp) index is
+    # replaced by idx_messages_conversation_id.
+    "DROP INDEX IF EXISTS idx_messages_conversation_timestamp",
+    BACKFILL_LENGTHS,
+    BACKFILL_ATTACHMENT_READERS,
+    # The id of the message at a cursor, when the writer knew it, so
+    # exports need not look it up by position.
+    "ALTER TABLE read_cursors ADD COLUMN message_id INTEGER",
+)
+
+UPSERT_SUMMARY = (
+    "INSERT OR REPLACE INTO conversation_summaries"
+    " (conversation_id, last_message, last_sender_email,"
+    " last_activity, unread) VALUES (?, ?, ?, ?, ?)"
+)
+
+INSERT_POSTING = (
+    "INSERT OR IGNORE INTO search_postings (token, message_id)"
+    " VALUES (?, ?)"
+)
+INSERT_ATTACHMENT = (
+    "INSERT OR IGNORE INTO attachments (digest, size, content_type)"
+    " VALUES (?, ?, ?)"
+)
+INSERT_ATTACHMENT_OWNER = (
+    "INSERT OR IGNORE INTO attachment_owners (email, digest)"
+    " VALUES (?, ?)"
+)
+INSERT_ATTACHMENT_READER = (
+    "INSERT OR IGNORE INTO attachment_readers (digest, email)"
+    " VALUES (?, ?)"
+)
+INSERT_REVOKED_SESSION = (
+    "INSERT OR IGNORE INTO revoked_sessions (token_id, expires)"
+    " VALUES (?, ?)"
+)
+# Cursors only move forward, whichever order their writes commit in.
+UPSERT_READ_CURSOR = (
+    "INSERT INTO read_cursors"
+    " (conversation_id, email, position, message_id)"
+    " VALUES (?, ?, ?, ?) ON CONFLICT (conversation_id, email)"
+    " DO UPDATE SET position = MAX(position, excluded.position),"
+    " message_id = CASE"
+    " WHEN excluded.position > position THEN excluded.message_id"
+    " WHEN excluded.position = position"
+    " THEN COALESCE(message_id, excluded.message_id)"
+    " ELSE message_id END"
+)
+
+
+class StorageWriteError(Exception):
+    """Raised by `Storage.flush` when queued writes were dropped."""
+
+
+def _is_transient(error: sqlite3.Error) -> bool:
+    return (
+        getattr(error, "sqlite_errorcode", None) in TRANSIENT_ERROR_CODES
+    )
+
+
+def _message_from_row(row: tuple) -> Message:
+    return Message(
+        id=row[0],
+        sender_email=row[1],
+        receiver_email=row[2],
+        content=row[3],
+        timestamp=row[4],
+        is_read=bool(row[5]),
+        file_url=row[6],
+    )
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Applies the MIGRATIONS a database has not had yet, in one transaction."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(
+        MIGRATIONS
+    ):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while this one waited.
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            conn.execute(step)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _commit_message(
+    conn: sqlite3.Connection, cid: str, row: tuple[Any, ...]
+) -> None:
+    conn.execute(INSERT_MESSAGE, row)
+    conn.execute(ADD_TO_LENGTH, (cid, 1))
+
+
+def _commit_segment(
+    conn: sqlite3.Connection,
+    name: str,
+    day: str,
+    first_positions: dict[str, int],
+    blocks: dict[str, list[tuple]],
+) -> None:
+    if conn.execute(
+        "SELECT 1 FROM archive_segments WHERE name = ?", (name,)
+    ).fetchone():
+        # Another worker archived this day first.
+        return
+    conn.execute(
+        "INSERT INTO archive_segments (name, day) VALUES (?, ?)",
+        (name, day),
+    )
+    conn.executemany(
+        "INSERT INTO archive_blocks (conversation_id, first_position,"
+        " count, segment) VALUES (?, ?, ?, ?)",
+        [
+            (cid, first_positions[cid], len(rows), name)
+            for cid, rows in blocks.items()
+        ],
+    )
+    ids = [row[0] for rows in blocks.values() for row in rows]
+    conn.executemany(
+        "INSERT OR IGNORE INTO archived_messages"
+        " (id, sender_email, timestamp, segment)"
+        " SELECT id, sender_email, timestamp, ?"
+        " FROM messages WHERE id = ?",
+        [(name, message_id) for message_id in ids],
+    )
+    conn.executemany(
+        "DELETE FROM messages WHERE id = ?",
+        [(message_id,) for message_id in ids],
+    )
+    conn.executemany(
+        "UPDATE conversation_lengths SET archived = archived + ?"
+        " WHERE conversation_id = ?",
+        [(len(rows), cid) for cid, rows in blocks.items()],
+    )
+
+
+class Storage:
+    """SQLite persistence with an async write-behind queue.
+
+    Reads go straight to an indexed read connection, one per thread so
+    conversation reads can run in worker threads. Writes are queued and
+    group-committed by a single writer task off the event loop.
+
+    Old messages may have been moved to archive segments (see
+    app.services.archive). Each conversation then starts with its archived
+    messages, recorded per segment in archive_blocks, followed by the rows
+    still in `messages`; positions count across both. How many positions
+    are archived, and the conversation's length, are kept in
+    conversation_lengths, and the rows in `messages` are read by id
+    (keyset), so reading a page costs the same at any history size.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        durability: str = "fsync",
+        flush_interval_ms: int = 5,
+        max_batch_size: int = 1000,
+        archive_dir: str = "archive",
+        open_segments: int = 16,
+    ) -> None:
+        if durability not in DURABILITY_MODES:
+            raise ValueError(
+                f"Unknown durability mode {durability!r}; expected one of {sorted(DURABILITY_MODES)}."
+            )
+        self.path = path
+        self.durability = durability
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._local = threading.local()
+        self._read_conns: list[sqlite3.Connection] = []
+        self._read_conns_lock = threading.Lock()
+        self._write_conn: sqlite3.Connection | None = None
+        self._queue: asyncio.Queue[Write] = asyncio.Queue()
+        self._writer: asyncio.Task | None = None
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+        # Writes dropped since the storage was opened; flush() reports the
+        # ones dropped while it waits.
+        self._dropped_writes = 0
+        self.segments = SegmentCache(archive_dir, open_segments)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"PRAGMA synchronous={DURABILITY_MODES[self.durability]}"
+        )
+        conn.executescript(SCHEMA)
+        if not self._migrated:
+            with self._migrate_lock:
+                if not self._migrated:
+                    _migrate(conn)
+                    self._migrated = True
+        return conn
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        """This thread's connection for (indexed) reads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._read_conns_lock:
+                self._read_conns.append(conn)
+        return conn
+
+    def load_user(self, email: str) -> User | None:
+        """Returns a persisted user, or None if the email is unknown."""
+        row = self.reader.execute(
+            "SELECT password, name, profile_photo FROM users WHERE email = ?",
+            (email,),
+        ).fetchone()
+        if row is None:
+            return None
+        return User(
+            password=row[0], name=row[1], profile_photo=row[2]
+        )
+
+    def load_users(self) -> dict[str, User]:
+        """Returns every persisted user, keyed by email."""
+        return {
+            row[0]: User(
+                password=row[1],
+                name=row[2],
+                profile_photo=row[3],
+            )
+            for row in self.reader.execute(
+                "SELECT email, password, name, profile_photo FROM users"
+            )
+        }
+
+    def load_user(self, email: str) -> User | None:
+        """Returns one persisted user."""
+        row = self.reader.execute(
+            "SELECT password, name, profile_photo FROM users"
+            " WHERE email = ?",
+            (email,),
+        ).fetchone()
+        if row is None:
+            return None
+        return User(
+            password=row[0], name=row[1], profile_photo=row[2]
+        )
+
+    def _lengths(self, cid: str) -> tuple[int, int]:
+        """Returns how many positions of a conversation are archived, and its length."""
+        row = self.reader.execute(
+            "SELECT archived, length FROM conversation_lengths"
+            " WHERE conversation_id = ?",
+            (cid,),
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else (0, 0)
+
+    def _load_archived(
+        self, cid: str, start: int, end: int
+    ) -> list[Message]:
+        """Reads positions [start, end) of a conversation from its archive segments."""
+        blocks = self.reader.execute(
+            "SELECT b.first_position, b.segment FROM archive_blocks b"
+            " JOIN archive_segments s ON s.name = b.segment"
+            " WHERE b.conversation_id = ? AND b.first_position < ?"
+            " AND b.first_position + b.count > ? AND s.purged = 0"
+            " ORDER BY b.first_position",
+            (cid, end, start),
+        ).fetchall()
+        messages = []
+        for first_position, segment in blocks:
+            rows = self.segments.read_block(segment, cid)
+            if rows is None:
+                continue
+            messages.extend(
+                _message_from_row(row)
+                for row in rows[
+                    max(0, start - first_position) : end
+                    - first_position
+                ]
+            )
+        return messages
+
+    def load_conversation_range(
+        self,
+        cid: str,
+        start: int,
+        end: int | None = None,
+        end_id: int | None = None,
+    ) -> list[Message]:
+        """Returns the messages at positions [start, end) of a conversation, oldest first.
+
+        `end_id` is the id of the message at position `end`, if the caller
+        knows it; the rows before it are then found through the
+        (conversation_id, id) index. Without it, a range ending before the
+        conversation's last message is counted back from the end.
+        Archived positions are read from their segments, the rest from the
+        database, in one read transaction so a concurrent compaction cannot
+        shift positions in between.
+        """
+        conn = self.reader
+        conn.execute("BEGIN")
+        try:
+            archived, length = self._lengths(cid)
+            end = length if end is None else min(end, length)
+            messages = (
+                self._load_archived(cid, start, min(end, archived))
+                if start < archived
+                else []
+            )
+            if end > archived:
+                count = end - max(start, archived)
+                if end_id is not None:
+                    rows = conn.execute(
+                        f"SELECT {MESSAGE_COLUMNS} FROM messages"
+                        " WHERE conversation_id = ? AND id < ?"
+                        " ORDER BY id DESC LIMIT ?",
+                        (cid, end_id, count),
+                    )
+                else:
+                    rows = conn.execute(
+                        f"SELECT {MESSAGE_COLUMNS} FROM messages"
+                        " WHERE conversation_id = ?"
+                        " ORDER BY id DESC LIMIT ? OFFSET ?",
+                        (cid, count, length - end),
+                    )
+                messages.extend(
+                    _message_from_row(row)
+                    for row in reversed(rows.fetchall())
+                )
+        finally:
+            conn.execute("COMMIT")
+        return messages
+
+    def message_id_at(self, cid: str, position: int) -> int | None:
+        """Returns the id of the message at `position`, or None if it is not retained."""
+        messages = self.load_conversation_range(
+            cid, position, position + 1
+        )
+        return messages[0]["id"] if messages else None
+
+    def load_conversation(self, cid: str) -> list[Message]:
+        """Returns every retained message of a conversation, oldest first."""
+        return self.load_conversation_range(
+            cid, self.first_position(cid)
+        )
+
+    def load_conversation_tail(
+        self, cid: str, limit: int
+    ) -> tuple[list[Message], int]:
+        """Returns the last `limit` messages of a conversation and its length."""
+        _, length = self._lengths(cid)
+        return (
+            self.load_conversation_range(
+                cid, max(0, length - limit), length
+            ),
+            length,
+        )
+
+    def first_position(self, cid: str) -> int:
+        """Returns the position of a conversation's oldest retained message.
+
+        It is past 0 once archive segments have been deleted by retention.
+        """
+        row = self.reader.execute(
+            "SELECT MIN(b.first_position) FROM archive_blocks b"
+            " JOIN archive_segments s ON s.name = b.segment"
+            " WHERE b.conversation_id = ? AND s.purged = 0",
+            (cid,),
+        ).fetchone()
+        if row[0] is not None:
+            return row[0]
+        return self._lengths(cid)[0]
+
+    def load_messages(self, ids: list[int]) -> list[Message]:
+        """Returns the persisted messages with the given ids, in id order."""
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        rows = self.reader.execute(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages"
+            f" WHERE id IN ({placeholders})",
+            ids,
+        ).fetchall()
+        archived = self.reader.execute(
+            "SELECT a.segment, a.id FROM archived_messages a"
+            " JOIN archive_segments s ON s.name = a.segment"
+            f" WHERE a.id IN ({placeholders}) AND s.purged = 0",
+            ids,
+        ).fetchall()
+        by_segment: dict[str, set[int]] = {}
+        for segment, message_id in archived:
+            by_segment.setdefault(segment, set()).add(message_id)
+        for segment, segment_ids in by_segment.items():
+            rows.extend(
+                self.segments.read_ids(segment, segment_ids) or ()
+            )
+        rows.sort(key=lambda row: row[0])
+        return [_message_from_row(row) for row in rows]
+
+    def max_message_id(self) -> int:
+        """Returns the largest message id ever persisted, or 0."""
+        row = self.reader.execute(
+            "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM messages"
+            " UNION ALL SELECT MAX(id) FROM archived_messages)"
+        ).fetchone()
+        return row[0] or 0
+
+    def _scan(self, sql: str):
+        """Streams the rows of a bulk query on a dedicated connection.
+
+        Bulk scans run in worker threads, so they must not share the
+        connection used by the event loop.
+        """
+        conn = self._connect()
+        try:
+            yield from conn.execute(sql)
+        finally:
+            conn.close()
+
+    def load_search_postings(self):
+        """Yields (token, message_id) pairs grouped by token, ids ascending."""
+        return self._scan(
+            "SELECT token, message_id FROM search_postings"
+            " ORDER BY token, message_id"
+        )
+
+    def load_message_metadata(self):
+        """Yields (id, sender_email, timestamp) for every message, archived ones included, ids ascending."""
+        return self._scan(
+            "SELECT id, sender_email, timestamp FROM messages"
+            " WHERE receiver_email != '*'"
+            " UNION ALL SELECT id, sender_email, timestamp"
+            " FROM archived_messages ORDER BY id"
+        )
+
+    def iter_messages(
+        self,
+        cid: str | None = None,
+        user: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ):
+        """Yields messages in (timestamp, id) order, archived ones included.
+
+        Filters are a conversation id, a participant's email and an
+        inclusive range of UTC days (YYYY-MM-DD). Runs on its own connection
+        and maps each archive segment only while it is read, so memory stays
+        bounded by one day's segment however much is exported.
+        """
+        conn = self._connect()
+        try:
+            yield from heapq.merge(
+                self._iter_archived(conn, cid, user, since, until),
+                self._iter_database(conn, cid, user, since, until),
+                key=lambda message: (
+                    message["timestamp"],
+                    message["id"],
+                ),
+            )
+        finally:
+            conn.close()
+
+    def _iter_database(
+        self,
+        conn: sqlite3.Connection,
+        cid: str | None,
+        user: str | None,
+        since: str | None,
+        until: str | None,
+    ):
+        clauses, params = [], []
+        if cid is not None:
+            clauses.append("conversation_id = ?")
+            params.append(cid)
+        if user is not None:
+            clauses.append("(sender_email = ? OR receiver_email = ?)")
+            params += [user, user]
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until + "~")
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        for row in conn.execute(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages{where}"
+            " ORDER BY timestamp, id",
+            params,
+        ):
+            yield _message_from_row(row)
+
+    def _iter_archived(
+        self,
+        conn: sqlite3.Connection,
+        cid: str | None,
+        user: str | None,
+        since: str | None,
+        until: str | None,
+    ):
+        segments = conn.execute(
+            "SELECT name FROM archive_segments"
+            " WHERE purged = 0 AND day >= ? AND day <= ? ORDER BY day",
+            (since or "", until or "~"),
+        ).fetchall()
+        for (name,) in segments:
+            try:
+                reader = SegmentReader(self.segments.path(name))
+            except FileNotFoundError:
+                continue
+            try:
+                cids = [
+                    block_cid
+                    for block_cid in reader.index
+                    if (cid is None or block_cid == cid)
+                    and (user is None or user in block_cid.split("|"))
+                ]
+                rows = heapq.merge(
+                    *(reader.read_block(block_cid) for block_cid in cids),
+                    key=lambda row: (row[4], row[0]),
+                )
+                for row in rows:
+                    yield _message_from_row(row)
+            finally:
+                reader.close()
+
+    def archivable_days(self, before_day: str) -> list[str]:
+        """Returns the UTC days (YYYY-MM-DD) before `before_day` that still have conversation messages in the database, oldest first."""
+        days = []
+        conn = self._connect()
+        try:
+            while True:
+                row = conn.execute(
+                    "SELECT MIN(timestamp) FROM messages"
+                    " WHERE timestamp >= ? AND timestamp < ?"
+                    " AND conversation_id != '*'",
+                    (days[-1] + "~" if days else "", before_day),
+                ).fetchone()
+                if row[0] is None:
+                    return days
+                days.append(row[0][:10])
+        finally:
+            conn.close()
+
+    def load_day(
+        self, day: str
+    ) -> tuple[dict[str, list[tuple]], dict[str, int]]:
+        """Returns the rows of every conversation with messages on `day` and their first positions.
+
+        Broadcasts are left in the database; they are always kept in memory.
+        """
+        conn = self._connect()
+        try:
+            blocks: dict[str, list[tuple]] = {}
+            for cid, *row in conn.execute(
+                f"SELECT conversation_id, {MESSAGE_COLUMNS} FROM messages"
+                " WHERE timestamp >= ? AND timestamp < ?"
+                " AND conversation_id != '*'"
+                " ORDER BY conversation_id, id",
+                (day, day + "~"),
+            ):
+                blocks.setdefault(cid, []).append(tuple(row))
+            first_positions = {
+                cid: conn.execute(
+                    "SELECT COALESCE(MAX(archived), 0)"
+                    " FROM conversation_lengths WHERE conversation_id = ?",
+                    (cid,),
+                ).fetchone()[0]
+                for cid in blocks
+            }
+        finally:
+            conn.close()
+        return blocks, first_positions
+
+    def save_segment(
+        self,
+        name: str,
+        day: str,
+        first_positions: dict[str, int],
+        blocks: dict[str, list[tuple]],
+    ) -> None:
+        """Queues recording a written segment and removing its messages from the database, in one transaction."""
+        self._enqueue(
+            _commit_segment, (name, day, first_positions, blocks)
+        )
+
+    def expired_segments(self, before_day: str) -> list[str]:
+        """Returns the live segments of days before `before_day`."""
+        return [
+            row[0]
+            for row in self.reader.execute(
+                "SELECT name FROM archive_segments"
+                " WHERE day < ? AND purged = 0",
+                (before_day,),
+            )
+        ]
+
+    def purge_segment(self, name: str) -> None:
+        """Queues marking a segment deleted; its positions stay counted."""
+        self._enqueue(
+            "UPDATE archive_segments SET purged = 1 WHERE name = ?",
+            (name,),
+        )
+
+    def load_summaries(
+        self,
+    ) -> list[tuple[str, ConversationSummary]]:
+        """Returns every conversation summary, least recently active first."""
+        rows = self.reader.execute(
+            "SELECT conversation_id, last_message, last_sender_email,"
+            " last_activity, unread FROM conversation_summaries"
+            " ORDER BY last_activity"
+        )
+        return [
+            (
+                row[0],
+                ConversationSummary(
+                    last_message=row[1],
+                    last_sender_email=row[2],
+                    last_activity=row[3],
+                    unread=json.loads(row[4]),
+                ),
+            )
+            for row in rows
+        ]
+
+    def load_read_cursors(self, cid: str) -> dict[str, int]:
+        """Returns the read position of each participant of a conversation."""
+        return dict(
+            self.reader.execute(
+                "SELECT email, position FROM read_cursors"
+                " WHERE conversation_id = ?",
+                (cid,),
+            ).fetchall()
+        )
+
+    def load_read_cursor_ids(self, cid: str) -> dict[str, int]:
+        """Returns the id of the last message each participant has read.
+
+        Cursors saved without their message id are looked up by position.
+        """
+        return {
+            email: (
+                message_id
+                if message_id is not None
+                else self.message_id_at(cid, position) or 0
+            )
+            for email, position, message_id in self.reader.execute(
+                "SELECT email, position, message_id FROM read_cursors"
+                " WHERE conversation_id = ?",
+                (cid,),
+            ).fetchall()
+        }
+
+    def load_attachment(
+        self, digest: str
+    ) -> tuple[int, str] | None:
+        """Returns the (size, content type) of a stored attachment."""
+        return self.reader.execute(
+            "SELECT size, content_type FROM attachments WHERE digest = ?",
+            (digest,),
+        ).fetchone()
+
+    def can_read_attachment(self, email: str, digest: str) -> bool:
+        """Returns whether `email` uploaded the attachment or was sent it."""
+        return (
+            self.reader.execute(
+                "SELECT 1 FROM attachment_readers"
+                " WHERE digest = ? AND email = ?"
+                " UNION ALL SELECT 1 FROM attachment_owners"
+                " WHERE email = ? AND digest = ? LIMIT 1",
+                (digest, email, email, digest),
+            ).fetchone()
+            is not None
+        )
+
+    def load_attachment_usage(
+        self, email: str
+    ) -> tuple[int, set[str]]:
+        """Returns the bytes charged to a user and the digests they own."""
+        rows = self.reader.execute(
+            "SELECT a.digest, a.size FROM attachment_owners o"
+            " JOIN attachments a ON a.digest = o.digest"
+            " WHERE o.email = ?",
+            (email,),
+        ).fetchall()
+        return sum(size for _, size in rows), {
+            digest for digest, _ in rows
+        }
+
+    def save_user(self, email: str, user: User) -> None:
+        """Queues a user for persistence."""
+        self._enqueue(
+            INSERT_USER,
+            (
+                email,
+                user["password"],
+                user["name"],
+                user["profile_photo"],
+            ),
+        )
+
+    def save_message(self, cid: str, message: Message) -> None:
+        """Queues a message, and the growth of its conversation, for persistence."""
+        self._enqueue(
+            _commit_message,
+            (
+                cid,
+                (
+                    message["id"],
+                    cid,
+                    message["sender_email"],
+                    message["receiver_email"],
+                    message["content"],
+                    message["timestamp"],
+                    int(message["is_read"]),
+                    message["file_url"],
+                ),
+            ),
+        )
+
+    def save_summary(
+        self, cid: str, summary: ConversationSummary
+    ) -> None:
+        """Queues a conversation summary for persistence."""
+        self._enqueue(
+            UPSERT_SUMMARY,
+            (
+                cid,
+                summary["last_message"],
+                summary["last_sender_email"],
+                summary["last_activity"],
+                json.dumps(summary["unread"]),
+            ),
+        )
+
+    def save_postings(
+        self, message_id: int, tokens: set[str]
+    ) -> None:
+        """Queues the search postings of a message for persistence."""
+        for token in tokens:
+            self._enqueue(INSERT_POSTING, (token, message_id))
+
+    def save_attachment(
+        self,
+        digest: str,
+        size: int,
+        content_type: str,
+        owner: str,
+    ) -> None:
+        """Queues an attachment and its ownership by `owner` for persistence."""
+        self._enqueue(
+            INSERT_ATTACHMENT, (digest, size, content_type)
+        )
+        self._enqueue(INSERT_ATTACHMENT_OWNER, (owner, digest))
+
+    def save_attachment_readers(
+        self, digest: str, emails: tuple[str, ...]
+    ) -> None:
+        """Queues the users an attachment was posted to, so they may download it."""
+        for email in emails:
+            self._enqueue(INSERT_ATTACHMENT_READER, (digest, email))
+
+    def save_read_cursor(
+        self,
+        cid: str,
+        email: str,
+        position: int,
+        message_id: int | None = None,
+    ) -> None:
+        """Queues a read cursor, and the id of the message at it if known, for persistence."""
+        self._enqueue(
+            UPSERT_READ_CURSOR, (cid, email, position, message_id)
+        )
+
+    def save_revoked_session(
+        self, token_id: str, expires: float
+    ) -> None:
+        """Queues revoking a session token until it would have expired."""
+        self._enqueue(INSERT_REVOKED_SESSION, (token_id, expires))
+
+    def load_revoked_sessions(
+        self, now: float
+    ) -> list[tuple[str, float]]:
+        """Returns the (token id, expiry) of revoked tokens not yet expired."""
+        return self.reader.execute(
+            "SELECT token_id, expires FROM revoked_sessions"
+            " WHERE expires > ?",
+            (now,),
+        ).fetchall()
+
+    def purge_revoked_sessions(self, now: float) -> None:
+        """Queues forgetting revocations of tokens that have expired anyway."""
+        self._enqueue(
+            "DELETE FROM revoked_sessions WHERE expires <= ?", (now,)
+        )
+
+    def _enqueue(
+        self, sql: str, params: tuple[Any, ...]
+    ) -> None:
+        self._queue.put_nowait((sql, params))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(
+                self._write_behind()
+            )
+
+    async def _write_behind(self) -> None:
+        """Drains the queue, committing everything gathered in one flush window."""
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.flush_interval)
+            while (
+                not self._queue.empty()
+                and len(batch) < self.max_batch_size
+            ):
+                batch.append(self._queue.get_nowait())
+            try:
+                failed = await self._commit_with_retries(batch)
+                for (sql, params), error in failed:
+                    metrics.inc("storage_write_failures_total")
+                    logger.error(
+                        "Dropped a write that failed to persist: %s %r (%s).",
+                        getattr(sql, "__name__", sql),
+                        params,
+                        error,
+                    )
+                self._dropped_writes += len(failed)
+            except Exception:
+                # Whatever failed, the writer must keep draining the queue.
+                metrics.inc(
+                    "storage_write_failures_total", len(batch)
+                )
+                logger.exception(
+                    "Failed to persist a batch of %d writes.",
+                    len(batch),
+                )
+                self._dropped_writes += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit_with_retries(
+        self, batch: list[Write]
+    ) -> list[tuple[Write, Exception]]:
+        """Commits a batch, retrying it while the database is busy or locked."""
+        delay = WRITE_RETRY_DELAY_S
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return await asyncio.to_thread(
+                    self._commit_batch, batch
+                )
+            except sqlite3.Error as e:
+                if (
+                    not _is_transient(e)
+                    or attempt == WRITE_RETRY_ATTEMPTS - 1
+                ):
+                    raise
+                logger.warning(
+                    "Database busy, retrying a batch of %d writes.",
+                    len(batch),
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+        return []
+
+    def _commit_batch(
+        self, batch: list[Write]
+    ) -> list[tuple[Write, Exception]]:
+        """Commits a batch in one transaction and returns the writes that failed.
+
+        Each write runs under its own savepoint, so a failing write (a
+        constraint violation, say) is rolled back and reported alone while
+        the rest of the batch commits. Busy and locked errors abort the whole
+        batch so it can be retried.
+        """
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+        conn = self._write_conn
+        failed = []
+        conn.execute("BEGIN")
+        try:
+            for write in batch:
+                sql, params = write
+                conn.execute("SAVEPOINT write")
+                try:
+                    if callable(sql):
+                        sql(conn, *params)
+                    else:
+                        conn.execute(sql, params)
+                except Exception as e:
+                    if isinstance(e, sqlite3.Error) and _is_transient(e):
+                        raise
+                    conn.execute("ROLLBACK TO write")
+                    failed.append((write, e))
+                conn.execute("RELEASE write")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return failed
+
+    async def flush(self) -> None:
+        """Waits until every queued write has been committed.
+
+        Raises StorageWriteError if writes were dropped while it waited.
+        """
+        dropped = self._dropped_writes
+        await self._queue.join()
+        if self._dropped_writes > dropped:
+            raise StorageWriteError(
+                f"{self._dropped_writes - dropped} queued writes failed to persist."
+            )
+
+    async def close(self) -> None:
+        """Flushes pending writes and closes the connections.
+
+        Raises StorageWriteError, after closing, if pending writes were dropped.
+        """
+        if self._writer is not None:
+            try:
+                await self.flush()
+            finally:
+                self._writer.cancel()
+                self._writer = None
+                self._close_connections()
+        else:
+            self._close_connections()
+
+    def _close_connections(self) -> None:
+        with self._read_conns_lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns.clear()
+            self._local = threading.local()
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+        self.segments.close()
+
+
+storage = Storage(
+    settings.DATABASE_PATH,
+    durability=settings.DATABASE_DURABILITY,
+    flush_interval_ms=settings.WRITE_FLUSH_INTERVAL_MS,
+    max_batch_size=settings.WRITE_MAX_BATCH_SIZE,
+    archive_dir=settings.ARCHIVE_DIR,
+    open_segments=settings.ARCHIVE_OPEN_SEGMENTS,
+)
@@ -0,0 +1,506 @@
+"""Streaming export and bulk import of users and messages.
+
+Export (also served to the admin at /export/messages):
+
+    python -m app.services.transfer export [--user EMAIL] [--partner EMAIL]
+        [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--format ndjson|csv]
+
+Import, e.g. to seed a staging database; run it while the backend is
+stopped, since running workers cache users, summaries and conversations:
+
+    python -m app.services.transfer import records.ndjson [...]
+
+Import reads NDJSON records: users carry "email", "password" (a bcrypt
+hash), "name" and "profile_photo"; messages carry the Message fields, with
+"id" optional. A user whose email already exists is skipped and counted,
+never replaced. Messages are appended to their conversations, so each
+conversation's records must come in timestamp order and after its existing
+messages; an NDJSON export can be imported as is. A message that already
+exists (same conversation, sender, time and text) is skipped, and a record
+whose id is taken gets a new one.
+
+Exported "is_read" reflects the receiver's read cursor; on import, a read
+message moves its receiver's cursor, and unread counts are what each
+receiver got after their cursor.
+"""
+
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+
+from app.models import ConversationSummary, Message
+from app.services.message_store import (
+    BROADCAST_CONVERSATION,
+    BROADCAST_RECIPIENT,
+    SNIPPET_LENGTH,
+    conversation_id,
+)
+from app.services.search_index import tokenize
+from app.services.storage import (
+    ADD_TO_LENGTH,
+    INSERT_MESSAGE,
+    INSERT_POSTING,
+    UPSERT_READ_CURSOR,
+    UPSERT_SUMMARY,
+    Storage,
+    storage,
+)
+
+EXPORT_FIELDS = (
+    "id",
+    "sender_email",
+    "receiver_email",
+    "content",
+    "timestamp",
+    "is_read",
+    "file_url",
+)
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# Rows per chunk yielded by the exporters, and records per import
+# transaction.
+EXPORT_CHUNK_ROWS = 1000
+IMPORT_BATCH_SIZE = 20000
+# Conversations whose read cursors an export keeps resolved; one that
+# comes back after being dropped is looked up again.
+EXPORT_CURSOR_CACHE_SIZE = 1024
+# Imported users never replace existing ones, whose passwords may have
+# changed since the export.
+INSERT_NEW_USER = (
+    "INSERT OR IGNORE INTO users (email, password, name, profile_photo)"
+    " VALUES (?, ?, ?, ?)"
+)
+
+
+def _chunked(
+    messages: Iterable[Message], render
+) -> Iterator[str]:
+    chunk = []
+    for message in messages:
+        chunk.append(render(message))
+        if len(chunk) == EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def to_ndjson(messages: Iterable[Message]) -> Iterator[str]:
+    """Renders messages as NDJSON, one chunk of lines at a time."""
+    return _chunked(
+        messages,
+        lambda message: json.dumps(message, separators=(",", ":"))
+        + "\n",
+    )
+
+
+def to_csv(messages: Iterable[Message]) -> Iterator[str]:
+    """Renders messages as CSV with a header row, one chunk of lines at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def render(message: Message) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(message[field] for field in EXPORT_FIELDS)
+        return buffer.getvalue()
+
+    yield ",".join(EXPORT_FIELDS) + "\r\n"
+    yield from _chunked(messages, render)
+
+
+def export_messages(
+    storage: Storage,
+    format: str = "ndjson",
+    user: str | None = None,
+    partner: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+) -> Iterator[str]:
+    """Streams the messages of one conversation (`user` and `partner`), of one user, or of everyone.
+
+    `since` and `until` are inclusive UTC days (YYYY-MM-DD).
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {format!r}; expected one of {sorted(EXPORT_FORMATS)}."
+        )
+    if partner and not user:
+        raise ValueError("A partner filter needs a user.")
+    if user and partner:
+        messages = storage.iter_messages(
+            cid=conversation_id(user, partner),
+            since=since,
+            until=until,
+        )
+    else:
+        messages = storage.iter_messages(
+            user=user, since=since, until=until
+        )
+    render = to_ndjson if format == "ndjson" else to_csv
+    return render(_with_read_state(storage, messages))
+
+
+def _with_read_state(
+    storage: Storage, messages: Iterable[Message]
+) -> Iterator[Message]:
+    """Sets each message's is_read from its receiver's read cursor; the stored flag is never updated.
+
+    Cursors are resolved to message ids as each conversation comes up,
+    and only those of the most recent conversations are kept.
+    """
+    read_up_to: OrderedDict[str, dict[str, int]] = OrderedDict()
+    for message in messages:
+        receiver = message["receiver_email"]
+        if receiver != BROADCAST_RECIPIENT:
+            cid = conversation_id(message["sender_email"], receiver)
+            cursors = read_up_to.get(cid)
+            if cursors is None:
+                cursors = read_up_to[cid] = (
+                    storage.load_read_cursor_ids(cid)
+                )
+                if len(read_up_to) > EXPORT_CURSOR_CACHE_SIZE:
+                    read_up_to.popitem(last=False)
+            else:
+                read_up_to.move_to_end(cid)
+            message["is_read"] = message["id"] <= cursors.get(
+                receiver, 0
+            )
+        yield message
+
+
+class _Conversation:
+    """Import progress of one conversation."""
+
+    __slots__ = ("timestamp", "last_id", "length", "summary", "cursors")
+
+    def __init__(
+        self, timestamp: str, last_id: int, length: int
+    ) -> None:
+        # Time and id of the latest message; imported ones must follow it.
+        self.timestamp = timestamp
+        self.last_id = last_id
+        self.length = length
+        self.summary = ConversationSummary(
+            last_message="",
+            last_sender_email="",
+            last_activity="",
+            unread={},
+        )
+        # (position, message id) of the read cursors moved by imported
+        # read messages.
+        self.cursors: dict[str, tuple[int, int]] = {}
+
+
+class _Importer:
+    """Writes records to the database in large transactions on a dedicated connection."""
+
+    def __init__(self, storage: Storage, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self.conn = storage._connect()
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        row = self.conn.execute(
+            "SELECT MAX(day) FROM archive_segments"
+        ).fetchone()
+        # Archived days are immutable; messages on them would shift the
+        # positions of everything archived after them.
+        self.archived_until = (row[0] + "~") if row[0] else ""
+        self.next_id = storage.max_message_id() + 1
+        self.conversations: dict[str, _Conversation] = {}
+        self.users: list[tuple] = []
+        self.messages: list[tuple[tuple, bool]] = []
+        self.postings: list[tuple] = []
+        # Skipped records are unrecognized or on archived days.
+        self.counts = {
+            "users": 0,
+            "existing_users": 0,
+            "messages": 0,
+            "duplicates": 0,
+            "out_of_order": 0,
+            "skipped": 0,
+        }
+
+    def add(self, record: dict) -> None:
+        if "sender_email" in record:
+            self._add_message(record)
+        elif "email" in record:
+            self.users.append(
+                (
+                    record["email"],
+                    record["password"],
+                    record["name"],
+                    record["profile_photo"],
+                )
+            )
+        else:
+            self.counts["skipped"] += 1
+        if len(self.users) + len(self.messages) >= self.batch_size:
+            self.flush()
+
+    def _add_message(self, record: dict) -> None:
+        sender, receiver = record["sender_email"], record["receiver_email"]
+        timestamp = record["timestamp"]
+        if receiver == BROADCAST_RECIPIENT:
+            cid = BROADCAST_CONVERSATION
+        elif timestamp < self.archived_until:
+            self.counts["skipped"] += 1
+            return
+        else:
+            cid = conversation_id(sender, receiver)
+        self.messages.append(
+            (
+                (
+                    record.get("id") or 0,
+                    cid,
+                    sender,
+                    receiver,
+                    record["content"],
+                    timestamp,
+                    0,
+                    record.get("file_url"),
+                ),
+                bool(record.get("is_read", False)),
+            )
+        )
+
+    def _conversation(self, cid: str) -> _Conversation:
+        conversation = self.conversations.get(cid)
+        if conversation is None:
+            row = self.conn.execute(
+                "SELECT timestamp, id FROM messages"
+                " WHERE conversation_id = ? ORDER BY id DESC LIMIT 1",
+                (cid,),
+            ).fetchone()
+            length = self.conn.execute(
+                "SELECT length FROM conversation_lengths"
+                " WHERE conversation_id = ?",
+                (cid,),
+            ).fetchone()
+            conversation = self.conversations[cid] = _Conversation(
+                *(row or ("", 0)), length[0] if length else 0
+            )
+        return conversation
+
+    def _is_duplicate(self, row: tuple) -> bool:
+        _, cid, sender, _, content, timestamp, _, _ = row
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM messages WHERE timestamp = ?"
+                " AND conversation_id = ? AND sender_email = ?"
+                " AND content = ?",
+                (timestamp, cid, sender, content),
+            ).fetchone()
+            is not None
+        )
+
+    def _assign_id(self, conversation: _Conversation, wanted: int) -> int:
+        """Keeps the record's id if it is free and follows the conversation's last one; otherwise allocates a new one."""
+        if wanted > conversation.last_id and (
+            self.conn.execute(
+                "SELECT 1 FROM messages WHERE id = ?"
+                " UNION ALL SELECT 1 FROM archived_messages WHERE id = ?",
+                (wanted, wanted),
+            ).fetchone()
+            is None
+        ):
+            message_id = wanted
+        else:
+            message_id = self.next_id
+        self.next_id = max(self.next_id, message_id + 1)
+        return message_id
+
+    def _append(self, row: tuple, is_read: bool) -> bool:
+        """Inserts a message at the end of its conversation; returns whether it was inserted."""
+        cid, timestamp = row[1], row[5]
+        conversation = self._conversation(cid)
+        if self._is_duplicate(row):
+            self.counts["duplicates"] += 1
+            return False
+        # Positions follow ids, and archived days must stay a prefix of
+        # the conversation, so messages are only appended.
+        if timestamp < conversation.timestamp:
+            self.counts["out_of_order"] += 1
+            return False
+        row = (self._assign_id(conversation, row[0]), *row[1:])
+        self.conn.execute(INSERT_MESSAGE, row)
+        conversation.timestamp = timestamp
+        conversation.last_id = row[0]
+        self._account(conversation, row, is_read)
+        conversation.length += 1
+        return True
+
+    def _account(
+        self, conversation: _Conversation, row: tuple, is_read: bool
+    ) -> None:
+        """Adds an inserted message's postings and folds it into its conversation's summary and read cursors.
+
+        A message exported as read moves its receiver's cursor to it; unread
+        counts are what each receiver got after their cursor.
+        """
+        message_id, cid, sender, receiver, content, timestamp, _, _ = row
+        if cid == BROADCAST_CONVERSATION:
+            return
+        self.postings.extend(
+            (token, message_id) for token in tokenize(content)
+        )
+        summary = conversation.summary
+        summary["last_message"] = content[:SNIPPET_LENGTH]
+        summary["last_sender_email"] = sender
+        summary["last_activity"] = timestamp
+        if is_read:
+            conversation.cursors[receiver] = (
+                conversation.length,
+                message_id,
+            )
+            summary["unread"][receiver] = 0
+        else:
+            summary["unread"][receiver] = (
+                summary["unread"].get(receiver, 0) + 1
+            )
+
+    def flush(self) -> None:
+        conn = self.conn
+        inserted: dict[str, int] = {}
+        conn.execute("BEGIN")
+        try:
+            changes = conn.total_changes
+            conn.executemany(INSERT_NEW_USER, self.users)
+            new_users = conn.total_changes - changes
+            for row, is_read in self.messages:
+                if self._append(row, is_read):
+                    inserted[row[1]] = inserted.get(row[1], 0) + 1
+            conn.executemany(ADD_TO_LENGTH, inserted.items())
+            conn.executemany(INSERT_POSTING, self.postings)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self.counts["users"] += new_users
+        self.counts["existing_users"] += len(self.users) - new_users
+        self.counts["messages"] += sum(inserted.values())
+        self.users, self.messages, self.postings = [], [], []
+
+    def finish(self) -> dict[str, int]:
+        """Writes the last batch, then the read cursors and merged summaries of every touched conversation."""
+        self.flush()
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            for cid, conversation in self.conversations.items():
+                summary = conversation.summary
+                if not summary["last_activity"]:
+                    continue
+                row = conn.execute(
+                    "SELECT unread FROM conversation_summaries"
+                    " WHERE conversation_id = ?",
+                    (cid,),
+                ).fetchone()
+                if row is not None:
+                    # Unread messages from before the import stay unread
+                    # unless an imported read message moved the cursor
+                    # past them.
+                    for email, unread in json.loads(row[0]).items():
+                        if email not in conversation.cursors:
+                            summary["unread"][email] = (
+                                summary["unread"].get(email, 0)
+                                + unread
+                            )
+                conn.executemany(
+                    UPSERT_READ_CURSOR,
+                    [
+                        (cid, email, position, message_id)
+                        for email, (
+                            position,
+                            message_id,
+                        ) in conversation.cursors.items()
+                    ],
+                )
+                conn.execute(
+                    UPSERT_SUMMARY,
+                    (
+                        cid,
+                        summary["last_message"],
+                        summary["last_sender_email"],
+                        summary["last_activity"],
+                        json.dumps(summary["unread"]),
+                    ),
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        conn.close()
+        return self.counts
+
+
+def import_records(
+    storage: Storage,
+    lines: Iterable[str],
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> dict[str, int]:
+    """Loads NDJSON user and message records in batches; returns how many were imported and skipped.
+
+    Messages that already exist, that would not come last in their
+    conversation, or that fall on an archived day, are skipped and
+    counted; taken ids are replaced. Only one batch and one summary per
+    conversation are held in memory.
+    """
+    importer = _Importer(storage, batch_size)
+    try:
+        for line in lines:
+            if line.strip():
+                importer.add(json.loads(line))
+    except (sqlite3.Error, ValueError, KeyError):
+        importer.conn.close()
+        raise
+    return importer.finish()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--user")
+    export_parser.add_argument("--partner")
+    export_parser.add_argument("--since")
+    export_parser.add_argument("--until")
+    export_parser.add_argument(
+        "--format", choices=sorted(EXPORT_FORMATS), default="ndjson"
+    )
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("files", nargs="+")
+    import_parser.add_argument(
+        "--batch-size", type=int, default=IMPORT_BATCH_SIZE
+    )
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for chunk in export_messages(
+            storage,
+            args.format,
+            user=args.user,
+            partner=args.partner,
+            since=args.since,
+            until=args.until,
+        ):
+            sys.stdout.write(chunk)
+        return 0
+    totals: dict[str, int] = {}
+    for path in args.files:
+        with open(path) as f:
+            counts = import_records(storage, f, args.batch_size)
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+    print(json.dumps(totals), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import asyncio
+import bisect
+from collections import OrderedDict
+
+from app.models import User
+from app.services.storage import (
+    Storage,
+    StorageWriteError,
+    storage,
+)
+
+# Sorts after every character that can follow a prefix, so that
+# bisect(prefix + PREFIX_END) bounds all keys starting with prefix.
+PREFIX_END = "\U0010ffff"
+# Sorted match lists of recent queries kept for paging through them.
+MAX_CACHED_QUERIES = 64
+
+
+def _prefix_range(
+    keys: list, prefix: str
+) -> tuple[int, int]:
+    return (
+        bisect.bisect_left(keys, (prefix,)),
+        bisect.bisect_left(keys, (prefix + PREFIX_END,)),
+    )
+
+
+class UserDirectory:
+    """Process-wide user registry with sorted email and name-prefix indexes.
+
+    All persisted users are loaded from storage on first use. Listed users are
+    kept in an email-sorted index for paging, and every email and name word is
+    kept in a sorted (key, email) index so prefix searches are a bisect.
+    A query's deduplicated, sorted matches are cached until the directory
+    changes, so paging through them is a slice.
+    """
+
+    def __init__(self, storage: Storage | None = None) -> None:
+        self._storage = storage
+        self._users: dict[str, User] = {}
+        self._emails: list[str] = []
+        self._prefixes: list[tuple[str, str]] = []
+        self._loaded = storage is None
+        self.version = 0
+        self._matches: OrderedDict[str, list[str]] = OrderedDict()
+        self._matches_version = 0
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        for email, user in self._storage.load_users().items():
+            if email not in self._users:
+                self._index(email, user)
+
+    def _index(self, email: str, user: User) -> None:
+        self._users[email] = user
+        bisect.insort(self._emails, email)
+        keys = {email, *user["name"].lower().split()}
+        for key in keys:
+            bisect.insort(self._prefixes, (key, email))
+        self.version += 1
+
+    def _unindex(self, email: str) -> None:
+        user = self._users.pop(email)
+        del self._emails[bisect.bisect_left(self._emails, email)]
+        keys = {email, *user["name"].lower().split()}
+        for key in keys:
+            del self._prefixes[
+                bisect.bisect_left(self._prefixes, (key, email))
+            ]
+        self.version += 1
+
+    def add_seed(self, email: str, user: User) -> None:
+        """Registers an account that is not persisted or listed (e.g. the admin)."""
+        self._users[email] = user
+        self.version += 1
+
+    def add(self, email: str, user: User) -> None:
+        """Registers and persists a new listed user."""
+        self._ensure_loaded()
+        if email in self._users:
+            raise ValueError(f"User {email!r} already exists.")
+        self._index(email, user)
+        if self._storage is not None:
+            self._storage.save_user(email, user)
+
+    async def register(self, email: str, user: User) -> None:
+        """Adds a new listed user and waits until it is persisted.
+
+        Raises ValueError if the email is taken, including by a sign-up on
+        another worker whose row was written first; that user then replaces
+        the one reserved here. StorageWriteError means the user could not
+        be stored and was not added.
+        """
+        self.add(email, user)
+        if self._storage is None:
+            return
+        try:
+            await self._storage.flush()
+        except StorageWriteError:
+            # Checked below: the dropped write may not have been ours.
+            pass
+        stored = await asyncio.to_thread(
+            self._storage.load_user, email
+        )
+        if (
+            stored is not None
+            and stored["password"] == user["password"]
+        ):
+            return
+        self._unindex(email)
+        if stored is None:
+            raise StorageWriteError(f"User {email!r} was not stored.")
+        self._index(email, stored)
+        raise ValueError(f"User {email!r} already exists.")
+
+    def add_replicated(self, email: str, user: User) -> None:
+        """Registers a user that another worker added and persisted."""
+        self._ensure_loaded()
+        if email not in self._users:
+            self._index(email, user)
+
+    def get(self, email: str) -> User | None:
+        """Returns a user by email."""
+        self._ensure_loaded()
+        return self._users.get(email)
+
+    def matches(self, query: str) -> list[str]:
+        """Returns the sorted listed emails matching a non-empty, lower-cased `query`."""
+        self._ensure_loaded()
+        if self._matches_version != self.version:
+            self._matches.clear()
+            self._matches_version = self.version
+        matches = self._matches.get(query)
+        if matches is None:
+            start, end = _prefix_range(self._prefixes, query)
+            matches = self._matches[query] = sorted(
+                {email for _, email in self._prefixes[start:end]}
+            )
+            if len(self._matches) > MAX_CACHED_QUERIES:
+                self._matches.popitem(last=False)
+        else:
+            self._matches.move_to_end(query)
+        return matches
+
+    def search(
+        self, query: str, offset: int, limit: int
+    ) -> tuple[list[str], int]:
+        """Returns one page of listed emails matching `query`, and the total match count.
+
+        An empty query pages through every listed user; otherwise `query` is
+        matched as a prefix of the email or of any word of the name.
+        """
+        self._ensure_loaded()
+        query = query.strip().lower()
+        if not query:
+            return (
+                self._emails[offset : offset + limit],
+                len(self._emails),
+            )
+        matches = self.matches(query)
+        return matches[offset : offset + limit], len(matches)
+
+
+user_directory = UserDirectory(storage)
@@ -0,0 +1,187 @@
+import os
+
+DATABASE_PATH = os.environ.get(
+    "CHAT_DATABASE_PATH", "chat.db"
+)
+# "fsync" syncs the WAL on every committed batch, "relaxed" only at
+# checkpoints (faster, but the last batches can be lost on power failure).
+DATABASE_DURABILITY = os.environ.get(
+    "CHAT_DATABASE_DURABILITY", "fsync"
+)
+WRITE_FLUSH_INTERVAL_MS = int(
+    os.environ.get("CHAT_WRITE_FLUSH_INTERVAL_MS", "5")
+)
+WRITE_MAX_BATCH_SIZE = int(
+    os.environ.get("CHAT_WRITE_MAX_BATCH_SIZE", "1000")
+)
+# Maximum number of undelivered events buffered per subscriber before the
+# oldest ones are dropped.
+SUBSCRIBER_QUEUE_SIZE = int(
+    os.environ.get("CHAT_SUBSCRIBER_QUEUE_SIZE", "256")
+)
+# Seconds a listener waits for events before checking its session is alive.
+LISTENER_IDLE_TIMEOUT_S = float(
+    os.environ.get("CHAT_LISTENER_IDLE_TIMEOUT_S", "30")
+)
+# Serialize outgoing state deltas a second time to count their size per var.
+PAYLOAD_METRICS_ENABLED = os.environ.get(
+    "CHAT_PAYLOAD_METRICS", "0"
+) in ("1", "true", "yes")
+BCRYPT_ROUNDS = int(os.environ.get("CHAT_BCRYPT_ROUNDS", "12"))
+# "thread" (bcrypt releases the GIL) or "process".
+PASSWORD_HASH_EXECUTOR = os.environ.get(
+    "CHAT_PASSWORD_HASH_EXECUTOR", "thread"
+)
+PASSWORD_HASH_WORKERS = int(
+    os.environ.get("CHAT_PASSWORD_HASH_WORKERS", "2")
+)
+# Hash/verify requests allowed to wait for a worker before new ones are
+# rejected.
+PASSWORD_HASH_MAX_WAITING = int(
+    os.environ.get("CHAT_PASSWORD_HASH_MAX_WAITING", "64")
+)
+# Optional JSON file of precomputed seed accounts, mapping each email to a
+# {"password": <bcrypt hash>, "name": ..., "profile_photo": ...} object.
+CREDENTIALS_FILE = os.environ.get("CHAT_CREDENTIALS_FILE", "")
+# Precomputed bcrypt hash for the admin account. When unset, the default
+# admin password is hashed on first use instead of at import time.
+ADMIN_PASSWORD_HASH = os.environ.get(
+    "CHAT_ADMIN_PASSWORD_HASH", ""
+)
+STARTUP_PROFILE_ENABLED = os.environ.get(
+    "CHAT_PROFILE_STARTUP", "0"
+) in ("1", "true", "yes")
+# Where the startup profile is written as JSON; logged when empty.
+STARTUP_PROFILE_OUTPUT = os.environ.get(
+    "CHAT_STARTUP_PROFILE_OUTPUT", ""
+)
+# Read-cursor moves within this window are coalesced into one update.
+READ_RECEIPT_DEBOUNCE_MS = int(
+    os.environ.get("CHAT_READ_RECEIPT_DEBOUNCE_MS", "250")
+)
+ATTACHMENTS_DIR = os.environ.get(
+    "CHAT_ATTACHMENTS_DIR", "attachments"
+)
+ATTACHMENT_MAX_BYTES = int(
+    os.environ.get(
+        "CHAT_ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)
+    )
+)
+# Total bytes of distinct attachments each user may upload.
+ATTACHMENT_QUOTA_BYTES = int(
+    os.environ.get(
+        "CHAT_ATTACHMENT_QUOTA_BYTES", str(200 * 1024 * 1024)
+    )
+)
+ATTACHMENT_THUMBNAIL_SIZE = int(
+    os.environ.get("CHAT_ATTACHMENT_THUMBNAIL_SIZE", "320")
+)
+# Time every AuthState/ChatState event handler and computed var.
+INSTRUMENTATION_ENABLED = os.environ.get(
+    "CHAT_INSTRUMENT_STATES", "0"
+) in ("1", "true", "yes")
+# Instrumented events slower than this are logged; 0 disables the log.
+SLOW_EVENT_THRESHOLD_MS = float(
+    os.environ.get("CHAT_SLOW_EVENT_MS", "0")
+)
+# /metrics answers only loopback clients unless this is set.
+METRICS_ALLOW_REMOTE = os.environ.get(
+    "CHAT_METRICS_ALLOW_REMOTE", "0"
+) in ("1", "true", "yes")
+# Negotiate permessage-deflate on the event websocket (production worker).
+WS_COMPRESSION_ENABLED = os.environ.get(
+    "CHAT_WS_COMPRESSION", "1"
+) in ("1", "true", "yes")
+# Websocket messages smaller than this are sent uncompressed.
+WS_COMPRESSION_MIN_BYTES = int(
+    os.environ.get("CHAT_WS_COMPRESSION_MIN_BYTES", "1024")
+)
+# Token buckets for sending messages: sustained sends per second and burst.
+SEND_RATE_PER_USER = float(
+    os.environ.get("CHAT_SEND_RATE_PER_USER", "5")
+)
+SEND_BURST_PER_USER = float(
+    os.environ.get("CHAT_SEND_BURST_PER_USER", "10")
+)
+SEND_RATE_PER_SESSION = float(
+    os.environ.get("CHAT_SEND_RATE_PER_SESSION", "3")
+)
+SEND_BURST_PER_SESSION = float(
+    os.environ.get("CHAT_SEND_BURST_PER_SESSION", "6")
+)
+SEND_RATE_GLOBAL = float(
+    os.environ.get("CHAT_SEND_RATE_GLOBAL", "500")
+)
+SEND_BURST_GLOBAL = float(
+    os.environ.get("CHAT_SEND_BURST_GLOBAL", "1000")
+)
+# Sends a user may have waiting on the state lock before new ones are
+# rejected.
+SEND_MAX_IN_FLIGHT = int(
+    os.environ.get("CHAT_SEND_MAX_IN_FLIGHT", "4")
+)
+# Sends carry a client-generated id; a resubmitted id (double click, retry
+# after a reconnect) is dropped if seen within this window. At most
+# SEND_DEDUPE_SIZE ids are remembered, least recently seen evicted first.
+SEND_DEDUPE_WINDOW_S = float(
+    os.environ.get("CHAT_SEND_DEDUPE_WINDOW_S", "600")
+)
+SEND_DEDUPE_SIZE = int(
+    os.environ.get("CHAT_SEND_DEDUPE_SIZE", "100000")
+)
+# HMAC key for session tokens; set it so sessions survive restarts and are
+# accepted by every backend worker.
+SESSION_SECRET = os.environ.get("CHAT_SESSION_SECRET", "")
+SESSION_TTL_S = int(
+    os.environ.get("CHAT_SESSION_TTL_S", str(7 * 24 * 3600))
+)
+# Recently verified session tokens remembered per process.
+SESSION_CACHE_SIZE = int(
+    os.environ.get("CHAT_SESSION_CACHE_SIZE", "4096")
+)
+# Unix socket of the bus broker (python -m app.services.bus). When set,
+# each backend worker joins the bus and conversations are sharded across
+# workers; when empty, the worker owns every conversation.
+BUS_SOCKET = os.environ.get("CHAT_BUS_SOCKET", "")
+# Message ids are interleaved between this many worker slots.
+BUS_MAX_WORKERS = int(os.environ.get("CHAT_BUS_MAX_WORKERS", "64"))
+# Connected sessions refresh their user's presence this often; a user goes
+# offline once no heartbeat arrived for PRESENCE_TIMEOUT_S.
+PRESENCE_HEARTBEAT_S = float(
+    os.environ.get("CHAT_PRESENCE_HEARTBEAT_S", "15")
+)
+PRESENCE_TIMEOUT_S = float(
+    os.environ.get("CHAT_PRESENCE_TIMEOUT_S", "40")
+)
+# Browsers send at most one typing event per interval; typing stops when
+# none arrived for TYPING_TIMEOUT_S.
+TYPING_THROTTLE_MS = int(
+    os.environ.get("CHAT_TYPING_THROTTLE_MS", "2000")
+)
+TYPING_TIMEOUT_S = float(
+    os.environ.get("CHAT_TYPING_TIMEOUT_S", "5")
+)
+# Messages older than ARCHIVE_AFTER_DAYS are moved out of the database into
+# compressed, immutable segment files, one per UTC day (0 disables it).
+ARCHIVE_DIR = os.environ.get("CHAT_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(
+    os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", "30")
+)
+# Segments older than this many days are deleted (0 keeps them forever).
+ARCHIVE_RETENTION_DAYS = int(
+    os.environ.get("CHAT_ARCHIVE_RETENTION_DAYS", "0")
+)
+ARCHIVE_COMPACT_INTERVAL_S = float(
+    os.environ.get("CHAT_ARCHIVE_COMPACT_INTERVAL_S", "3600")
+)
+# Archive segments kept memory-mapped at once.
+ARCHIVE_OPEN_SEGMENTS = int(
+    os.environ.get("CHAT_ARCHIVE_OPEN_SEGMENTS", "16")
+)
+# Messages kept in memory per loaded conversation; older ones are read
+# from the database or the archive when someone scrolls back.
+HOT_TAIL_SIZE = int(os.environ.get("CHAT_HOT_TAIL_SIZE", "200"))
+# Conversations kept loaded in memory, least recently used evicted first.
+HOT_CONVERSATIONS = int(
+    os.environ.get("CHAT_HOT_CONVERSATIONS", "5000")
+)
@@ -1,6 +1,21 @@
 import reflex as rx
 from app.models import User
-import bcrypt
+from app.services.cluster import cluster
+from app.services.storage import StorageWriteError
+from app.services.user_directory import user_directory
+from app.services.passwords import (
+    HasherBusyError,
+    password_hasher,
+)
+from app.services.seed_accounts import (
+    LazyPasswordHash,
+    load_credentials,
+)
+from app.services.session_tokens import (
+    SESSION_COOKIE,
+    session_tokens,
+)
+from app import settings
 import uuid
 import os
 from typing import Optional, cast
@@ -13,35 +28,55 @@ DEFAULT_PROFILE_PICS = [
     "minimal_abstract_geometric.png",
     "simple_minimal_abstract.png",
 ]
+ADMIN_DEFAULT_PASSWORD = "adminpassword123"
 
+# Hashed on the first admin sign-in rather than at import time, unless a
+# precomputed hash is configured.
+admin_password_hash = LazyPasswordHash(
+    ADMIN_DEFAULT_PASSWORD,
+    precomputed=settings.ADMIN_PASSWORD_HASH,
+)
+user_directory.add_seed(
+    ADMIN_EMAIL,
+    User(
+        password="",
+        name=ADMIN_NAME,
+        profile_photo=DEFAULT_PROFILE_PICS[0],
+    ),
+)
 
-def hash_password(password: str) -> str:
-    """Hashes a password using bcrypt."""
-    return bcrypt.hashpw(
-        password.encode(), bcrypt.gensalt()
-    ).decode()
 
-
-def verify_password(
-    plain_password: str, hashed_password: str
-) -> bool:
-    """Verifies a plain password against a hashed one."""
-    return bcrypt.checkpw(
-        plain_password.encode(), hashed_password.encode()
+def _without_password(user: User | None) -> User | None:
+    """Blanks the password hash of a user that is sent to the client."""
+    if user is None:
+        return None
+    return User(
+        password="",
+        name=user["name"],
+        profile_photo=user["profile_photo"],
     )
 
 
 class AuthState(rx.State):
     """Manages user authentication, registration, and session state."""
 
-    users: dict[str, User] = {
-        ADMIN_EMAIL: User(
-            password=hash_password("adminpassword123"),
-            name=ADMIN_NAME,
-            profile_photo=DEFAULT_PROFILE_PICS[0],
-        )
-    }
     logged_in_user_email: str | None = None
+    # Reflex cookies are written by the frontend, so they cannot be
+    # HttpOnly; revoking the token on sign-out limits what a stolen one
+    # is worth.
+    session_token: str = rx.Cookie(
+        "",
+        name=SESSION_COOKIE,
+        max_age=settings.SESSION_TTL_S,
+        same_site="strict",
+        secure=True,
+    )
+
+    def _find_user(self, email: str) -> User | None:
+        """Looks up a user in the seed credentials, then the shared user directory."""
+        return load_credentials(
+            settings.CREDENTIALS_FILE
+        ).get(email) or user_directory.get(email)
 
     @rx.var
     def is_authenticated(self) -> bool:
@@ -51,11 +86,10 @@ class AuthState(rx.State):
     @rx.var
     def current_user(self) -> User | None:
         """Returns the User object for the currently logged-in user."""
-        if (
-            self.logged_in_user_email
-            and self.logged_in_user_email in self.users
-        ):
-            return self.users[self.logged_in_user_email]
+        if self.logged_in_user_email:
+            return _without_password(
+                self._find_user(self.logged_in_user_email)
+            )
         return None
 
     @rx.var
@@ -84,7 +118,9 @@ class AuthState(rx.State):
     @rx.var
     def admin_user_details(self) -> User | None:
         """Returns the admin user details."""
-        return self.users.get(ADMIN_EMAIL)
+        return _without_password(
+            self._find_user(ADMIN_EMAIL)
+        )
 
     @rx.var
     def admin_display_name(self) -> str:
@@ -105,7 +141,7 @@ class AuthState(rx.State):
         return f"/{DEFAULT_PROFILE_PICS[0]}"
 
     @rx.event
-    def sign_up(self, form_data: dict):
+    async def sign_up(self, form_data: dict):
         """Registers a new user."""
         email = form_data.get("email", "").strip().lower()
         password = form_data.get("password", "")
@@ -118,7 +154,7 @@ class AuthState(rx.State):
         if email == ADMIN_EMAIL:
             yield rx.toast.error("This email is reserved.")
             return
-        if email in self.users:
+        if self._find_user(email) is not None:
             yield rx.toast.error(
                 "Email already in use. Please log in or use a different email."
             )
@@ -126,21 +162,38 @@ class AuthState(rx.State):
         profile_photo_to_save = random.choice(
             DEFAULT_PROFILE_PICS
         )
-        hashed_pw = hash_password(password)
+        try:
+            hashed_pw = await password_hasher.hash(password)
+        except HasherBusyError:
+            yield rx.toast.error(
+                "The server is busy. Please try again in a moment."
+            )
+            return
         new_user = User(
             password=hashed_pw,
             name=name,
             profile_photo=profile_photo_to_save,
         )
-        self.users[email] = new_user
-        self.logged_in_user_email = email
+        try:
+            await cluster.add_user(email, new_user)
+        except ValueError:
+            yield rx.toast.error(
+                "Email already in use. Please log in or use a different email."
+            )
+            return
+        except StorageWriteError:
+            yield rx.toast.error(
+                "Could not create your account. Please try again."
+            )
+            return
+        self._start_session(email)
         yield rx.toast.success(
             f"Welcome, {name}! Your account has been created with a random avatar."
         )
-        return rx.redirect("/chat")
+        yield rx.redirect("/chat")
 
     @rx.event
-    def sign_in(self, form_data: dict):
+    async def sign_in(self, form_data: dict):
         """Logs in an existing user."""
         email = form_data.get("email", "").strip().lower()
         password = form_data.get("password", "")
@@ -149,18 +202,58 @@ class AuthState(rx.State):
                 "Email and password are required."
             )
             return
-        user_data = self.users.get(email)
-        if user_data and verify_password(
-            password, user_data["password"]
-        ):
-            self.logged_in_user_email = email
+        user_data = self._find_user(email)
+        try:
+            hashed_password = (
+                user_data["password"] if user_data else ""
+            )
+            if user_data and email == ADMIN_EMAIL:
+                hashed_password = (
+                    hashed_password
+                    or await admin_password_hash.get()
+                )
+            password_ok = (
+                bool(hashed_password)
+                and await password_hasher.verify(
+                    password, hashed_password
+                )
+            )
+        except HasherBusyError:
+            yield rx.toast.error(
+                "The server is busy. Please try again in a moment."
+            )
+            return
+        if user_data and password_ok:
+            self._start_session(email)
             yield rx.toast.success(
                 f"Welcome back, {user_data['name']}!"
             )
-            return rx.redirect("/chat")
+            yield rx.redirect("/chat")
+            return
         yield rx.toast.error("Invalid email or password.")
         self.logged_in_user_email = None
 
+    def _start_session(self, email: str):
+        """Logs `email` in and issues the session cookie that restores it later."""
+        self.logged_in_user_email = email
+        self.session_token = session_tokens.issue(email)
+
+    def _restore_session(self):
+        """Logs in from the session cookie if this tab has no identity yet."""
+        if (
+            self.logged_in_user_email is not None
+            or not self.session_token
+        ):
+            return
+        email = session_tokens.verify(self.session_token)
+        if (
+            email is not None
+            and self._find_user(email) is not None
+        ):
+            self.logged_in_user_email = email
+        else:
+            self.session_token = ""
+
     @rx.event
     def sign_out(self):
         """Logs out the current user."""
@@ -169,20 +262,24 @@ class AuthState(rx.State):
             if self.current_user
             else "User"
         )
+        session_tokens.revoke(self.session_token)
         self.logged_in_user_email = None
+        self.session_token = ""
         yield rx.toast.info(
             f"You have been logged out, {user_name}."
         )
-        return rx.redirect("/login")
+        yield rx.redirect("/login")
 
     @rx.event
     def check_login_status(self):
         """Redirects to login page if the user is not authenticated."""
+        self._restore_session()
         if not self.is_authenticated:
             return rx.redirect("/login")
 
     @rx.event
     def redirect_if_logged_in(self):
         """Redirects to chat page if the user is already authenticated."""
+        self._restore_session()
         if self.is_authenticated:
-            return rx.redirect("/chat")
\ No newline at end of file
+            return rx.redirect("/chat")
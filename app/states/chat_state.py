@@ -1,27 +1,148 @@
 import reflex as rx
-from app.models import Message, User
+from app.models import Message, User, WireMessage
 from app.states.auth_state import (
     AuthState,
     ADMIN_EMAIL,
     DEFAULT_PROFILE_PICS,
 )
+from app.services.message_store import (
+    BROADCAST_RECIPIENT,
+    conversation_id,
+    decode_cursor,
+    encode_cursor,
+    message_store,
+    participants,
+    to_wire,
+)
+from app.services.cluster import cluster
+from app.services.hub import hub
+from app.services.presence import presence
+from app.services.rate_limit import send_limiter
+from app.services.read_receipts import read_receipts
+from app.services.search_index import search_index
+from app.services.storage import StorageWriteError, storage
+from app.services.attachments import (
+    CHUNK_SIZE,
+    AttachmentTooLargeError,
+    QuotaExceededError,
+    attachment_store,
+)
+from app.services.user_directory import user_directory
+from app import settings
+from reflex.utils import prerequisites
+import asyncio
 import datetime
-from typing import cast
+import heapq
+import urllib.parse
+import uuid
+from typing import Any, cast
+
+MESSAGE_PAGE_SIZE = 50
+MAX_RENDERED_MESSAGES = 200
+# New messages are appended to a short tail list so that each append only
+# re-sends the tail; the tail is folded into displayed_messages when full.
+RECENT_TAIL_SIZE = 20
+ADMIN_USER_PAGE_SIZE = 25
+NO_CHAT_PARTNER = (
+    "Select a User to Chat",
+    f"/{DEFAULT_PROFILE_PICS[0]}",
+)
+MESSAGE_SEARCH_LIMIT = 50
+SEND_THROTTLED_MESSAGES = {
+    "in_flight": "Still sending your previous messages. Please wait a moment.",
+    "session": "You're sending messages too quickly. Please slow down.",
+    "user": "You're sending messages too quickly. Please slow down.",
+    "global": "The chat is busy right now. Please try again in a moment.",
+}
+# Client message ids longer than this are ignored rather than remembered.
+MAX_CLIENT_MESSAGE_ID_LENGTH = 64
+# Pushed events that never change conversations or their summaries.
+EPHEMERAL_EVENTS = ("presence", "typing")
+
+
+def _parse_search_date(value: str, end_of_day: bool) -> float | None:
+    """Converts a YYYY-MM-DD form value to epoch seconds (UTC), or None."""
+    try:
+        day = datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return None
+    if end_of_day:
+        day += datetime.timedelta(days=1, microseconds=-1)
+    return day.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _new_draft_id() -> str:
+    """Returns a fresh client message id for the next message composed."""
+    return uuid.uuid4().hex
+
+
+def _client_message_id(form_data: dict) -> str:
+    """Returns the id the browser generated for a submitted form, or "" if it sent none."""
+    client_id = str(form_data.get("client_message_id", ""))
+    if len(client_id) > MAX_CLIENT_MESSAGE_ID_LENGTH:
+        return ""
+    return client_id
+
+
+def _is_session_connected(token: str) -> bool:
+    """Checks whether a client token still has an open websocket."""
+    namespace = (
+        prerequisites.get_and_validate_app().app.event_namespace
+    )
+    return (
+        namespace is not None
+        and token in namespace.token_to_sid
+    )
+
+
+async def _read_chunks(file: rx.UploadFile):
+    """Yields an uploaded file's contents in fixed-size chunks."""
+    while chunk := await file.read(CHUNK_SIZE):
+        yield chunk
 
 
 class ChatState(rx.State):
     """Manages chat messages and interactions."""
 
-    messages: list[Message] = []
+    displayed_messages: list[WireMessage] = []
+    recent_messages: list[WireMessage] = []
+    history_cursor: str = ""
+    has_newer_messages: bool = False
+    partner_read_position: int = -1
+    last_message_seen: bool = False
     current_message_input: str = ""
+    # Client message ids of the drafts in the message and broadcast forms.
+    # Each stays the same across resends and is replaced once the send is
+    # acknowledged.
+    message_draft_id: str = ""
+    broadcast_draft_id: str = ""
     active_chat_user_email: str | None = None
+    chat_partner: dict[str, str] = {
+        "name": NO_CHAT_PARTNER[0],
+        "profile_photo_src": NO_CHAT_PARTNER[1],
+    }
+    admin_user_list: list[dict[str, str]] = []
+    admin_user_query: str = ""
+    admin_user_sort: str = "name"
+    message_search_results: list[dict[str, str]] = []
+    message_search_active: bool = False
+    admin_user_page: int = 0
+    admin_user_total: int = 0
+    online_users: list[str] = []
+    typing_users: list[str] = []
+    partner_typing: bool = False
+    _window_start: int = 0
+    _window_end: int = 0
+    _viewer_email: str = ""
+    _listener_id: int = 0
+    _chat_partner_key: tuple[str, str, int] = ("", "", -1)
 
     async def _get_user_details_from_auth(
         self, email: str
     ) -> tuple[str, str]:
         """Helper to get user name and profile pic URL from AuthState."""
         auth_s = await self.get_state(AuthState)
-        user = auth_s.users.get(email)
+        user = auth_s._find_user(email)
         if user:
             name = user["name"]
             profile_photo_filename = user["profile_photo"]
@@ -32,90 +153,285 @@ class ChatState(rx.State):
             f"/{DEFAULT_PROFILE_PICS[0]}",
         )
 
-    @rx.var
-    async def current_chat_partner_name(self) -> str:
-        """Determines the name of the current chat partner."""
+    async def _refresh_chat_partner(self):
+        """Re-resolves the chat partner's profile if the viewer, the active user or the directory changed."""
         auth_s = await self.get_state(AuthState)
+        viewer_email = auth_s.logged_in_user_email or ""
         if auth_s.is_admin:
-            if self.active_chat_user_email:
-                user_details = (
-                    await self._get_user_details_from_auth(
-                        self.active_chat_user_email
-                    )
-                )
-                return user_details[0]
-            return "Select a User to Chat"
+            partner_email = self.active_chat_user_email or ""
         else:
-            admin_details = (
-                await self._get_user_details_from_auth(
-                    ADMIN_EMAIL
-                )
+            partner_email = ADMIN_EMAIL if viewer_email else ""
+        key = (viewer_email, partner_email, user_directory.version)
+        if key == self._chat_partner_key:
+            return
+        if partner_email:
+            name, pic_src = await self._get_user_details_from_auth(
+                partner_email
             )
-            return admin_details[0]
+        else:
+            name, pic_src = NO_CHAT_PARTNER
+        # Looking a user up may load the directory and bump its version.
+        self._chat_partner_key = (
+            viewer_email,
+            partner_email,
+            user_directory.version,
+        )
+        self.chat_partner = {
+            "name": name,
+            "profile_photo_src": pic_src,
+        }
 
-    @rx.var
-    async def current_chat_partner_profile_pic(self) -> str:
-        """Determines the profile picture of the current chat partner."""
+    async def _partner_email(self) -> str | None:
+        """Returns the email of the user the viewer is chatting with, if any."""
         auth_s = await self.get_state(AuthState)
+        if not auth_s.logged_in_user_email:
+            return None
         if auth_s.is_admin:
-            if self.active_chat_user_email:
-                user_details = (
-                    await self._get_user_details_from_auth(
-                        self.active_chat_user_email
-                    )
-                )
-                return user_details[1]
-            return f"/{DEFAULT_PROFILE_PICS[0]}"
-        else:
-            admin_details = (
-                await self._get_user_details_from_auth(
-                    ADMIN_EMAIL
-                )
-            )
-            return admin_details[1]
+            return self.active_chat_user_email
+        return ADMIN_EMAIL
 
-    @rx.var
-    async def displayed_messages(self) -> list[Message]:
-        """Filters messages for the current active chat."""
+    async def _active_conversation_id(self) -> str | None:
+        """Returns the id of the conversation currently shown, if any."""
         auth_s = await self.get_state(AuthState)
-        if (
-            not auth_s.is_authenticated
-            or not auth_s.logged_in_user_email
-        ):
-            return []
-        logged_in_email = auth_s.logged_in_user_email
+        if not auth_s.logged_in_user_email:
+            return None
         if auth_s.is_admin:
             if not self.active_chat_user_email:
-                return []
-            return [
-                m
-                for m in self.messages
-                if m["sender_email"] == logged_in_email
-                and m["receiver_email"]
-                == self.active_chat_user_email
-                or (
-                    m["sender_email"]
-                    == self.active_chat_user_email
-                    and m["receiver_email"]
-                    == logged_in_email
-                )
-            ]
+                return None
+            partner_email = self.active_chat_user_email
         else:
-            return [
-                m
-                for m in self.messages
-                if m["sender_email"] == logged_in_email
-                and m["receiver_email"] == ADMIN_EMAIL
-                or (
-                    m["sender_email"] == ADMIN_EMAIL
-                    and m["receiver_email"]
-                    == logged_in_email
+            partner_email = ADMIN_EMAIL
+        return conversation_id(
+            auth_s.logged_in_user_email, partner_email
+        )
+
+    def _to_wire(
+        self, messages: list[Message]
+    ) -> list[WireMessage]:
+        """Converts stored messages to the compact form rendered for the viewer."""
+        return [
+            to_wire(message, self._viewer_email)
+            for message in messages
+        ]
+
+    async def _page(
+        self, cid: str, end: int | None
+    ) -> tuple[list[WireMessage], int]:
+        """Returns the page of `cid` ending before position `end` (None for the latest page) and its start.
+
+        Broadcasts sent between the page's first and last message are merged
+        in by time; the latest page also gets every broadcast sent after it.
+        """
+        messages, start = await message_store.page(
+            cid, end, MESSAGE_PAGE_SIZE
+        )
+        stop = start + len(messages)
+        previous = (
+            (await message_store.page(cid, start, 1))[0]
+            if start > message_store.first_position(cid)
+            else []
+        )
+        after = previous[0]["timestamp"] if previous else None
+        if stop >= message_store.conversation_length(cid):
+            until = None
+        elif messages:
+            until = messages[-1]["timestamp"]
+        else:
+            return [], start
+        broadcasts = message_store.broadcasts_between(
+            after, until, MESSAGE_PAGE_SIZE
+        )
+        merged = heapq.merge(
+            messages,
+            broadcasts,
+            key=lambda message: message["timestamp"],
+        )
+        return self._to_wire(list(merged)), start
+
+    def _show_window(
+        self, cid: str, messages: list[WireMessage], start: int
+    ):
+        """Replaces the rendered window with `messages`, starting at position `start`."""
+        self.displayed_messages = messages
+        self.recent_messages = []
+        self._window_start = start
+        self._window_end = start + sum(
+            not message["broadcast"] for message in messages
+        )
+        self.history_cursor = (
+            encode_cursor(cid, start)
+            if start > message_store.first_position(cid)
+            else ""
+        )
+        self.has_newer_messages = (
+            self._window_end
+            < message_store.conversation_length(cid)
+        )
+        self._refresh_seen_marker()
+
+    def _refresh_seen_marker(self):
+        """Updates whether the partner has read the viewer's latest rendered message."""
+        last = next(
+            (
+                message
+                for window in (
+                    self.recent_messages,
+                    self.displayed_messages,
                 )
+                for message in reversed(window)
+                if not message["broadcast"]
+            ),
+            None,
+        )
+        self.last_message_seen = (
+            last is not None
+            and last["mine"]
+            and self._window_end - 1
+            <= self.partner_read_position
+        )
+
+    def _push_to_tail(self, cid: str, message: WireMessage):
+        """Appends to the rendered tail, folding it into displayed_messages when full."""
+        if not message["broadcast"]:
+            self._window_end += 1
+        if len(self.recent_messages) < RECENT_TAIL_SIZE:
+            self.recent_messages = self.recent_messages + [
+                message
             ]
+            self._refresh_seen_marker()
+            return
+        messages = (
+            self.displayed_messages
+            + self.recent_messages
+            + [message]
+        )
+        start = self._window_start
+        overflow = len(messages) - MAX_RENDERED_MESSAGES
+        if overflow > 0:
+            start += sum(
+                not dropped["broadcast"]
+                for dropped in messages[:overflow]
+            )
+            messages = messages[overflow:]
+        self._show_window(cid, messages, start)
+
+    async def _append_to_window(
+        self, cid: str, message: Message, position: int
+    ):
+        """Adds a new message to the window if the window shows the conversation's tail.
+
+        Only `recent_messages` changes unless the tail is full, so a typical
+        append sends a handful of messages instead of the whole window.
+        """
+        if self.has_newer_messages:
+            return
+        if position < self._window_end:
+            return
+        if position > self._window_end:
+            self._show_window(cid, *await self._page(cid, None))
+            return
+        self._push_to_tail(
+            cid, to_wire(message, self._viewer_email)
+        )
+
+    @rx.var
+    def conversation_export_query(self) -> str:
+        """Query string selecting the admin's open conversation on /export/messages, or ""."""
+        if not self.active_chat_user_email:
+            return ""
+        return urllib.parse.urlencode(
+            {
+                "user": self.active_chat_user_email,
+                "partner": ADMIN_EMAIL,
+            }
+        )
+
+    @rx.var
+    def has_older_messages(self) -> bool:
+        """Whether there is history before the rendered window."""
+        return self.history_cursor != ""
+
+    async def _show_latest_page(self):
+        """Shows the most recent page of the active conversation."""
+        await self._refresh_chat_partner()
+        cid = await self._active_conversation_id()
+        if cid is None:
+            self.displayed_messages = []
+            self.recent_messages = []
+            self.history_cursor = ""
+            self.has_newer_messages = False
+            self.partner_read_position = -1
+            self.last_message_seen = False
+            return
+        auth_s = await self.get_state(AuthState)
+        self._viewer_email = cast(
+            str, auth_s.logged_in_user_email
+        )
+        partner_email = next(
+            (
+                email
+                for email in participants(cid)
+                if email != self._viewer_email
+            ),
+            self._viewer_email,
+        )
+        await message_store.load_read_state(cid)
+        self.partner_read_position = message_store.read_cursor(
+            cid, partner_email
+        )
+        self.partner_typing = presence.is_typing(
+            partner_email, self._viewer_email
+        )
+        self._show_window(cid, *await self._page(cid, None))
+        read_receipts.mark_read(
+            cid, self._viewer_email, self._window_end - 1
+        )
+
+    @rx.event
+    async def load_latest_messages(self):
+        """Opens the active conversation at its most recent messages."""
+        if not self.message_draft_id:
+            self.message_draft_id = _new_draft_id()
+        if not self.broadcast_draft_id:
+            self.broadcast_draft_id = _new_draft_id()
+        await self._show_latest_page()
+
+    @rx.event
+    async def mark_window_read(self):
+        """Advances the viewer's read cursor to the end of the rendered window."""
+        cid = await self._active_conversation_id()
+        if cid is not None and self._viewer_email:
+            read_receipts.mark_read(
+                cid, self._viewer_email, self._window_end - 1
+            )
+
+    @rx.event
+    async def load_older_messages(self):
+        """Prepends the previous page, dropping the newest messages past the window limit."""
+        cid = await self._active_conversation_id()
+        if cid is None:
+            return
+        end = decode_cursor(cid, self.history_cursor)
+        if end is None:
+            return
+        older, start = await self._page(cid, end)
+        window = (
+            older
+            + self.displayed_messages
+            + self.recent_messages
+        )
+        self._show_window(
+            cid, window[:MAX_RENDERED_MESSAGES], start
+        )
 
     @rx.event(background=True)
     async def send_message(self, form_data: dict):
-        """Sends a message."""
+        """Sends a message.
+
+        A resubmission of the same draft (same client message id), e.g. a
+        double click or a retry after reconnecting, is not appended again;
+        the message it first sent is shown instead.
+        """
         auth_s = await self.get_state(AuthState)
         submitted_content = form_data.get(
             "chat_message_content", ""
@@ -154,68 +470,491 @@ class ChatState(rx.State):
             async with self:
                 self.current_message_input = ""
             return
-        new_msg = Message(
-            sender_email=sender_email,
-            receiver_email=receiver_email,
-            content=submitted_content,
-            timestamp=datetime.datetime.utcnow().isoformat(),
-            is_read=False,
-            file_url=None,
+        throttled = send_limiter.acquire(
+            sender_email, self.router.session.client_token
         )
-        async with self:
-            self.messages.append(new_msg)
-            self.current_message_input = ""
+        if throttled is not None:
+            yield rx.toast.warning(
+                SEND_THROTTLED_MESSAGES[throttled]
+            )
+            return
+        try:
+            new_msg = Message(
+                id=0,
+                sender_email=sender_email,
+                receiver_email=receiver_email,
+                content=submitted_content,
+                timestamp=datetime.datetime.utcnow().isoformat(),
+                is_read=False,
+                file_url=None,
+            )
+            async with self:
+                self.current_message_input = ""
+                await self._post_message(
+                    new_msg, _client_message_id(form_data)
+                )
+                self.message_draft_id = _new_draft_id()
+        finally:
+            send_limiter.release(sender_email)
         yield
 
+    @rx.event
+    async def send_broadcast(self, form_data: dict):
+        """Sends an announcement to every user (admin only).
+
+        The broadcast is stored once and shown in each conversation when it
+        is read; connected sessions get it in a single push.
+        """
+        auth_s = await self.get_state(AuthState)
+        if not auth_s.is_admin:
+            yield rx.toast.error(
+                "This action is available for admins only."
+            )
+            return
+        content = form_data.get("broadcast_content", "").strip()
+        if not content:
+            yield rx.toast.error("Enter an announcement to send.")
+            return
+        sender_email = cast(str, auth_s.logged_in_user_email)
+        throttled = send_limiter.acquire(
+            sender_email, self.router.session.client_token
+        )
+        if throttled is not None:
+            yield rx.toast.warning(
+                SEND_THROTTLED_MESSAGES[throttled]
+            )
+            return
+        try:
+            cluster.add_broadcast(
+                Message(
+                    id=0,
+                    sender_email=sender_email,
+                    receiver_email=BROADCAST_RECIPIENT,
+                    content=content,
+                    timestamp=datetime.datetime.utcnow().isoformat(),
+                    is_read=False,
+                    file_url=None,
+                ),
+                _client_message_id(form_data),
+            )
+            await cluster.drain()
+        finally:
+            send_limiter.release(sender_email)
+        self.broadcast_draft_id = _new_draft_id()
+        yield rx.toast.success("Announcement sent to all users.")
+
+    @rx.event
+    async def user_typing(self, value: str):
+        """Reports that the viewer is typing (or cleared the input) to the chat partner.
+
+        The input throttles these events; nothing is stored.
+        """
+        auth_s = await self.get_state(AuthState)
+        partner_email = await self._partner_email()
+        if not partner_email:
+            return
+        email = cast(str, auth_s.logged_in_user_email)
+        if value.strip():
+            presence.typing(email, partner_email)
+        else:
+            presence.stop_typing(email, partner_email)
+
+    @rx.event
+    async def upload_attachment(
+        self, files: list[rx.UploadFile]
+    ):
+        """Stores uploaded files and sends each one as a message in the active chat."""
+        auth_s = await self.get_state(AuthState)
+        sender_email = auth_s.logged_in_user_email
+        if auth_s.is_admin:
+            receiver_email = self.active_chat_user_email
+        else:
+            receiver_email = ADMIN_EMAIL
+        if not sender_email or not receiver_email:
+            yield rx.toast.error(
+                "Open a conversation before attaching files."
+            )
+            return
+        for file in files:
+            throttled = send_limiter.acquire(
+                sender_email, self.router.session.client_token
+            )
+            if throttled is not None:
+                yield rx.toast.warning(
+                    SEND_THROTTLED_MESSAGES[throttled]
+                )
+                return
+            content_type = (
+                file.content_type or "application/octet-stream"
+            )
+            try:
+                attachment = await attachment_store.save(
+                    sender_email,
+                    content_type,
+                    _read_chunks(file),
+                    readers=(receiver_email,),
+                )
+            except (
+                AttachmentTooLargeError,
+                QuotaExceededError,
+            ) as e:
+                yield rx.toast.error(str(e))
+                continue
+            except StorageWriteError:
+                yield rx.toast.error(
+                    "Could not store the file. Please try again."
+                )
+                continue
+            finally:
+                send_limiter.release(sender_email)
+            kind = (
+                "image"
+                if content_type.startswith("image/")
+                else "file"
+            )
+            await self._post_message(
+                Message(
+                    id=0,
+                    sender_email=sender_email,
+                    receiver_email=receiver_email,
+                    content=file.filename or "attachment",
+                    timestamp=datetime.datetime.utcnow().isoformat(),
+                    is_read=False,
+                    file_url=f"/files/{attachment['digest']}?kind={kind}",
+                )
+            )
+
+    async def _post_message(
+        self, message: Message, client_id: str = ""
+    ):
+        """Stores and indexes a message sent by this session, renders it and pushes it to both participants.
+
+        When another worker owns the conversation the message is rendered
+        once it comes back through the listener. For a resubmitted
+        `client_id` the message first sent with it is rendered.
+        """
+        presence.stop_typing(
+            message["sender_email"], message["receiver_email"]
+        )
+        # Appending to a conversation that is not in memory would read it
+        # on the event loop.
+        await message_store.load(
+            conversation_id(
+                message["sender_email"], message["receiver_email"]
+            )
+        )
+        posted = cluster.append(message, client_id)
+        # Sends wait here while the bus is backed up.
+        await cluster.drain()
+        if posted is None:
+            return
+        cid, position, message = posted
+        if self.has_newer_messages:
+            self._show_window(cid, *await self._page(cid, None))
+        else:
+            await self._append_to_window(cid, message, position)
+
+    async def _apply_pushed_events(
+        self, events: list[dict[str, Any]]
+    ):
+        """Applies events delivered by the hub to this session's state."""
+        auth_s = await self.get_state(AuthState)
+        email = cast(str, auth_s.logged_in_user_email)
+        active_cid = await self._active_conversation_id()
+        partner_email = await self._partner_email()
+        for event in events:
+            if (
+                event["type"] == "message"
+                and event["conversation_id"] == active_cid
+            ):
+                await self._append_to_window(
+                    active_cid,
+                    event["message"],
+                    event["position"],
+                )
+                if not self.has_newer_messages:
+                    read_receipts.mark_read(
+                        active_cid, email, event["position"]
+                    )
+            elif (
+                event["type"] == "receipt"
+                and event["conversation_id"] == active_cid
+                and event["reader"] != email
+            ):
+                self.partner_read_position = event["position"]
+                self._refresh_seen_marker()
+            elif (
+                event["type"] == "broadcast"
+                and active_cid is not None
+                and not self.has_newer_messages
+            ):
+                self._push_to_tail(
+                    active_cid,
+                    to_wire(event["message"], self._viewer_email),
+                )
+            elif (
+                event["type"] == "typing"
+                and event["email"] == partner_email
+            ):
+                self.partner_typing = event["active"]
+        if auth_s.is_admin:
+            if any(
+                event["type"] not in EPHEMERAL_EVENTS
+                for event in events
+            ):
+                await self._load_admin_user_page()
+            else:
+                self._refresh_presence(email)
+
+    @rx.event(background=True)
+    async def listen_for_messages(self):
+        """Applies events pushed to the logged-in user until the session goes away.
+
+        The listener also sends the user's presence heartbeats while the
+        session's websocket is connected. Starting a new
+        listener (e.g. on page reload) retires the previous one.
+        """
+        async with self:
+            auth_s = await self.get_state(AuthState)
+            email = auth_s.logged_in_user_email
+            self._listener_id += 1
+            listener_id = self._listener_id
+            token = self.router.session.client_token
+            if email and auth_s.is_admin:
+                presence.watch(email)
+        if not email:
+            return
+        subscription = hub.subscribe(email)
+        # Waking up at least once per heartbeat keeps the user online.
+        timeout = min(
+            settings.LISTENER_IDLE_TIMEOUT_S,
+            settings.PRESENCE_HEARTBEAT_S,
+        )
+        try:
+            while True:
+                # Pushed events keep waking a listener whose tab is gone;
+                # it must neither heartbeat nor keep running then.
+                if not _is_session_connected(token):
+                    return
+                presence.heartbeat(email)
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(), timeout
+                    )
+                    events = [event, *subscription.drain()]
+                except asyncio.TimeoutError:
+                    events = []
+                async with self:
+                    auth_s = await self.get_state(AuthState)
+                    if (
+                        self._listener_id != listener_id
+                        or auth_s.logged_in_user_email != email
+                    ):
+                        return
+                    if events:
+                        await self._apply_pushed_events(events)
+        finally:
+            subscription.close()
+
     @rx.event
     async def select_user_to_chat(self, user_email: str):
         """Allows admin to select a user to chat with."""
         auth_s = await self.get_state(AuthState)
         if auth_s.is_admin:
             self.active_chat_user_email = user_email
-            user_details = (
-                await self._get_user_details_from_auth(
-                    user_email
-                )
-            )
+            await self._show_latest_page()
+            await self._load_admin_user_page()
             yield rx.toast.info(
-                f"Opened chat with {user_details[0]}"
+                f"Opened chat with {self.chat_partner['name']}"
             )
         else:
             yield rx.toast.error(
                 "This action is available for admins only."
             )
 
-    @rx.var
-    async def get_chat_user_list_for_admin_view(
-        self,
-    ) -> list[dict[str, str]]:
-        """
-        Provides a list of users the admin can chat with.
-        Includes all registered users (excluding admin) and users admin has messaged.
-        """
+    async def _load_admin_user_page(self):
+        """Loads the visible page of the admin's user list from the user directory."""
         auth_s = await self.get_state(AuthState)
         if not auth_s.is_admin:
-            return []
-        all_non_admin_users_emails = {
-            email
-            for email in auth_s.users
-            if email != ADMIN_EMAIL
-        }
+            self.admin_user_list = []
+            self.admin_user_total = 0
+            return
+        admin_email = cast(str, auth_s.logged_in_user_email)
+        offset = self.admin_user_page * ADMIN_USER_PAGE_SIZE
+        if self.admin_user_sort == "name":
+            emails, self.admin_user_total = (
+                user_directory.search(
+                    self.admin_user_query,
+                    offset,
+                    ADMIN_USER_PAGE_SIZE,
+                )
+            )
+        else:
+            query = self.admin_user_query.strip().lower()
+            emails, self.admin_user_total = (
+                message_store.partner_page(
+                    admin_email,
+                    self.admin_user_sort,
+                    offset,
+                    ADMIN_USER_PAGE_SIZE,
+                    set(user_directory.matches(query))
+                    if query
+                    else None,
+                )
+            )
         user_list_for_view = []
-        for email in sorted(
-            list(all_non_admin_users_emails)
-        ):
+        for email in emails:
             user_details = (
                 await self._get_user_details_from_auth(
                     email
                 )
             )
+            summary = message_store.summary(
+                conversation_id(admin_email, email)
+            )
             user_list_for_view.append(
                 {
                     "email": email,
                     "name": user_details[0],
                     "profile_photo_src": user_details[1],
+                    "unread": str(
+                        summary["unread"].get(admin_email, 0)
+                        if summary
+                        else 0
+                    ),
+                    "last_message": (
+                        summary["last_message"]
+                        if summary
+                        else ""
+                    ),
+                    "last_activity": (
+                        summary["last_activity"][11:16]
+                        if summary
+                        else ""
+                    ),
                 }
             )
-        return user_list_for_view
\ No newline at end of file
+        self.admin_user_list = user_list_for_view
+        self._refresh_presence(admin_email)
+
+    def _refresh_presence(self, admin_email: str):
+        """Updates which users on the admin's visible page are online or typing."""
+        online = [
+            user["email"]
+            for user in self.admin_user_list
+            if presence.is_online(user["email"])
+        ]
+        typing = [
+            user["email"]
+            for user in self.admin_user_list
+            if presence.is_typing(user["email"], admin_email)
+        ]
+        # Assigning marks a var dirty, so only changed lists are re-sent.
+        if online != self.online_users:
+            self.online_users = online
+        if typing != self.typing_users:
+            self.typing_users = typing
+
+    @rx.var
+    def admin_user_page_count(self) -> int:
+        """Number of pages in the admin's (filtered) user list."""
+        return max(
+            1,
+            -(-self.admin_user_total // ADMIN_USER_PAGE_SIZE),
+        )
+
+    @rx.event
+    async def load_admin_users(self):
+        """Loads the first page of the admin's user list."""
+        self.admin_user_page = 0
+        await self._load_admin_user_page()
+
+    @rx.event
+    async def search_admin_users(self, query: str):
+        """Filters the admin's user list by a name or email prefix."""
+        self.admin_user_query = query
+        self.admin_user_page = 0
+        await self._load_admin_user_page()
+
+    @rx.event
+    async def set_admin_user_sort(self, sort: str):
+        """Orders the admin's user list by "name", "recent" activity or "unread" count."""
+        if sort not in ("name", "recent", "unread"):
+            return
+        self.admin_user_sort = sort
+        self.admin_user_page = 0
+        await self._load_admin_user_page()
+
+    @rx.event
+    async def change_admin_user_page(self, delta: int):
+        """Moves the admin's user list forward or back by `delta` pages."""
+        page = self.admin_user_page + delta
+        if 0 <= page < self.admin_user_page_count:
+            self.admin_user_page = page
+            await self._load_admin_user_page()
+
+    @rx.event
+    async def search_messages(self, form_data: dict):
+        """Searches every conversation by keyword, sender and date range (admin only)."""
+        auth_s = await self.get_state(AuthState)
+        if not auth_s.is_admin:
+            yield rx.toast.error(
+                "This action is available for admins only."
+            )
+            return
+        query = form_data.get("query", "").strip()
+        sender = form_data.get("sender", "").strip().lower()
+        if not query and not sender:
+            yield rx.toast.error(
+                "Enter a keyword or a sender email to search."
+            )
+            return
+        await search_index.ensure_loaded()
+        ids = search_index.search(
+            query,
+            sender=sender or None,
+            since=_parse_search_date(
+                form_data.get("since", ""), end_of_day=False
+            ),
+            until=_parse_search_date(
+                form_data.get("until", ""), end_of_day=True
+            ),
+            limit=MESSAGE_SEARCH_LIMIT,
+        )
+        try:
+            await storage.flush()
+        except StorageWriteError:
+            # Matches whose rows were dropped are left out below.
+            pass
+        messages = await asyncio.to_thread(storage.load_messages, ids)
+        results = []
+        for message in reversed(messages):
+            partner_email = (
+                message["receiver_email"]
+                if message["sender_email"] == ADMIN_EMAIL
+                else message["sender_email"]
+            )
+            sender_name, _ = (
+                await self._get_user_details_from_auth(
+                    message["sender_email"]
+                )
+            )
+            results.append(
+                {
+                    "id": str(message["id"]),
+                    "partner_email": partner_email,
+                    "sender_name": sender_name,
+                    "content": message["content"],
+                    "time": message["timestamp"][:16].replace(
+                        "T", " "
+                    ),
+                }
+            )
+        self.message_search_results = results
+        self.message_search_active = True
+
+    @rx.event
+    def clear_message_search(self):
+        """Closes the message search results."""
+        self.message_search_results = []
+        self.message_search_active = False
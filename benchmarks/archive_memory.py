@@ -0,0 +1,209 @@
+"""Measures the message store's steady-state memory as the archive grows.
+
+Usage: python benchmarks/archive_memory.py [--sizes 50000,100000,200000]
+           [--conversations 100] [--days 120] [--output results.json]
+
+For each history size a fresh process fills a database with that many
+messages spread over ``--days`` days and ``--conversations``
+conversations. Everything older than a week is compacted into archive
+segments, then a steady-state workload runs: every conversation is opened
+at its latest page, a few are scrolled back through archived history, and
+new messages are appended. Resident memory growth over the workload is
+reported with hot tails (the default) and with whole conversations kept
+in memory, as before archiving. Hot-tail memory stays flat as the archive
+grows; whole-history memory grows with it.
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models import Message  # noqa: E402
+from app.services.archive import Archiver  # noqa: E402
+from app.services.message_store import (  # noqa: E402
+    MessageStore,
+    conversation_id,
+)
+from app.services.storage import (  # noqa: E402
+    ADD_TO_LENGTH,
+    INSERT_MESSAGE,
+    Storage,
+)
+
+ADMIN_EMAIL = "admin@example.com"
+TODAY = datetime.date(2024, 6, 1)
+WORDS = (
+    "hello thanks order shipped refund when please update account "
+    "invoice delivery tomorrow issue fixed great sorry help question"
+).split()
+
+
+def read_rss() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def fill(storage: Storage, size: int, args) -> list[str]:
+    users = [f"user{i}@example.com" for i in range(args.conversations)]
+    start = datetime.datetime.combine(
+        TODAY - datetime.timedelta(days=args.days), datetime.time()
+    )
+    step = datetime.timedelta(days=args.days) / size
+    rows = []
+    for i in range(size):
+        user = users[i % len(users)]
+        sender, receiver = (
+            (user, ADMIN_EMAIL) if i % 2 else (ADMIN_EMAIL, user)
+        )
+        rows.append(
+            (
+                i + 1,
+                conversation_id(sender, receiver),
+                sender,
+                receiver,
+                " ".join(random.choices(WORDS, k=12)),
+                (start + step * i).isoformat(),
+                0,
+                None,
+            )
+        )
+    conn = storage.reader
+    conn.execute("BEGIN")
+    conn.executemany(INSERT_MESSAGE, rows)
+    lengths: dict[str, int] = {}
+    for row in rows:
+        lengths[row[1]] = lengths.get(row[1], 0) + 1
+    conn.executemany(ADD_TO_LENGTH, lengths.items())
+    conn.execute("COMMIT")
+    return users
+
+
+async def _measure(size: int, hot_tail: int | None, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(
+            os.path.join(tmp, "chat.db"),
+            durability="relaxed",
+            archive_dir=os.path.join(tmp, "archive"),
+        )
+        users = fill(storage, size, args)
+        archived_days = await Archiver(storage, 7, 0).compact(TODAY)
+        store = (
+            MessageStore(storage, hot_tail_size=hot_tail)
+            if hot_tail is not None
+            else MessageStore(storage, hot_tail_size=size + 1)
+        )
+        gc.collect()
+        rss_before = read_rss()
+        for user in users:
+            await store.page(conversation_id(user, ADMIN_EMAIL), None, 50)
+        for user in users[: args.scrolled]:
+            cid = conversation_id(user, ADMIN_EMAIL)
+            end = None
+            for _ in range(args.scroll_pages):
+                _, end = await store.page(cid, end, 50)
+        for i in range(args.appends):
+            user = users[i % len(users)]
+            store.append(
+                Message(
+                    id=0,
+                    sender_email=user,
+                    receiver_email=ADMIN_EMAIL,
+                    content=" ".join(random.choices(WORDS, k=12)),
+                    timestamp=datetime.datetime.combine(
+                        TODAY, datetime.time()
+                    ).isoformat(),
+                    is_read=False,
+                    file_url=None,
+                )
+            )
+        await storage.flush()
+        gc.collect()
+        rss_after = read_rss()
+        segments_bytes = sum(
+            entry.stat().st_size
+            for entry in os.scandir(os.path.join(tmp, "archive"))
+        )
+        await storage.close()
+    return {
+        "messages": size,
+        "archived_days": archived_days,
+        "segments_bytes": segments_bytes,
+        "rss_growth_bytes": rss_after - rss_before,
+        "rss_bytes": rss_after,
+    }
+
+
+def _child(size: int, hot_tail: int | None, args, results) -> None:
+    results.put(asyncio.run(_measure(size, hot_tail, args)))
+
+
+def measure(size: int, hot_tail: int | None, args) -> dict:
+    """Runs one measurement in a fresh process so RSS is not shared between runs."""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_child, args=(size, hot_tail, args, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="50000,100000,200000")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--hot-tail", type=int, default=200)
+    parser.add_argument(
+        "--scrolled",
+        type=int,
+        default=20,
+        help="Conversations scrolled back into the archive.",
+    )
+    parser.add_argument("--scroll-pages", type=int, default=10)
+    parser.add_argument("--appends", type=int, default=5000)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        results.append(
+            {
+                "hot_tail": measure(size, args.hot_tail, args),
+                "whole_history": measure(size, None, args),
+            }
+        )
+    text = json.dumps(
+        {
+            "config": {
+                "conversations": args.conversations,
+                "days": args.days,
+                "hot_tail": args.hot_tail,
+                "appends": args.appends,
+            },
+            "results": results,
+        },
+        indent=2,
+    )
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Measures message throughput with 1..N workers sharing the bus.
+
+Usage: python benchmarks/bus_scaling.py [--max-workers 4] [--messages 5000]
+           [--users 200] [--durability fsync] [--output results.json]
+
+Starts a bus broker and N worker processes for each N, sharing one fresh
+database as deployed workers do. Every worker plays the backend of its own
+connected users: it sends ``--messages`` messages from them to the admin
+through the cluster (forwarding to the owning worker when needed), waiting
+on the bus when it is backed up, and renders each one for the sender as
+the chat page would. A worker is done when it has received all N * messages
+events for the admin, who is connected everywhere, and its writes are
+committed. Throughput is total messages over the slowest worker's time.
+Scaling past the machine's core count is not expected, so it is reported
+with the results.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models import Message  # noqa: E402
+from app.services.bus import BusBroker  # noqa: E402
+from app.services.cluster import Cluster  # noqa: E402
+from app.services.dedupe import RecentKeys  # noqa: E402
+from app.services.hub import MessageHub  # noqa: E402
+from app.services.message_store import (  # noqa: E402
+    MessageStore,
+    to_wire,
+)
+from app.services.search_index import SearchIndex  # noqa: E402
+from app.services.storage import (  # noqa: E402
+    DURABILITY_MODES,
+    Storage,
+)
+from app.services.user_directory import UserDirectory  # noqa: E402
+
+ADMIN_EMAIL = "admin@example.com"
+MAX_SLOTS = 64
+WORDS = (
+    "hello thanks order shipped refund when please update account "
+    "invoice delivery tomorrow issue fixed great sorry help question"
+).split()
+
+
+def run_broker(path: str) -> None:
+    asyncio.run(BusBroker(path, MAX_SLOTS).serve_forever())
+
+
+def _storage(tmp: str, args) -> Storage:
+    return Storage(
+        os.path.join(tmp, "chat.db"),
+        durability=args.durability,
+        archive_dir=os.path.join(tmp, "archive"),
+    )
+
+
+async def _worker(
+    tmp: str, index: int, workers: int, args, barrier, results
+) -> None:
+    storage = _storage(tmp, args)
+    hub = MessageHub(workers * args.messages + 1)
+    cluster = Cluster(
+        MessageStore(storage),
+        SearchIndex(storage),
+        hub,
+        UserDirectory(None),
+        RecentKeys(args.messages, 60),
+    )
+    await cluster.start(os.path.join(tmp, "bus.sock"), MAX_SLOTS)
+    while len(cluster.ring.nodes) < workers:
+        await asyncio.sleep(0.01)
+    admin = hub.subscribe(ADMIN_EMAIL)
+    rng = random.Random(index)
+    users = [f"w{index}-user{i}@example.com" for i in range(args.users)]
+    await asyncio.to_thread(barrier.wait)
+    started = time.perf_counter()
+    for i in range(args.messages):
+        sender = rng.choice(users)
+        message = Message(
+            id=0,
+            sender_email=sender,
+            receiver_email=ADMIN_EMAIL,
+            content=" ".join(rng.choices(WORDS, k=12)),
+            timestamp=f"2025-01-01T00:00:{i % 60:02d}",
+            is_read=False,
+            file_url=None,
+        )
+        if cluster.append(message, f"{index}-{i}") is not None:
+            json.dumps(to_wire(message, sender))
+        await cluster.drain()
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+    received = 0
+    total = workers * args.messages
+    while received < total:
+        event = await admin.get()
+        received += event["type"] == "message"
+    await storage.flush()
+    results.put(time.perf_counter() - started)
+    await asyncio.to_thread(barrier.wait)
+    await cluster.stop()
+    await storage.close()
+
+
+def run_worker(tmp, index, workers, args, barrier, results) -> None:
+    asyncio.run(_worker(tmp, index, workers, args, barrier, results))
+
+
+async def _create_schema(tmp: str, args) -> None:
+    storage = _storage(tmp, args)
+    storage.reader  # Opening a connection creates the schema.
+    await storage.close()
+
+
+def measure(workers: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        # Created up front so the workers do not race to create it.
+        asyncio.run(_create_schema(tmp, args))
+        path = os.path.join(tmp, "bus.sock")
+        broker = multiprocessing.Process(
+            target=run_broker, args=(path,), daemon=True
+        )
+        broker.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        barrier = multiprocessing.Barrier(workers)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(tmp, i, workers, args, barrier, results),
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        elapsed = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        broker.terminate()
+        broker.join()
+    total = workers * args.messages
+    return {
+        "workers": workers,
+        "messages": total,
+        "seconds": max(elapsed),
+        "messages_per_s": total / max(elapsed),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--max-workers", type=int, default=os.cpu_count() or 1
+    )
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument(
+        "--durability",
+        choices=sorted(DURABILITY_MODES),
+        default="fsync",
+    )
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    runs = [measure(n, args) for n in range(1, args.max_workers + 1)]
+    base = runs[0]["messages_per_s"]
+    for run in runs:
+        run["speedup"] = run["messages_per_s"] / base
+    text = json.dumps(
+        {
+            "cpu_count": os.cpu_count(),
+            "durability": args.durability,
+            "runs": runs,
+        },
+        indent=2,
+    )
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Measures cold start of the app module against a time budget.
+
+Usage: python benchmarks/cold_start.py [--runs 5] [--budget-ms 1500]
+
+Each run imports ``app.app`` in a fresh interpreter with startup profiling
+enabled and reports the per-phase timings. Exits non-zero if the median
+total exceeds the budget.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def profile_once() -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "startup.json")
+        env = {
+            **os.environ,
+            "CHAT_PROFILE_STARTUP": "1",
+            "CHAT_STARTUP_PROFILE_OUTPUT": output,
+            "CHAT_DATABASE_PATH": os.path.join(tmp, "chat.db"),
+        }
+        subprocess.run(
+            [sys.executable, "-c", "import app.app"],
+            cwd=ROOT,
+            env=env,
+            check=True,
+        )
+        with open(output) as f:
+            return json.load(f)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms", type=float, default=1500.0
+    )
+    args = parser.parse_args()
+
+    reports = [profile_once() for _ in range(args.runs)]
+    phase_names = [p["name"] for p in reports[0]["phases"]]
+    summary = {
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "total_ms": statistics.median(
+            r["total_ms"] for r in reports
+        ),
+        "phases_ms": {
+            name: statistics.median(
+                p["ms"]
+                for r in reports
+                for p in r["phases"]
+                if p["name"] == name
+            )
+            for name in phase_names
+        },
+    }
+    print(json.dumps(summary, indent=2))
+    if summary["total_ms"] > args.budget_ms:
+        print(
+            f"Cold start {summary['total_ms']:.0f} ms exceeds the {args.budget_ms:.0f} ms budget.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
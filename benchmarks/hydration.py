@@ -0,0 +1,171 @@
+"""Compares encodings of the /chat hydration payload by size and time.
+
+Usage: python benchmarks/hydration.py [--messages 200] [--users 25]
+           [--link-kbps 1600] [--repeat 20] [--output results.json]
+
+Builds a representative admin hydration delta (the rendered message window
+and a page of the admin user list) and encodes it as the JSON Reflex sends
+today, as that JSON deflated the way permessage-deflate does on the
+websocket, and as msgpack (plain and deflated) when msgpack is installed.
+Hydration time is encode + transfer at ``--link-kbps`` + decode.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models import Message  # noqa: E402
+from app.services.message_store import to_wire  # noqa: E402
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ADMIN_EMAIL = "admin@example.com"
+WORDS = (
+    "hello thanks order shipped refund when please update account "
+    "password invoice delivery tomorrow issue fixed great sorry help "
+    "question payment card address today week check back soon"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(3, 18))).capitalize()
+
+
+def build_payload(messages: int, users: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    partner = "customer.name@example.com"
+    started = datetime.datetime(2025, 1, 1)
+    window = [
+        to_wire(
+            Message(
+                id=1000 + i,
+                sender_email=partner if i % 2 else ADMIN_EMAIL,
+                receiver_email=ADMIN_EMAIL if i % 2 else partner,
+                content=_sentence(rng),
+                timestamp=(
+                    started + datetime.timedelta(minutes=i)
+                ).isoformat(),
+                is_read=True,
+                file_url=None,
+            ),
+            ADMIN_EMAIL,
+        )
+        for i in range(messages)
+    ]
+    user_list = [
+        {
+            "email": f"user{i}@example.com",
+            "name": f"User Number {i}",
+            "profile_photo_src": "/person_1.png",
+            "unread": str(rng.randint(0, 5)),
+            "last_message": _sentence(rng)[:80],
+            "last_activity": "2025-01-01 12:00",
+        }
+        for i in range(users)
+    ]
+    return {
+        "reflex___state____state.app___states___chat_state____chat_state": {
+            "displayed_messages_rx_state_": window,
+            "recent_messages_rx_state_": [],
+            "admin_user_list_rx_state_": user_list,
+            "admin_user_total_rx_state_": users,
+        }
+    }
+
+
+def _deflate(data: bytes) -> bytes:
+    # Raw deflate with a sync flush, as permessage-deflate frames it.
+    encoder = zlib.compressobj(wbits=-15)
+    return (encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def _inflate(data: bytes) -> bytes:
+    decoder = zlib.decompressobj(wbits=-15)
+    return decoder.decompress(data + b"\x00\x00\xff\xff")
+
+
+def codecs() -> dict:
+    result = {
+        "json": (
+            lambda value: json.dumps(value, ensure_ascii=False).encode(),
+            lambda data: json.loads(data),
+        ),
+        "json+deflate": (
+            lambda value: _deflate(
+                json.dumps(value, ensure_ascii=False).encode()
+            ),
+            lambda data: json.loads(_inflate(data)),
+        ),
+    }
+    if msgpack is not None:
+        result["msgpack"] = (msgpack.packb, msgpack.unpackb)
+        result["msgpack+deflate"] = (
+            lambda value: _deflate(msgpack.packb(value)),
+            lambda data: msgpack.unpackb(_inflate(data)),
+        )
+    return result
+
+
+def measure(payload: dict, repeat: int, link_kbps: float) -> dict:
+    results = {}
+    for name, (encode, decode) in codecs().items():
+        encode_times, decode_times = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = encode(payload)
+            encode_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            decode(data)
+            decode_times.append(time.perf_counter() - started)
+        encode_ms = statistics.median(encode_times) * 1000
+        decode_ms = statistics.median(decode_times) * 1000
+        transfer_ms = len(data) * 8 / link_kbps
+        results[name] = {
+            "bytes": len(data),
+            "encode_ms": encode_ms,
+            "decode_ms": decode_ms,
+            "transfer_ms": transfer_ms,
+            "hydration_ms": encode_ms + transfer_ms + decode_ms,
+        }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--users", type=int, default=25)
+    parser.add_argument(
+        "--link-kbps",
+        type=float,
+        default=1600,
+        help="Link speed used for transfer time (default: slow 4G).",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    payload = build_payload(args.messages, args.users)
+    report = {
+        "config": vars(args),
+        "encodings": measure(payload, args.repeat, args.link_kbps),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
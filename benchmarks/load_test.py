@@ -0,0 +1,336 @@
+"""Headless websocket load test for a running chat backend.
+
+Usage:
+    python benchmarks/load_test.py --backend ws://localhost:8000 \\
+        --clients 100 --rate 0.5 --duration 60 \\
+        --server-pid <backend pid> --output results.json
+
+Each simulated client signs up (or signs in) through AuthState and then
+sends messages to the admin through ChatState.send_message at ``--rate``
+messages per second. One extra client signs in as the admin and runs the
+message listener. A message counts as rendered when a state delta
+containing its unique marker reaches a client. Both the sender's own echo
+and delivery to the admin are measured.
+
+With ``--typing`` each client also reports typing between messages, at the
+rate the input's throttle allows, and the presence/typing frames reaching
+the admin are counted per user on the admin's visible sidebar page.
+
+Requires python-socketio's async client (``pip install "python-socketio[asyncio_client]"``)
+and must run inside the app's environment so state names can be resolved.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import socketio
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.states.auth_state import (  # noqa: E402
+    ADMIN_DEFAULT_PASSWORD,
+    ADMIN_EMAIL,
+    AuthState,
+)
+from app import settings  # noqa: E402
+from app.states.chat_state import (  # noqa: E402
+    ADMIN_USER_PAGE_SIZE,
+    ChatState,
+)
+
+EVENT_PATH = "/_event"
+
+
+def _handler(state, name: str) -> str:
+    return f"{state.get_full_name()}.{name}"
+
+
+class Client:
+    """One simulated browser tab speaking Reflex's socket.io protocol."""
+
+    def __init__(
+        self, backend: str, stats: "Stats", is_admin: bool = False
+    ) -> None:
+        self.backend = backend
+        self.stats = stats
+        self.is_admin = is_admin
+        self.token = str(uuid.uuid4())
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("event", self._on_update, namespace=EVENT_PATH)
+
+    async def _on_update(self, update) -> None:
+        raw = update if isinstance(update, str) else json.dumps(update)
+        self.stats.bytes_received += len(raw.encode())
+        self.stats.updates_received += 1
+        self.stats.on_frame(raw, self.is_admin)
+
+    async def connect(self) -> None:
+        await self.sio.connect(
+            f"{self.backend}?token={self.token}",
+            socketio_path=EVENT_PATH,
+            namespaces=[EVENT_PATH],
+            transports=["websocket"],
+        )
+
+    async def emit(
+        self, handler: str, payload: dict, path: str = "/chat"
+    ) -> None:
+        event = {
+            "name": handler,
+            "payload": payload,
+            "token": self.token,
+            "router_data": {
+                "pathname": path,
+                "query": {},
+                "asPath": path,
+            },
+        }
+        self.stats.bytes_sent += len(json.dumps(event).encode())
+        self.stats.events_sent += 1
+        await self.sio.emit("event", event, namespace=EVENT_PATH)
+
+    async def sign_in(
+        self, email: str, password: str, name: str | None = None
+    ) -> None:
+        if name is not None:
+            await self.emit(
+                _handler(AuthState, "sign_up"),
+                {
+                    "form_data": {
+                        "email": email,
+                        "password": password,
+                        "name": name,
+                    }
+                },
+                path="/signup",
+            )
+        await self.emit(
+            _handler(AuthState, "sign_in"),
+            {"form_data": {"email": email, "password": password}},
+            path="/login",
+        )
+
+    async def close(self) -> None:
+        await self.sio.disconnect()
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.pending: dict[str, float] = {}
+        self.echo_latencies: list[float] = []
+        self.delivery_latencies: list[float] = []
+        self.marker_prefix = "@@bench-"
+        self.events_sent = 0
+        self.updates_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rss_samples: list[int] = []
+        self.typing_events_sent = 0
+        self.presence_frames = 0
+        self.presence_bytes = 0
+        self._seen: dict[bool, set[str]] = {False: set(), True: set()}
+
+    def new_marker(self) -> str:
+        marker = f"{self.marker_prefix}{uuid.uuid4().hex}"
+        self.pending[marker] = time.perf_counter()
+        return marker
+
+    def on_frame(self, raw: str, is_admin: bool) -> None:
+        """Records the first sighting of each marker by senders and by the admin."""
+        now = time.perf_counter()
+        if is_admin and (
+            "typing_users" in raw or "online_users" in raw
+        ):
+            self.presence_frames += 1
+            self.presence_bytes += len(raw.encode())
+        seen = self._seen[is_admin]
+        latencies = (
+            self.delivery_latencies if is_admin else self.echo_latencies
+        )
+        start = 0
+        while (i := raw.find(self.marker_prefix, start)) != -1:
+            marker = raw[i : i + len(self.marker_prefix) + 32]
+            start = i + 1
+            sent_at = self.pending.get(marker)
+            if sent_at is not None and marker not in seen:
+                seen.add(marker)
+                latencies.append(now - sent_at)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+    }
+
+
+def read_rss(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def sample_rss(pid: int, stats: Stats, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        stats.rss_samples.append(read_rss(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def pause(stop: asyncio.Event, seconds: float) -> None:
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_user(
+    client: Client, index: int, args, stats: Stats, stop: asyncio.Event
+) -> None:
+    email = f"bench-{index}-{client.token[:8]}@example.com"
+    await client.sign_in(email, "bench-password", name=f"Bench {index}")
+    await client.emit(
+        _handler(ChatState, "load_latest_messages"), {}
+    )
+    interval = 1 / args.rate
+    throttle = settings.TYPING_THROTTLE_MS / 1000
+    while not stop.is_set():
+        marker = stats.new_marker()
+        await client.emit(
+            _handler(ChatState, "send_message"),
+            {"form_data": {"chat_message_content": marker}},
+        )
+        if not args.typing:
+            await pause(stop, interval)
+            continue
+        typed = 0.0
+        while typed < interval and not stop.is_set():
+            await client.emit(
+                _handler(ChatState, "user_typing"),
+                {"value": "bench typing"},
+            )
+            stats.typing_events_sent += 1
+            await pause(stop, min(throttle, interval - typed))
+            typed += throttle
+
+
+async def main_async(args) -> dict:
+    stats = Stats()
+    admin = Client(args.backend, stats, is_admin=True)
+    await admin.connect()
+    await admin.sign_in(ADMIN_EMAIL, args.admin_password)
+    await admin.emit(_handler(ChatState, "listen_for_messages"), {})
+    await admin.emit(_handler(ChatState, "load_admin_users"), {})
+
+    clients = [Client(args.backend, stats) for _ in range(args.clients)]
+    for i in range(0, len(clients), args.connect_batch):
+        await asyncio.gather(
+            *(c.connect() for c in clients[i : i + args.connect_batch])
+        )
+
+    stop = asyncio.Event()
+    tasks = [
+        asyncio.create_task(run_user(c, i, args, stats, stop))
+        for i, c in enumerate(clients)
+    ]
+    if args.server_pid:
+        tasks.append(
+            asyncio.create_task(sample_rss(args.server_pid, stats, stop))
+        )
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(c.close() for c in [admin, *clients]))
+
+    return {
+        "config": {
+            "backend": args.backend,
+            "clients": args.clients,
+            "rate_per_client": args.rate,
+            "duration_s": args.duration,
+            "typing": args.typing,
+        },
+        "messages_sent": len(stats.pending),
+        "messages_echoed": len(stats.echo_latencies),
+        "messages_delivered_to_admin": len(stats.delivery_latencies),
+        "send_to_render_echo": percentiles(stats.echo_latencies),
+        "send_to_render_admin": percentiles(stats.delivery_latencies),
+        "events_sent_per_s": stats.events_sent / elapsed,
+        "updates_received_per_s": stats.updates_received / elapsed,
+        "typing_events_sent_per_user_per_s": (
+            stats.typing_events_sent / args.clients / elapsed
+        ),
+        "presence_frames_to_admin_per_visible_user_per_s": (
+            stats.presence_frames
+            / min(args.clients, ADMIN_USER_PAGE_SIZE)
+            / elapsed
+        ),
+        "presence_frame_bytes_avg": (
+            stats.presence_bytes / stats.presence_frames
+            if stats.presence_frames
+            else 0
+        ),
+        "websocket_bytes_sent": stats.bytes_sent,
+        "websocket_bytes_received": stats.bytes_received,
+        "server_rss_bytes": {
+            "max": max(stats.rss_samples, default=0),
+            "last": stats.rss_samples[-1] if stats.rss_samples else 0,
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", default="ws://localhost:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.5,
+        help="Messages per second per client.",
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument(
+        "--drain",
+        type=float,
+        default=2.0,
+        help="Seconds to wait for late deliveries.",
+    )
+    parser.add_argument(
+        "--typing",
+        action="store_true",
+        help="Report typing between messages.",
+    )
+    parser.add_argument("--connect-batch", type=int, default=50)
+    parser.add_argument("--admin-password", default=ADMIN_DEFAULT_PASSWORD)
+    parser.add_argument("--server-pid", type=int, default=0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
 import reflex as rx
 
-config = rx.Config(app_name="app")
\ No newline at end of file
+config = rx.Config(
+    app_name="app",
+    gunicorn_worker_class="app.server.CompressingUvicornWorker",
+)
@@ -0,0 +1,37 @@
+import pytest
+
+from app.models import Message
+from app.services.storage import Storage
+
+
+def make_message(
+    sender: str,
+    receiver: str,
+    content: str = "hello",
+    timestamp: str = "2025-01-01T00:00:00",
+    message_id: int = 0,
+) -> Message:
+    return Message(
+        id=message_id,
+        sender_email=sender,
+        receiver_email=receiver,
+        content=content,
+        timestamp=timestamp,
+        is_read=False,
+        file_url=None,
+    )
+
+
+@pytest.fixture
+def new_storage(tmp_path):
+    """Returns a factory of storages over fresh databases in `tmp_path`."""
+
+    def factory(name: str = "chat.db") -> Storage:
+        return Storage(
+            str(tmp_path / name),
+            durability="relaxed",
+            flush_interval_ms=0,
+            archive_dir=str(tmp_path / f"{name}-archive"),
+        )
+
+    return factory
@@ -0,0 +1,88 @@
+import asyncio
+import datetime
+import os
+
+from app.services.archive import Archiver
+from app.services.message_store import MessageStore, conversation_id
+from tests.conftest import make_message
+
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+CID = conversation_id(ALICE, BOB)
+TODAY = datetime.date(2025, 1, 10)
+DAYS = ["2025-01-01"] * 3 + ["2025-01-02"] * 2 + ["2025-01-09"]
+
+
+def _send_days(store: MessageStore) -> None:
+    for i, day in enumerate(DAYS):
+        store.append(
+            make_message(
+                ALICE,
+                BOB,
+                content=f"message {i}",
+                timestamp=f"{day}T12:00:{i:02d}",
+            )
+        )
+
+
+async def _read_all(storage) -> list[str]:
+    store = MessageStore(storage, hot_tail_size=2)
+    page, _ = await store.page(CID, None, 100)
+    return [m["content"] for m in page]
+
+
+def test_compaction_moves_old_days_into_segments(new_storage):
+    async def scenario():
+        storage = new_storage()
+        _send_days(MessageStore(storage))
+        await storage.flush()
+        archiver = Archiver(storage, after_days=3, retention_days=0)
+        assert await archiver.compact(TODAY) == 2
+        assert sorted(os.listdir(storage.segments.directory)) == [
+            "2025-01-01.seg",
+            "2025-01-02.seg",
+        ]
+        # Only the recent day is left in the database...
+        assert storage.archivable_days("2025-01-10") == ["2025-01-09"]
+        # ...but every position still reads, in order.
+        assert await _read_all(storage) == [
+            f"message {i}" for i in range(6)
+        ]
+        rows = storage.load_conversation_range(CID, 1, 4)
+        assert [m["content"] for m in rows] == [
+            "message 1",
+            "message 2",
+            "message 3",
+        ]
+        assert await archiver.compact(TODAY) == 0
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_purge_deletes_expired_segments_but_keeps_positions(
+    new_storage,
+):
+    async def scenario():
+        storage = new_storage()
+        _send_days(MessageStore(storage))
+        await storage.flush()
+        await Archiver(storage, after_days=3, retention_days=0).compact(
+            TODAY
+        )
+        archiver = Archiver(storage, after_days=3, retention_days=8)
+        # Only 2025-01-01 is older than 2025-01-02.
+        assert await archiver.purge(TODAY) == 1
+        assert os.listdir(storage.segments.directory) == [
+            "2025-01-02.seg"
+        ]
+        assert await archiver.purge(TODAY) == 0
+        store = MessageStore(storage, hot_tail_size=2)
+        assert store.conversation_length(CID) == 6
+        assert store.first_position(CID) == 3
+        assert await _read_all(storage) == [
+            f"message {i}" for i in range(3, 6)
+        ]
+        await storage.close()
+
+    asyncio.run(scenario())
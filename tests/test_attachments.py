@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from app.services.attachments import (
+    AttachmentStore,
+    QuotaExceededError,
+    parse_byte_range,
+)
+
+
+async def _chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+def _store(tmp_path, storage, quota_bytes: int = 10) -> AttachmentStore:
+    return AttachmentStore(
+        str(tmp_path / "files"),
+        storage,
+        max_file_bytes=100,
+        quota_bytes=quota_bytes,
+        thumbnail_size=64,
+    )
+
+
+def test_upload_is_stored_once_and_readable_by_its_readers(
+    tmp_path, new_storage
+):
+    async def scenario():
+        storage = new_storage()
+        store = _store(tmp_path, storage)
+        attachment = await store.save(
+            "alice@example.com",
+            "text/plain",
+            _chunks(b"hel", b"lo"),
+            readers=("admin@example.com",),
+        )
+        digest = hashlib.sha256(b"hello").hexdigest()
+        assert attachment["digest"] == digest
+        assert store.path(digest).read_bytes() == b"hello"
+        # Flushed before returning, so another worker can serve it.
+        assert storage.load_attachment(digest) == (5, "text/plain")
+        assert storage.can_read_attachment("alice@example.com", digest)
+        assert storage.can_read_attachment("admin@example.com", digest)
+        assert not storage.can_read_attachment("eve@example.com", digest)
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_quota_charges_each_distinct_file_once(tmp_path, new_storage):
+    async def scenario():
+        storage = new_storage()
+        store = _store(tmp_path, storage)
+        await store.save("alice@example.com", "text/plain", _chunks(b"123456"))
+        await store.save("alice@example.com", "text/plain", _chunks(b"123456"))
+        with pytest.raises(QuotaExceededError):
+            await store.save(
+                "alice@example.com", "text/plain", _chunks(b"abcde")
+            )
+        assert not any((tmp_path / "files" / "tmp").iterdir())
+        # Someone else's quota is separate, and the file is shared on disk.
+        await store.save("bob@example.com", "text/plain", _chunks(b"123456"))
+        # Usage survives a restart.
+        restarted = _store(tmp_path, storage)
+        with pytest.raises(QuotaExceededError):
+            await restarted.save(
+                "alice@example.com", "text/plain", _chunks(b"abcde")
+            )
+        await restarted.save(
+            "alice@example.com", "text/plain", _chunks(b"abcd")
+        )
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-3", (0, 3)),
+        ("bytes=4-", (4, 9)),
+        ("bytes=2-100", (2, 9)),
+        ("bytes=-3", (7, 9)),
+        ("bytes=-30", (0, 9)),
+        (" bytes=0-0 ", (0, 0)),
+        ("bytes=10-", None),
+        ("bytes=5-2", None),
+        ("bytes=-", None),
+        ("bytes=0-1,4-5", None),
+        ("items=0-1", None),
+    ],
+)
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 10) == expected
@@ -0,0 +1,149 @@
+import asyncio
+
+from app.services.bus import BusBroker
+from app.services.cluster import Cluster
+from app.services.dedupe import RecentKeys
+from app.services.hub import MessageHub
+from app.services.message_store import MessageStore, conversation_id
+from app.services.search_index import SearchIndex
+from app.services.user_directory import UserDirectory
+from tests.conftest import make_message
+
+ADMIN = "admin@example.com"
+
+
+def _cluster() -> Cluster:
+    return Cluster(
+        MessageStore(None),
+        SearchIndex(None),
+        MessageHub(16),
+        UserDirectory(None),
+        RecentKeys(100, 60),
+    )
+
+
+async def _until(predicate) -> None:
+    for _ in range(200):
+        if predicate():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError("timed out")
+
+
+def _user_owned_by(cluster: Cluster, worker: str) -> str:
+    """Returns a user whose conversation with the admin `worker` owns."""
+    for i in range(100):
+        email = f"user{i}@example.com"
+        if cluster.owner(conversation_id(email, ADMIN)) == worker:
+            return email
+    raise AssertionError(f"no conversation owned by {worker}")
+
+
+async def _start(path: str, *worker_ids: str) -> list[Cluster]:
+    clusters = [_cluster() for _ in worker_ids]
+    for cluster, worker_id in zip(clusters, worker_ids):
+        await cluster.start(path, 4, worker_id=worker_id)
+    await _until(
+        lambda: all(
+            c.ring.nodes == sorted(worker_ids) for c in clusters
+        )
+    )
+    return clusters
+
+
+def test_appends_are_forwarded_to_their_owner(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "bus.sock")
+        broker = asyncio.create_task(
+            BusBroker(path, 4).serve_forever()
+        )
+        await _until((tmp_path / "bus.sock").exists)
+        a, b = await _start(path, "a", "b")
+        assert {a.store.id_offset, b.store.id_offset} == {0, 1}
+        user = _user_owned_by(a, "b")
+        cid = conversation_id(user, ADMIN)
+        assert b.owner(cid) == "b"
+        # Loaded here, so the replicated message is applied to it.
+        assert a.store.conversation_length(cid) == 0
+        inbox = a.hub.subscribe(user)
+        assert a.append(make_message(user, ADMIN)) is None
+        event = await asyncio.wait_for(inbox.get(), 1)
+        assert event["type"] == "message"
+        assert event["conversation_id"] == cid
+        assert event["message"]["id"] % 4 == b.store.id_offset
+        # Appended once by the owner and replicated here.
+        assert b.store.conversation_length(cid) == 1
+        assert a.store.conversation_length(cid) == 1
+        own = _user_owned_by(a, "a")
+        assert b.store.conversation_length(conversation_id(own, ADMIN)) == 0
+        cid, position, _ = a.append(make_message(own, ADMIN))
+        assert position == 0
+        await _until(lambda: b.store.conversation_length(cid) == 1)
+        await a.stop()
+        await b.stop()
+        broker.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_appends_to_a_departed_owner_are_rerouted(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "bus.sock")
+        broker = asyncio.create_task(
+            BusBroker(path, 4).serve_forever()
+        )
+        await _until((tmp_path / "bus.sock").exists)
+        a, b = await _start(path, "a", "b")
+        departed = []
+        a.on_departure(departed.append)
+        user = _user_owned_by(a, "b")
+        cid = conversation_id(user, ADMIN)
+        await b.stop()
+        await _until(lambda: a.ring.nodes == ["a"])
+        assert departed == ["b"]
+        assert a.owner(cid) == "a"
+        # Sent before this worker learnt that b left.
+        a.bus.send(
+            "b",
+            {
+                "type": "append",
+                "message": make_message(user, ADMIN),
+                "client_id": "c1",
+            },
+        )
+        await _until(lambda: a.store.conversation_length(cid) == 1)
+        await a.stop()
+        broker.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_resends_are_recognized_after_an_ownership_change(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "bus.sock")
+        broker = asyncio.create_task(
+            BusBroker(path, 4).serve_forever()
+        )
+        await _until((tmp_path / "bus.sock").exists)
+        a, b = await _start(path, "a", "b")
+        user = _user_owned_by(a, "a")
+        cid = conversation_id(user, ADMIN)
+        assert b.store.conversation_length(cid) == 0
+        sent = a.append(make_message(user, ADMIN), "c1")
+        await _until(lambda: b.store.conversation_length(cid) == 1)
+        broadcast = a.add_broadcast(make_message(ADMIN, "*"), "c2")
+        await _until(lambda: len(b.recent_sends) == 2)
+        # a left, and b now owns the conversation the resend goes to.
+        await a.stop()
+        await _until(lambda: b.ring.nodes == ["b"])
+        inbox = b.hub.subscribe(user)
+        assert b.append(make_message(user, ADMIN), "c1") == sent
+        assert b.store.conversation_length(cid) == 1
+        assert inbox.drain() == []
+        assert (
+            b.add_broadcast(make_message(ADMIN, "*"), "c2") == broadcast
+        )
+        await b.stop()
+        broker.cancel()
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import pytest
+
+from app.services import dedupe
+from app.services.dedupe import RecentKeys
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(dedupe.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_remembers_values_within_the_window(clock):
+    keys = RecentKeys(max_size=10, window_s=60)
+    assert keys.get(("a", "1")) is None
+    keys.add(("a", "1"), "first")
+    clock[0] = 59
+    assert keys.get(("a", "1")) == "first"
+    assert keys.get(("b", "1")) is None
+    clock[0] = 60
+    assert keys.get(("a", "1")) is None
+    assert len(keys) == 0
+
+
+def test_re_adding_restarts_the_window(clock):
+    keys = RecentKeys(max_size=10, window_s=60)
+    keys.add("k", 1)
+    clock[0] = 50
+    keys.add("k", 2)
+    clock[0] = 100
+    assert keys.get("k") == 2
+
+
+def test_evicts_the_oldest_past_the_size_bound(clock):
+    keys = RecentKeys(max_size=2, window_s=60)
+    for i in range(3):
+        keys.add(i, i)
+    assert len(keys) == 2
+    assert keys.get(0) is None
+    assert keys.get(1) == 1
+    assert keys.get(2) == 2
@@ -0,0 +1,54 @@
+import asyncio
+
+from app.services.hub import MessageHub
+
+
+def test_publish_reaches_every_session_of_the_recipient_only():
+    hub = MessageHub(queue_size=10)
+    first, second = hub.subscribe("alice"), hub.subscribe("alice")
+    other = hub.subscribe("bob")
+    hub.publish("alice", {"n": 1})
+    assert first.drain() == [{"n": 1}]
+    assert second.drain() == [{"n": 1}]
+    assert other.drain() == []
+
+
+def test_publish_all_reaches_every_subscriber():
+    hub = MessageHub(queue_size=10)
+    subscriptions = [hub.subscribe(email) for email in ("a", "a", "b")]
+    hub.publish_all({"type": "broadcast"})
+    assert all(
+        s.drain() == [{"type": "broadcast"}] for s in subscriptions
+    )
+
+
+def test_a_full_queue_drops_its_oldest_events():
+    hub = MessageHub(queue_size=2)
+    subscription = hub.subscribe("alice")
+    for n in range(5):
+        hub.publish("alice", {"n": n})
+    assert subscription.dropped == 3
+    assert subscription.drain() == [{"n": 3}, {"n": 4}]
+
+
+def test_closed_subscriptions_stop_receiving():
+    hub = MessageHub(queue_size=10)
+    subscription = hub.subscribe("alice")
+    subscription.close()
+    subscription.close()
+    hub.publish("alice", {"n": 1})
+    assert subscription.drain() == []
+    assert hub._subscribers == {}
+
+
+def test_get_waits_for_the_next_event():
+    async def scenario():
+        hub = MessageHub(queue_size=10)
+        subscription = hub.subscribe("alice")
+        waiter = asyncio.ensure_future(subscription.get())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        hub.publish("alice", {"n": 1})
+        assert await asyncio.wait_for(waiter, 1) == {"n": 1}
+
+    asyncio.run(scenario())
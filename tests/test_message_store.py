@@ -0,0 +1,187 @@
+import asyncio
+
+from app.services.message_store import MessageStore, conversation_id
+from tests.conftest import make_message
+
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+CID = conversation_id(ALICE, BOB)
+
+
+def _send(store: MessageStore, count: int, start: int = 0) -> None:
+    for i in range(start, start + count):
+        sender, receiver = (ALICE, BOB) if i % 2 else (BOB, ALICE)
+        store.append(
+            make_message(
+                sender,
+                receiver,
+                content=f"message {i}",
+                timestamp=f"2025-01-01T00:{i // 60:02d}:{i % 60:02d}",
+            )
+        )
+
+
+def test_append_assigns_ids_in_order_and_keeps_time_monotonic():
+    store = MessageStore(None)
+    first = make_message(ALICE, BOB, timestamp="2025-01-01T10:00:00")
+    late = make_message(BOB, ALICE, timestamp="2025-01-01T09:00:00")
+    assert store.append(first) == CID
+    store.append(late)
+    assert late["id"] > first["id"]
+    assert late["timestamp"] == first["timestamp"]
+    assert store.conversation_length(CID) == 2
+    assert [m["content"] for m in store.conversation(CID)] == [
+        "hello",
+        "hello",
+    ]
+
+
+def test_append_follows_the_id_stride():
+    store = MessageStore(None)
+    store.id_stride, store.id_offset = 4, 3
+    ids = []
+    for _ in range(3):
+        message = make_message(ALICE, BOB)
+        store.append(message)
+        ids.append(message["id"])
+    assert ids == [3, 7, 11]
+
+
+def test_page_without_storage():
+    store = MessageStore(None)
+    _send(store, 10)
+
+    async def scenario():
+        latest, start = await store.page(CID, None, 4)
+        assert start == 6
+        assert [m["content"] for m in latest] == [
+            f"message {i}" for i in range(6, 10)
+        ]
+        older, start = await store.page(CID, 6, 4)
+        assert start == 2
+        assert [m["content"] for m in older] == [
+            f"message {i}" for i in range(2, 6)
+        ]
+        first, start = await store.page(CID, 2, 4)
+        assert start == 0
+        assert len(first) == 2
+
+    asyncio.run(scenario())
+
+
+def test_summary_tracks_the_last_message_and_unread_counts():
+    store = MessageStore(None)
+    store.append(make_message(ALICE, BOB, content="first"))
+    store.append(make_message(BOB, ALICE, content="second"))
+    store.append(make_message(BOB, ALICE, content="third"))
+    summary = store.summary(CID)
+    assert summary["last_message"] == "third"
+    assert summary["last_sender_email"] == BOB
+    assert summary["unread"] == {BOB: 1, ALICE: 2}
+    assert store.summary(conversation_id(ALICE, "x@example.com")) is None
+
+
+def test_partner_page_orders_by_recency_and_unread():
+    store = MessageStore(None)
+    admin = "admin@example.com"
+    for i, user in enumerate(["a", "b", "c"]):
+        for _ in range(i + 1):
+            store.append(make_message(f"{user}@example.com", admin))
+    store.append(make_message("a@example.com", admin))
+    assert store.partner_page(admin, "recent", 0, 10) == (
+        ["a@example.com", "c@example.com", "b@example.com"],
+        3,
+    )
+    assert store.partner_page(admin, "unread", 0, 2) == (
+        ["c@example.com", "a@example.com"],
+        3,
+    )
+    store.mark_read_up_to(
+        conversation_id("c@example.com", admin), admin, 2
+    )
+    assert store.partner_page(admin, "unread", 0, 10)[0] == [
+        "a@example.com",
+        "b@example.com",
+        "c@example.com",
+    ]
+    assert store.partner_page(
+        admin, "recent", 0, 10, {"b@example.com", "x@example.com"}
+    ) == (["b@example.com"], 1)
+    # Filtering by a larger set scans the order instead.
+    among = {f"{user}@example.com" for user in "abcdefgh"} - {
+        "a@example.com"
+    }
+    assert store.partner_page(admin, "recent", 0, 10, among) == (
+        ["c@example.com", "b@example.com"],
+        2,
+    )
+
+
+def test_mark_read_up_to_counts_unread_after_the_cursor():
+    store = MessageStore(None)
+    _send(store, 6)
+    assert store.summary(CID)["unread"][BOB] == 3
+    assert store.mark_read_up_to(CID, BOB, 2)
+    assert store.summary(CID)["unread"][BOB] == 2
+    assert not store.mark_read_up_to(CID, BOB, 1)
+    assert store.mark_read_up_to(CID, BOB, 100)
+    assert store.read_cursor(CID, BOB) == 5
+    assert store.summary(CID)["unread"][BOB] == 0
+
+
+def test_a_cursor_behind_the_tail_counts_from_the_length(new_storage):
+    async def scenario():
+        storage = new_storage()
+        store = MessageStore(storage, hot_tail_size=2)
+        _send(store, 12)
+        # Positions 3..7 are behind the tail and counted as received;
+        # the tail's received messages are counted exactly.
+        assert store.mark_read_up_to(CID, BOB, 2)
+        tail = store.conversation(CID)
+        base = store.conversation_length(CID) - len(tail)
+        tail_received = sum(m["receiver_email"] == BOB for m in tail)
+        assert store.summary(CID)["unread"][BOB] == (
+            base - 3 + tail_received
+        )
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_read_cursors_are_evicted_with_their_conversation():
+    store = MessageStore(None, max_conversations=1)
+    _send(store, 2)
+    store.mark_read_up_to(CID, BOB, 1)
+    store.append(make_message(ALICE, "carol@example.com"))
+    # Cursors are kept on the conversation, so nothing of it is left.
+    assert CID not in store._conversations
+
+
+def test_page_reads_trimmed_positions_from_storage(new_storage):
+    async def scenario():
+        storage = new_storage()
+        store = MessageStore(storage, hot_tail_size=3)
+        _send(store, 20)
+        await storage.flush()
+        # A fresh store sees only what storage has.
+        reloaded = MessageStore(storage, hot_tail_size=3)
+        assert reloaded.conversation_length(CID) == 20
+        end, seen = None, []
+        while end != 0:
+            page, end = await reloaded.page(CID, end, 4)
+            seen = page + seen
+        assert [m["content"] for m in seen] == [
+            f"message {i}" for i in range(20)
+        ]
+        # Appends to the reloaded store continue the sequence.
+        _send(reloaded, 2, start=20)
+        latest, start = await reloaded.page(CID, None, 5)
+        assert start == 17
+        assert [m["content"] for m in latest] == [
+            f"message {i}" for i in range(17, 22)
+        ]
+        ids = [m["id"] for m in seen + latest[3:]]
+        assert ids == sorted(set(ids))
+        await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from app.services import presence as presence_module
+from app.services.cluster import Cluster
+from app.services.dedupe import RecentKeys
+from app.services.hub import MessageHub
+from app.services.message_store import MessageStore
+from app.services.presence import Presence, TimerWheel
+from app.services.search_index import SearchIndex
+from app.services.user_directory import UserDirectory
+
+ALICE = "alice@example.com"
+ADMIN = "admin@example.com"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(
+        presence_module.time, "monotonic", lambda: now[0]
+    )
+    return now
+
+
+def _presence() -> Presence:
+    cluster = Cluster(
+        MessageStore(None),
+        SearchIndex(None),
+        MessageHub(16),
+        UserDirectory(None),
+        RecentKeys(100, 60),
+    )
+    cluster.worker_id = "a"
+    return Presence(cluster, online_timeout_s=30, typing_timeout_s=5)
+
+
+def _remote(kind: str, to: str = "", worker: str = "b") -> dict:
+    return {
+        "type": kind,
+        "email": ALICE,
+        "to": to,
+        "active": True,
+        "worker": worker,
+    }
+
+
+def test_a_departed_worker_takes_its_statuses_with_it():
+    presence = _presence()
+    cluster = presence.cluster
+    presence.watch(ADMIN)
+    watcher = cluster.hub.subscribe(ADMIN)
+    cluster._set_members(["a", "b", "c"])
+    presence._apply_remote(_remote("presence"))
+    presence._apply_remote(_remote("presence", worker="c"))
+    presence._apply_remote(_remote("typing", to=ADMIN))
+    assert presence.is_online(ALICE)
+    assert presence.is_typing(ALICE, ADMIN)
+    assert [event["type"] for event in watcher.drain()] == [
+        "presence",
+        "typing",
+    ]
+    cluster._set_members(["a", "c"])
+    assert not presence.is_typing(ALICE, ADMIN)
+    # Still online through the worker that is left.
+    assert presence.is_online(ALICE)
+    assert watcher.drain() == [
+        {**_remote("typing", to=ADMIN), "active": False}
+    ]
+    cluster._set_members(["a"])
+    assert not presence.is_online(ALICE)
+    assert watcher.drain() == [
+        {**_remote("presence", worker="c"), "active": False}
+    ]
+    assert presence._remote_online == {}
+    assert presence._remote_typing == {}
+
+
+def test_keys_expire_once_their_timeout_passes(clock):
+    wheel = TimerWheel(1.0, 8)
+    assert wheel.touch("a", 3)
+    assert wheel.touch("b", 1)
+    assert not wheel.touch("a", 3)
+    assert "a" in wheel and len(wheel) == 2
+    clock[0] += 1
+    assert wheel.advance() == ["b"]
+    clock[0] += 2
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+    assert wheel.advance() == []
+
+
+def test_touching_pushes_the_deadline_back(clock):
+    wheel = TimerWheel(1.0, 8)
+    wheel.touch("a", 2)
+    clock[0] += 1
+    assert wheel.advance() == []
+    # Left behind in its old slot, where it is skipped.
+    assert not wheel.touch("a", 2)
+    clock[0] += 1
+    assert wheel.advance() == []
+    clock[0] += 1
+    assert wheel.advance() == ["a"]
+
+
+def test_discarded_keys_do_not_expire(clock):
+    wheel = TimerWheel(1.0, 8)
+    wheel.touch("a", 1)
+    assert wheel.discard("a")
+    assert not wheel.discard("a")
+    clock[0] += 1
+    assert wheel.advance() == []
+
+
+def test_timeouts_are_capped_and_long_gaps_visit_every_slot(clock):
+    wheel = TimerWheel(1.0, 4)
+    wheel.touch("long", 100)
+    wheel.touch("short", 0.1)
+    clock[0] += 1
+    assert wheel.advance() == ["short"]
+    # Past a full turn of the wheel, every key due is still found.
+    clock[0] += 50
+    assert wheel.advance() == ["long"]
+
+
+def test_heartbeats_expire_into_an_offline_event(clock):
+    async def scenario():
+        presence = _presence()
+        presence.watch(ADMIN)
+        watcher = presence.cluster.hub.subscribe(ADMIN)
+        presence.heartbeat(ALICE)
+        clock[0] += 29
+        presence._tick()
+        presence.heartbeat(ALICE)
+        assert [e["active"] for e in watcher.drain()] == [True]
+        clock[0] += 30
+        presence._tick()
+        assert not presence.is_online(ALICE)
+        assert [e["active"] for e in watcher.drain()] == [False]
+        assert presence._tick_handle is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import pytest
+
+from app.services import rate_limit
+from app.services.rate_limit import SendLimiter
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def _limiter(**limits) -> SendLimiter:
+    defaults = dict(
+        user_rate=1,
+        user_burst=3,
+        session_rate=1,
+        session_burst=2,
+        global_rate=100,
+        global_burst=100,
+        max_in_flight=10,
+    )
+    return SendLimiter(**{**defaults, **limits})
+
+
+def _send(limiter: SendLimiter, email: str, session: str) -> str | None:
+    reason = limiter.acquire(email, session)
+    if reason is None:
+        limiter.release(email)
+    return reason
+
+
+def test_session_then_user_bursts(clock):
+    limiter = _limiter()
+    assert _send(limiter, "a", "s1") is None
+    assert _send(limiter, "a", "s1") is None
+    assert _send(limiter, "a", "s1") == "session"
+    # Another session of the same user has its own bucket, not the user's.
+    assert _send(limiter, "a", "s2") is None
+    assert _send(limiter, "a", "s2") == "user"
+    # Other users are unaffected.
+    assert _send(limiter, "b", "s3") is None
+
+
+def test_tokens_refill_over_time(clock):
+    limiter = _limiter()
+    for _ in range(2):
+        assert _send(limiter, "a", "s") is None
+    assert _send(limiter, "a", "s") == "session"
+    clock.now += 1
+    assert _send(limiter, "a", "s") is None
+    assert _send(limiter, "a", "s") == "session"
+
+
+def test_a_rejected_send_consumes_no_tokens(clock):
+    limiter = _limiter(user_burst=1, session_burst=5)
+    assert _send(limiter, "a", "s") is None
+    for _ in range(5):
+        assert _send(limiter, "a", "s") == "user"
+    clock.now += 1
+    # The session bucket was not drained by the rejected sends.
+    assert _send(limiter, "a", "s") is None
+
+
+def test_global_limit(clock):
+    limiter = _limiter(global_burst=2)
+    assert _send(limiter, "a", "s1") is None
+    assert _send(limiter, "b", "s2") is None
+    assert _send(limiter, "c", "s3") == "global"
+
+
+def test_in_flight_limit_until_released(clock):
+    limiter = _limiter(max_in_flight=1, session_burst=10, user_burst=10)
+    assert limiter.acquire("a", "s") is None
+    assert limiter.acquire("a", "s") == "in_flight"
+    limiter.release("a")
+    assert limiter.acquire("a", "s") is None
+    limiter.release("a")
@@ -0,0 +1,77 @@
+import asyncio
+
+from app.services.cluster import Cluster
+from app.services.dedupe import RecentKeys
+from app.services.hub import MessageHub
+from app.services.message_store import MessageStore, conversation_id
+from app.services.read_receipts import ReadReceiptBatcher
+from app.services.search_index import SearchIndex
+from app.services.user_directory import UserDirectory
+from tests.conftest import make_message
+
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+CID = conversation_id(ALICE, BOB)
+
+
+def _cluster(store: MessageStore) -> Cluster:
+    return Cluster(
+        store,
+        SearchIndex(None),
+        MessageHub(100),
+        UserDirectory(None),
+        RecentKeys(100, 60),
+    )
+
+
+def _send(store: MessageStore, count: int) -> None:
+    for i in range(count):
+        sender, receiver = (ALICE, BOB) if i % 2 else (BOB, ALICE)
+        store.append(make_message(sender, receiver, f"m{i}"))
+
+
+def test_moves_in_one_window_become_one_receipt():
+    async def scenario():
+        store = MessageStore(None)
+        cluster = _cluster(store)
+        _send(store, 6)
+        alice = cluster.hub.subscribe(ALICE)
+        bob = cluster.hub.subscribe(BOB)
+        batcher = ReadReceiptBatcher(store, cluster, debounce_ms=10)
+        for position in (1, 3, 2):
+            batcher.mark_read(CID, ALICE, position)
+        await asyncio.sleep(0.05)
+        receipt = {
+            "type": "receipt",
+            "conversation_id": CID,
+            "reader": ALICE,
+            "position": 3,
+        }
+        assert alice.drain() == [receipt]
+        assert bob.drain() == [receipt]
+        assert store.read_cursor(CID, ALICE) == 3
+        # A move that does not advance the cursor sends nothing.
+        batcher.mark_read(CID, ALICE, 2)
+        await asyncio.sleep(0.05)
+        assert alice.drain() == []
+
+    asyncio.run(scenario())
+
+
+def test_flush_loads_read_state_from_storage(new_storage):
+    async def scenario():
+        storage = new_storage()
+        store = MessageStore(storage, hot_tail_size=2)
+        _send(store, 10)
+        store.mark_read_up_to(CID, ALICE, 2)
+        await storage.flush()
+        reloaded = MessageStore(storage, hot_tail_size=2)
+        batcher = ReadReceiptBatcher(reloaded, _cluster(reloaded), 0)
+        batcher.mark_read(CID, ALICE, 1)
+        batcher.mark_read(CID, BOB, 4)
+        await batcher.flush()
+        assert reloaded.read_cursor(CID, ALICE) == 2
+        assert reloaded.read_cursor(CID, BOB) == 4
+        await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,132 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.services.search_index import SearchIndex, to_epoch
+from tests.conftest import make_message
+
+
+def _index(messages: list[tuple[int, str, str]]) -> SearchIndex:
+    index = SearchIndex(None)
+    for message_id, sender, timestamp in messages:
+        message = make_message(
+            sender,
+            "admin@example.com",
+            content="order shipped",
+            timestamp=timestamp,
+            message_id=message_id,
+        )
+        index.add(message)
+    return index
+
+
+def _day(day: str, end: bool = False) -> float:
+    return to_epoch(f"2025-01-{day}T{'23:59:59' if end else '00:00:00'}")
+
+
+# Ids interleave with time, as they do across workers and after imports.
+MESSAGES = [
+    (10, "a@example.com", "2025-01-01T08:00:00"),
+    (2, "b@example.com", "2025-01-02T08:00:00"),
+    (7, "a@example.com", "2025-01-03T08:00:00"),
+    (1, "b@example.com", "2025-01-04T08:00:00"),
+    (5, "a@example.com", "2025-01-05T08:00:00"),
+]
+
+
+def test_date_range_is_by_send_time_not_id():
+    index = _index(MESSAGES)
+    assert index.search(
+        "shipped", since=_day("02"), until=_day("03", True)
+    ) == [7, 2]
+    assert index.search("order", since=_day("04")) == [5, 1]
+    assert index.search("order", until=_day("01", True)) == [10]
+    assert index.search("order", since=_day("06")) == []
+
+
+def test_date_range_when_the_range_is_larger_than_the_matches():
+    messages = MESSAGES + [
+        (100 + i, "c@example.com", "2025-01-03T09:00:00")
+        for i in range(20)
+    ]
+    index = _index(messages)
+    # The sender's postings (3 ids) drive the search; the range holds 22.
+    assert index.search(
+        "",
+        sender="a@example.com",
+        since=_day("02"),
+        until=_day("05", True),
+    ) == [7, 5]
+
+
+def test_filters_combine_and_limit_newest_first():
+    index = _index(MESSAGES)
+    assert index.search("order", sender="b@example.com") == [2, 1]
+    assert index.search("order", limit=2) == [10, 7]
+    assert index.search("missing") == []
+    assert index.search("") == []
+
+
+def test_persisted_postings_are_loaded_on_first_search(new_storage):
+    async def scenario():
+        storage = new_storage()
+        previous = SearchIndex(storage)
+        for message_id, sender, timestamp in MESSAGES:
+            message = make_message(
+                sender,
+                "admin@example.com",
+                content="order shipped",
+                timestamp=timestamp,
+                message_id=message_id,
+            )
+            storage.save_message("a|b", message)
+            previous.add(message)
+        # Sent by an earlier process, and by this one before the load.
+        earlier = make_message(
+            "a@example.com",
+            "admin@example.com",
+            content="refund",
+            message_id=20,
+        )
+        storage.save_message("a|b", earlier)
+        previous.add(earlier)
+        index = SearchIndex(storage)
+        recent = make_message(
+            "b@example.com",
+            "admin@example.com",
+            content="refund please",
+            timestamp="2025-01-06T00:00:00",
+            message_id=21,
+        )
+        storage.save_message("a|b", recent)
+        index.add(recent)
+        await index.ensure_loaded()
+        assert index.search("refund") == [21, 20]
+        assert index.search("order", since=_day("04")) == [5, 1]
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_failed_load_is_retried(new_storage, monkeypatch):
+    async def scenario():
+        storage = new_storage()
+        index = SearchIndex(storage)
+        load = index._load
+        calls = []
+
+        def failing_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("disk I/O error")
+            load()
+
+        monkeypatch.setattr(index, "_load", failing_once)
+        with pytest.raises(sqlite3.OperationalError):
+            await index.ensure_loaded()
+        await index.ensure_loaded()
+        assert len(calls) == 2
+        await storage.close()
+
+    asyncio.run(scenario())
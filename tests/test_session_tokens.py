@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import pytest
+
+jwt = pytest.importorskip("jose.jwt")
+
+from app.services import session_tokens as session_tokens_module  # noqa: E402
+from app.services.session_tokens import ALGORITHM, SessionTokens  # noqa: E402
+
+SECRET = "test-secret"
+
+
+class FakeCluster:
+    def __init__(self) -> None:
+        self.handlers = {}
+        self.replicated = []
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def replicate(self, event):
+        self.replicated.append(event)
+
+
+def _tokens(storage=None, cluster=None, secret=SECRET, ttl_s=60):
+    return SessionTokens(
+        secret,
+        ttl_s=ttl_s,
+        cache_size=10,
+        storage=storage,
+        cluster=cluster or FakeCluster(),
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # jose checks expiry against the real clock, so start from it.
+    now = [time.time()]
+    monkeypatch.setattr(
+        session_tokens_module.time, "time", lambda: now[0]
+    )
+    return now
+
+
+def test_issued_tokens_verify(clock):
+    tokens = _tokens()
+    token = tokens.issue("alice@example.com")
+    assert tokens.verify(token) == "alice@example.com"
+    # Served from the cache the second time.
+    assert tokens.verify(token) == "alice@example.com"
+
+
+def test_expired_tokens_are_rejected(clock):
+    tokens = _tokens()
+    token = tokens.issue("alice@example.com")
+    assert tokens.verify(token) == "alice@example.com"
+    clock[0] += 61
+    # The cached verification expires with the token.
+    assert tokens.verify(token) is None
+
+
+def test_expired_tokens_are_rejected_without_the_cache():
+    tokens = _tokens(ttl_s=-1)
+    assert tokens.verify(tokens.issue("alice@example.com")) is None
+
+
+def test_tampered_tokens_are_rejected(clock):
+    tokens = _tokens()
+    token = tokens.issue("alice@example.com")
+    header, payload, signature = token.split(".")
+    forged_payload = jwt.encode(
+        {"sub": "admin@example.com", "exp": clock[0] + 60},
+        SECRET,
+        algorithm=ALGORITHM,
+    ).split(".")[1]
+    assert tokens.verify(f"{header}.{forged_payload}.{signature}") is None
+    assert tokens.verify(f"{header}.{payload}.{signature[::-1]}") is None
+    other = _tokens(secret="other-secret")
+    assert other.verify(token) is None
+    unsigned = jwt.encode(
+        {"sub": "admin@example.com", "exp": clock[0] + 60},
+        "",
+        algorithm=ALGORITHM,
+    )
+    assert tokens.verify(unsigned) is None
+    assert tokens.verify("not a token") is None
+
+
+def test_revoked_tokens_are_rejected_everywhere(clock, new_storage):
+    async def scenario():
+        storage = new_storage()
+        cluster = FakeCluster()
+        tokens = _tokens(storage, cluster)
+        token = tokens.issue("alice@example.com")
+        other_device = tokens.issue("alice@example.com")
+        assert tokens.verify(token) == "alice@example.com"
+        tokens.revoke(token)
+        assert tokens.verify(token) is None
+        assert tokens.verify(other_device) == "alice@example.com"
+        tokens.revoke("not a token")
+        # Another worker applies the replicated revocation.
+        [event] = cluster.replicated
+        peer_cluster = FakeCluster()
+        peer = _tokens(storage, peer_cluster)
+        assert peer.verify(token) == "alice@example.com"
+        peer_cluster.handlers["revoke"](event)
+        assert peer.verify(token) is None
+        # A restarted worker loads it from storage.
+        await storage.flush()
+        restarted = _tokens(storage)
+        await restarted.load()
+        assert restarted.verify(token) is None
+        assert restarted.verify(other_device) == "alice@example.com"
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_revocations_are_forgotten(clock, new_storage):
+    async def scenario():
+        storage = new_storage()
+        tokens = _tokens(storage)
+        tokens.revoke(tokens.issue("alice@example.com"))
+        await storage.flush()
+        clock[0] += 61
+        tokens._add_revoked("later", clock[0] + 60)
+        assert tokens._revoked == {"later"}
+        restarted = _tokens(storage)
+        await restarted.load()
+        assert not restarted._revoked
+        await storage.flush()
+        assert storage.load_revoked_sessions(0) == []
+        await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,155 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.services import storage as storage_module
+from app.services.storage import MIGRATIONS, StorageWriteError
+from app.services.message_store import conversation_id
+from app.services.metrics import metrics
+from tests.conftest import make_message
+
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+CID = conversation_id(ALICE, BOB)
+
+
+def _failures() -> float:
+    return metrics._counters[("storage_write_failures_total", ())]
+
+
+def test_a_failing_write_is_dropped_alone(new_storage):
+    async def scenario():
+        storage = new_storage()
+        before = _failures()
+        for message_id in (1, 2, 2, 3):
+            storage.save_message(
+                CID,
+                make_message(
+                    ALICE, BOB, f"id {message_id}", message_id=message_id
+                ),
+            )
+        with pytest.raises(StorageWriteError, match="1 queued writes"):
+            await storage.flush()
+        # Reported once; later flushes only report later drops.
+        await storage.flush()
+        messages = storage.load_conversation(CID)
+        assert [m["id"] for m in messages] == [1, 2, 3]
+        # The duplicate did not count towards the conversation's length.
+        assert storage.load_conversation_tail(CID, 10)[1] == 3
+        assert _failures() == before + 1
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_busy_batch_is_retried(new_storage, monkeypatch):
+    monkeypatch.setattr(storage_module, "WRITE_RETRY_DELAY_S", 0)
+
+    async def scenario():
+        storage = new_storage()
+        commit = storage._commit_batch
+        attempts = []
+
+        def busy_once(batch):
+            attempts.append(len(batch))
+            if len(attempts) == 1:
+                error = sqlite3.OperationalError("database is locked")
+                error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+                raise error
+            return commit(batch)
+
+        monkeypatch.setattr(storage, "_commit_batch", busy_once)
+        storage.save_message(CID, make_message(ALICE, BOB, message_id=1))
+        await storage.flush()
+        assert len(attempts) == 2
+        assert [m["id"] for m in storage.load_conversation(CID)] == [1]
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_reads_by_position_match_the_stored_order(new_storage):
+    async def scenario():
+        storage = new_storage()
+        for message_id in range(1, 11):
+            storage.save_message(
+                CID, make_message(ALICE, BOB, message_id=message_id * 3)
+            )
+        await storage.flush()
+        by_offset = storage.load_conversation_range(CID, 2, 6)
+        # The id at position 6, the end of the range.
+        by_id = storage.load_conversation_range(CID, 2, 6, end_id=21)
+        assert [m["id"] for m in by_offset] == [9, 12, 15, 18]
+        assert by_id == by_offset
+        assert storage.message_id_at(CID, 0) == 3
+        assert storage.message_id_at(CID, 10) is None
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_write_that_raises_anything_does_not_stop_the_writer(
+    new_storage,
+):
+    def broken(conn):
+        raise ValueError("not a database error")
+
+    async def scenario():
+        storage = new_storage()
+        storage._enqueue(broken, ())
+        storage.save_message(CID, make_message(ALICE, BOB, message_id=1))
+        with pytest.raises(StorageWriteError):
+            await storage.flush()
+        storage.save_message(CID, make_message(ALICE, BOB, message_id=2))
+        await storage.flush()
+        assert [m["id"] for m in storage.load_conversation(CID)] == [1, 2]
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_an_old_database_is_migrated_once(new_storage, tmp_path):
+    path = tmp_path / "chat.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            sender_email TEXT NOT NULL,
+            receiver_email TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            is_read INTEGER NOT NULL DEFAULT 0,
+            file_url TEXT
+        );
+        CREATE INDEX idx_messages_conversation_timestamp
+            ON messages (conversation_id, timestamp);
+        """
+    )
+    conn.executemany(
+        "INSERT INTO messages (conversation_id, sender_email,"
+        " receiver_email, content, timestamp) VALUES (?, ?, ?, 'hi', ?)",
+        [(CID, ALICE, BOB, f"2025-01-01T00:00:0{i}") for i in range(3)],
+    )
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        storage = new_storage()
+        assert storage.load_conversation_tail(CID, 10)[1] == 3
+        version, indexes = (
+            storage.reader.execute("PRAGMA user_version").fetchone()[0],
+            {
+                row[0]
+                for row in storage.reader.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index'"
+                )
+            },
+        )
+        assert version == len(MIGRATIONS)
+        assert "idx_messages_conversation_timestamp" not in indexes
+        await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services import transfer
+from app.services.message_store import MessageStore, conversation_id
+from app.services.transfer import export_messages, import_records
+from tests.conftest import make_message
+
+ADMIN = "admin@example.com"
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+
+
+async def _fill(storage, sends, read_up_to=()):
+    store = MessageStore(storage)
+    for sender, receiver, content, timestamp in sends:
+        store.append(
+            make_message(sender, receiver, content, f"2025-01-{timestamp}")
+        )
+    for cid, email, position in read_up_to:
+        store.mark_read_up_to(cid, email, position)
+    await storage.flush()
+
+
+def _contents(storage, cid):
+    return [m["content"] for m in storage.load_conversation(cid)]
+
+
+def test_round_trip_into_a_non_empty_database(new_storage):
+    alice_cid = conversation_id(ALICE, ADMIN)
+    bob_cid = conversation_id(BOB, ADMIN)
+
+    async def scenario():
+        source, target = new_storage("source.db"), new_storage("target.db")
+        await _fill(
+            source,
+            [
+                (ALICE, ADMIN, "hi", "02T10:00:00"),
+                (ADMIN, ALICE, "hello", "02T10:01:00"),
+                (ALICE, ADMIN, "order?", "02T10:02:00"),
+                (BOB, ADMIN, "refund", "02T11:00:00"),
+            ],
+            # The admin read Alice's first message only.
+            read_up_to=[(alice_cid, ADMIN, 0)],
+        )
+        # The target's ids 1..3 collide with the exported ones.
+        await _fill(
+            target,
+            [
+                (ALICE, ADMIN, "earlier", "01T09:00:00"),
+                (ADMIN, ALICE, "reply", "01T09:01:00"),
+                (BOB, ADMIN, "old", "01T09:00:00"),
+            ],
+        )
+        exported = list(export_messages(source))
+        counts = import_records(target, "".join(exported).splitlines())
+        assert counts["messages"] == 4
+        assert counts["duplicates"] == 0
+
+        assert _contents(target, alice_cid) == [
+            "earlier",
+            "reply",
+            "hi",
+            "hello",
+            "order?",
+        ]
+        assert _contents(target, bob_cid) == ["old", "refund"]
+        ids = [
+            m["id"]
+            for cid in (alice_cid, bob_cid)
+            for m in target.load_conversation(cid)
+        ]
+        assert len(ids) == len(set(ids))
+        # Read state travels as the receiver's cursor.
+        assert target.load_read_cursors(alice_cid)[ADMIN] == 2
+        summaries = dict(target.load_summaries())
+        assert summaries[alice_cid]["unread"][ADMIN] == 1
+        assert summaries[bob_cid]["unread"][ADMIN] == 2
+
+        again = import_records(target, "".join(exported).splitlines())
+        assert again["messages"] == 0
+        assert again["duplicates"] == 4
+        await source.close()
+        await target.close()
+
+    asyncio.run(scenario())
+
+
+def test_messages_before_a_conversations_last_one_are_skipped(new_storage):
+    async def scenario():
+        target = new_storage()
+        await _fill(target, [(ALICE, ADMIN, "latest", "05T00:00:00")])
+        record = (
+            '{"sender_email": "alice@example.com",'
+            ' "receiver_email": "admin@example.com",'
+            ' "content": "stale", "timestamp": "2025-01-01T00:00:00"}'
+        )
+        counts = import_records(target, [record])
+        assert counts["messages"] == 0
+        assert counts["out_of_order"] == 1
+        await target.close()
+
+    asyncio.run(scenario())
+
+
+def test_read_state_is_exported_with_few_cursors_held(
+    new_storage, monkeypatch
+):
+    monkeypatch.setattr(transfer, "EXPORT_CURSOR_CACHE_SIZE", 1)
+    alice_cid = conversation_id(ALICE, ADMIN)
+    bob_cid = conversation_id(BOB, ADMIN)
+
+    async def scenario():
+        storage = new_storage()
+        await _fill(
+            storage,
+            [
+                (ALICE, ADMIN, "a0", "02T10:00:00"),
+                (BOB, ADMIN, "b0", "02T10:01:00"),
+                (ALICE, ADMIN, "a1", "02T10:02:00"),
+                (BOB, ADMIN, "b1", "02T10:03:00"),
+                (ALICE, ADMIN, "a2", "02T10:04:00"),
+            ],
+            read_up_to=[(alice_cid, ADMIN, 1), (bob_cid, ADMIN, 0)],
+        )
+        conn = storage._connect()
+        assert conn.execute(
+            "SELECT COUNT(*) FROM read_cursors WHERE message_id IS NULL"
+        ).fetchone() == (0,)
+        # A cursor saved before cursors carried their message id.
+        conn.execute(
+            "UPDATE read_cursors SET message_id = NULL"
+            " WHERE conversation_id = ?",
+            (bob_cid,),
+        )
+        conn.close()
+        rows = [
+            json.loads(line)
+            for line in "".join(export_messages(storage)).splitlines()
+        ]
+        assert [(m["content"], m["is_read"]) for m in rows] == [
+            ("a0", True),
+            ("b0", True),
+            ("a1", True),
+            ("b1", False),
+            ("a2", False),
+        ]
+        with pytest.raises(ValueError):
+            export_messages(storage, partner=ALICE)
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_existing_users_are_not_replaced(new_storage):
+    async def scenario():
+        storage = new_storage()
+        storage.save_user(
+            ALICE,
+            {"password": "current", "name": "Alice", "profile_photo": ""},
+        )
+        await storage.flush()
+        records = [
+            json.dumps(
+                {
+                    "email": email,
+                    "password": "imported",
+                    "name": "Imported",
+                    "profile_photo": "",
+                }
+            )
+            for email in (ALICE, BOB)
+        ]
+        counts = import_records(storage, records)
+        assert counts["users"] == 1
+        assert counts["existing_users"] == 1
+        assert storage.load_user(ALICE)["password"] == "current"
+        assert storage.load_user(BOB)["password"] == "imported"
+        await storage.close()
+
+    asyncio.run(scenario())
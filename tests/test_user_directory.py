@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.models import User
+from app.services.user_directory import UserDirectory
+
+
+def _user(name: str) -> User:
+    return User(password="hash", name=name, profile_photo="")
+
+
+def _directory() -> UserDirectory:
+    directory = UserDirectory(None)
+    for email, name in [
+        ("bob@example.com", "Bob Smith"),
+        ("alice@example.com", "Alice Bobson"),
+        ("carl@example.com", "Carl Jones"),
+        ("dana@example.com", "Dana Smithers"),
+    ]:
+        directory.add(email, _user(name))
+    return directory
+
+
+def test_empty_query_pages_through_every_listed_user():
+    directory = _directory()
+    directory.add_seed("admin@example.com", _user("Admin"))
+    assert directory.search("", 0, 3) == (
+        ["alice@example.com", "bob@example.com", "carl@example.com"],
+        4,
+    )
+    assert directory.search("  ", 3, 3) == (["dana@example.com"], 4)
+    assert directory.get("admin@example.com")["name"] == "Admin"
+
+
+def test_prefix_matches_email_and_name_words_once_each():
+    directory = _directory()
+    assert directory.search("bob", 0, 10) == (
+        ["alice@example.com", "bob@example.com"],
+        2,
+    )
+    assert directory.search("SMITH", 0, 10) == (
+        ["bob@example.com", "dana@example.com"],
+        2,
+    )
+    assert directory.search("smith", 1, 1) == (["dana@example.com"], 2)
+    assert directory.search("zed", 0, 10) == ([], 0)
+
+
+def test_new_users_show_up_in_cached_queries():
+    directory = _directory()
+    assert directory.search("car", 0, 10)[1] == 1
+    version = directory.version
+    directory.add("cara@example.com", _user("Cara"))
+    assert directory.version > version
+    assert directory.search("car", 0, 10) == (
+        ["cara@example.com", "carl@example.com"],
+        2,
+    )
+
+
+def test_duplicate_emails_are_rejected():
+    directory = _directory()
+    with pytest.raises(ValueError):
+        directory.add("bob@example.com", _user("Other Bob"))
+    directory.add_replicated("bob@example.com", _user("Other Bob"))
+    assert directory.get("bob@example.com")["name"] == "Bob Smith"
+
+
+def test_users_are_loaded_from_storage(new_storage):
+    async def scenario():
+        storage = new_storage()
+        UserDirectory(storage).add("erin@example.com", _user("Erin Oak"))
+        await storage.flush()
+        reloaded = UserDirectory(storage)
+        assert reloaded.search("oak", 0, 10) == (["erin@example.com"], 1)
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_racing_sign_ups_keep_the_first_stored_user(new_storage):
+    async def scenario():
+        storage = new_storage()
+        here, there = UserDirectory(storage), UserDirectory(storage)
+        assert here.get("erin@example.com") is None
+        assert there.get("erin@example.com") is None
+        first = User(password="first", name="Erin Oak", profile_photo="")
+        second = User(password="second", name="Erin Elm", profile_photo="")
+        results = await asyncio.gather(
+            here.register("erin@example.com", first),
+            there.register("erin@example.com", second),
+            return_exceptions=True,
+        )
+        assert results[0] is None
+        assert isinstance(results[1], ValueError)
+        assert there.get("erin@example.com") == first
+        assert there.search("elm", 0, 10) == ([], 0)
+        assert there.search("oak", 0, 10) == (["erin@example.com"], 1)
+        assert storage.load_user("erin@example.com") == first
+        await storage.close()
+
+    asyncio.run(scenario())